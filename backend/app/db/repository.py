@@ -6,10 +6,11 @@ import psycopg
 import psycopg.rows
 import json
 import os
+import sys
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
 from psycopg.sql import SQL
-from ..models import ClassOption, Schedule, Subject
+from ..models import ClassOption, ClassOptionRecord, ClassSlot, Schedule, Subject
 
 # Define la ruta base del proyecto (la carpeta 'backend')
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -32,7 +33,7 @@ def get_db_connection():
     return psycopg.connect(DATABASE_URL)
 
 
-def _get_option_combinations(class_options: List[ClassOption]) -> List[List[ClassOption]]:
+def _get_option_combinations(class_options: List[ClassOptionRecord]) -> List[List[ClassOptionRecord]]:
     """
     Agrupa las opciones de clase por grupo y nombre de materia, y genera combinaciones válidas.
     Una combinación puede ser una clase 'Teorico-practico' o un par 'Teórico' y 'Laboratorio'.
@@ -40,7 +41,7 @@ def _get_option_combinations(class_options: List[ClassOption]) -> List[List[Clas
 
     # Se agrupa por una tupla de (group_id, subject_name) para diferenciar
     # materias con el mismo código pero diferente nombre (ej. las Éticas).
-    options_by_group: Dict[tuple[int, str], List[ClassOption]] = {}
+    options_by_group: Dict[tuple[int, str], List[ClassOptionRecord]] = {}
 
     for option in class_options:
         # Usamos una clave compuesta para la agrupación.
@@ -48,7 +49,7 @@ def _get_option_combinations(class_options: List[ClassOption]) -> List[List[Clas
         options_by_group.setdefault(group_key, []).append(option)
 
 
-    combinations: List[List[ClassOption]] = []
+    combinations: List[List[ClassOptionRecord]] = []
 
     for group_options in options_by_group.values():
         teoricas = [opt for opt in group_options if opt.type == 'Teórico']
@@ -67,10 +68,14 @@ def _get_option_combinations(class_options: List[ClassOption]) -> List[List[Clas
     return combinations
 
 
-def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> List[List[List[ClassOption]]]:
+def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> List[List[List[ClassOptionRecord]]]:
     """
     Obtiene todas las combinaciones de clases posibles para una lista de materias,
     filtrando por código y nombre de curso específico.
+
+    Las opciones son `ClassOptionRecord` (sin validación de pydantic) con las
+    cadenas repetidas internadas: días, horas, profesores y campus se repiten
+    en cientos de filas. Pasan a `ClassOption` solo las que se devuelven.
     """
     if not subjects_payload:
         return []
@@ -122,8 +127,9 @@ def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> Lis
     cursor.close()
     conn.close()
 
-    all_options_by_subject: Dict[tuple[str, str], List[ClassOption]] = {}
-    class_options_dict: Dict[str, ClassOption] = {}
+    all_options_by_subject: Dict[tuple[str, str], List[ClassOptionRecord]] = {}
+    class_options_dict: Dict[str, ClassOptionRecord] = {}
+    intern = sys.intern
 
     for row in rows:
         (
@@ -138,20 +144,20 @@ def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> Lis
             all_options_by_subject[subject_key] = []
 
         if nrc not in class_options_dict:
-            new_option = ClassOption(
-                subjectName=name,
-                subjectCode=code,
-                type=tipo,
+            new_option = ClassOptionRecord(
+                subject_name=intern(name),
+                subject_code=intern(code),
+                type=intern(tipo),
                 schedules=[],
-                professor=profesor or "Por Asignar",
+                professor=intern(profesor or "Por Asignar"),
                 nrc=nrc,
-                groupId=group_id,
+                group_id=group_id,
                 # Creditos es NUMERIC en la base (créditos fraccionarios) y psycopg
                 # lo devuelve como Decimal, que no se puede sumar con floats.
                 credits=float(credits),
-                campus=campus,
-                seatsAvailable=cupos_disponibles,
-                seatsMaximum=cupos_totales
+                campus=intern(campus),
+                seats_available=cupos_disponibles,
+                seats_maximum=cupos_totales,
             )
             class_options_dict[nrc] = new_option
             all_options_by_subject[subject_key].append(new_option)
@@ -160,10 +166,10 @@ def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> Lis
             hora_inicio_str = hora_inicio.strftime("%H:%M")
             hora_final_str = hora_final.strftime("%H:%M")
             class_options_dict[nrc].schedules.append(
-                Schedule(day=dia, time=f"{hora_inicio_str} - {hora_final_str}")
+                ClassSlot(intern(dia), intern(f"{hora_inicio_str} - {hora_final_str}"))
             )
 
-    combinations_per_subject: List[List[List[ClassOption]]] = []
+    combinations_per_subject: List[List[List[ClassOptionRecord]]] = []
     for subject_key in all_options_by_subject:
         subject_options = all_options_by_subject.get(subject_key, [])
         if subject_options:
@@ -174,6 +180,27 @@ def get_combinations_for_subjects(subjects_payload: List[Dict[str, str]]) -> Lis
     return combinations_per_subject
 
 
+def get_offer_version() -> int:
+    """
+    Versión actual de la oferta académica (la sube el ETL al reemplazarla).
+
+    Es parte de la llave del caché de horarios (`services/schedule_cache.py`).
+    0 si la tabla o la fila aún no existen (la crea la migración del ETL).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT version FROM oferta_version WHERE id = 1")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    except psycopg.errors.UndefinedTable:
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def get_subject_by_code(subject_code: str, subject_name: str) -> Subject | None:
     """
     Obtiene los detalles completos de una materia específica desde la base de datos,
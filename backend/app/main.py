@@ -1,21 +1,31 @@
 # main.py
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import Response
-from typing import List, Dict, Any 
+from starlette.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple, Union
+import itertools
+import json
 import os
 
 # Importa módulos y modelos. El '.' indica que son del mismo paquete 'app'
 from .models import (
     GenerateScheduleRequest,
     GenerateScheduleResponse,
+    NormalizedScheduleResponse,
+    CompactSchedule,
+    ScheduleAlternative,
     ScheduleDiagnosis,
     ClassOption,
+    ClassOptionRecord,
+    ClassSlot,
     CustomCourseInput,
 )
 from .db import repository
 from .services import schedule_generator
 from .services import schedule_diagnostics
+from .services.schedule_cache import OfferVersion, generation_cache, request_key
+from .services.schedule_store import decode_cursor, encode_cursor, schedule_store
 from .routes import subject_routes
 from .routes import favorite_routes
 from .routes import custom_course_routes
@@ -54,6 +64,31 @@ app.add_middleware(
 # N para el criterio actual. Configurable por env; 0 o negativo = sin límite.
 _MAX_SCHEDULES = int(os.getenv("MAX_SCHEDULES", "500"))
 
+# Procesos para la búsqueda completa de una petición grande (ver
+# `schedule_generator._parallel_leaves`). 1 = todo en el hilo de la petición;
+# en la VM de 4 núcleos se usa 4. El top-N móvil siempre es secuencial.
+_SEARCH_WORKERS = int(os.getenv("SCHEDULE_WORKERS", "1"))
+
+# Serializa un horario directo a JSON (con los alias camelCase), para el streaming.
+_schedule_adapter = TypeAdapter(List[ClassOption])
+
+# Serializa la respuesta completa del generador directo a bytes JSON (ver
+# `_json_response`), en cualquiera de sus dos formatos.
+_response_adapters = {
+    model: TypeAdapter(model) for model in (GenerateScheduleResponse, NormalizedScheduleResponse)
+}
+
+# Versión de la oferta para la llave del caché, releída de la base a lo sumo
+# cada OFFER_VERSION_TTL segundos: así un acierto del caché no abre conexión.
+# Tras un ETL, las respuestas anteriores se sirven hasta ese plazo.
+_offer_version = OfferVersion(
+    lambda: repository.get_offer_version(),
+    ttl_seconds=float(os.getenv("OFFER_VERSION_TTL", "5")),
+)
+
+# Tamaño de página cuando llega un `cursor` sin `limit`.
+_DEFAULT_PAGE_LIMIT = int(os.getenv("SCHEDULE_PAGE_LIMIT", "50"))
+
 # Ruta añadida para resolver problemática
 app.include_router(subject_routes.router)
 
@@ -86,7 +121,7 @@ def get_subjects_catalog():
     """
     return repository.get_all_subjects_catalog()
 
-def _custom_option_group(cc: CustomCourseInput) -> List[ClassOption]:
+def _custom_option_group(cc: CustomCourseInput) -> List[ClassOptionRecord]:
     """Convierte un curso personalizado en un `option_group` (una sola opción).
 
     Es una materia con dominio de 1: el backtracking la trata igual que a
@@ -94,38 +129,352 @@ def _custom_option_group(cc: CustomCourseInput) -> List[ClassOption]:
     ``CP{id}``). Cupos ficticios (1/1): es un curso que el usuario ya tiene.
     """
     return [
-        ClassOption(
-            subjectName=cc.name,
-            subjectCode=cc.code,
+        ClassOptionRecord(
+            subject_name=cc.name,
+            subject_code=cc.code,
             type=cc.etiqueta or cc.type or "Personalizado",
-            schedules=cc.bloques,
+            schedules=[ClassSlot(b.day, b.time) for b in cc.bloques],
             # Vacío si el usuario no puso profesor: la UI/descargas muestran el
             # profesor solo cuando existe (para un curso personalizado no hay uno
             # "oficial"). Ver detalle en schedule_overview / schedule_export.
             professor=cc.professor or "",
             nrc=cc.nrc,
-            groupId=0,
+            group_id=0,
             credits=cc.credits,
             campus=cc.campus or "",
-            seatsAvailable=1,
-            seatsMaximum=1,
-            isCustom=True,
+            seats_available=1,
+            seats_maximum=1,
+            is_custom=True,
         )
     ]
 
 
-@app.post("/api/schedules/generate", response_model=GenerateScheduleResponse, summary="Generar horarios válidos")
-def generate_schedules_endpoint(request: GenerateScheduleRequest) -> GenerateScheduleResponse:
+def _as_models(schedule: Sequence[ClassOptionRecord]) -> List[ClassOption]:
+    """Un horario del generador en modelos de la API (ver `ClassOptionRecord`)."""
+    return [option.to_model() for option in schedule]
+
+
+@app.post(
+    "/api/schedules/generate",
+    response_model=Union[GenerateScheduleResponse, NormalizedScheduleResponse],
+    summary="Generar horarios válidos",
+)
+def generate_schedules_endpoint(request: GenerateScheduleRequest) -> Response:
     """
     Recibe una lista de objetos de materia (código y nombre) y un diccionario de filtros.
 
     Ejecuta el algoritmo de backtracking y devuelve los horarios válidos junto con
     `truncated`, que indica si se aplicó el cap móvil y había más resultados.
+
+    Con `limit` pagina: la primera llamada calcula la lista completa una sola
+    vez, la guarda (`schedule_store`) y devuelve la primera página con el total
+    y un `nextCursor`. Con `cursor`, la página sale del resultado guardado sin
+    volver a buscar.
+
+    Con `countOnly` solo cuenta: `schedules` viene vacío y `total` trae cuántos
+    horarios (ya fusionados) habría, sin generarlos.
+
+    Con `responseFormat: "normalized"` responde `NormalizedScheduleResponse`:
+    cada opción una sola vez y los horarios como índices. No se combina con
+    la paginación (400).
+    """
+    if request.response_format == "normalized" and (
+        request.limit is not None or request.cursor is not None
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="El formato normalizado no admite paginación (limit/cursor).",
+        )
+
+    if request.cursor is not None:
+        return _json_response(
+            _schedule_page_from_cursor(request.cursor, request.limit or _DEFAULT_PAGE_LIMIT)
+        )
+
+    if not request.subjects:
+        raise HTTPException(status_code=400, detail="La lista de materias no puede estar vacía.")
+    _check_ranking(request)
+
+    subjects_data = [s.model_dump() for s in request.subjects]
+
+    # Cap solo para clientes móviles: el generador conserva solo los mejores N
+    # mientras busca (mismo orden que la lista completa), sin ordenar todos los
+    # demás. Escritorio recibe todos. Paginado no aplica el cap: las páginas ya
+    # son chicas y se calcula todo una vez para poder servirlas del almacén.
+    top_k: Optional[int] = None
+    if request.is_mobile and _MAX_SCHEDULES > 0 and request.limit is None:
+        top_k = _MAX_SCHEDULES
+
+    # Caché por petición canónica + versión de la oferta (ver schedule_cache).
+    # Un acierto evita la consulta de combinaciones y la búsqueda. El conteo se
+    # guarda aparte de las listas (su respuesta no trae horarios), y cada
+    # formato de respuesta aparte del otro.
+    cache_key = (
+        request_key(
+            subjects_data,
+            request.filters,
+            request.credit_limit,
+            [cc.model_dump() for cc in request.custom_courses],
+            _offer_version.get(),
+        ),
+        "count" if request.count_only else (top_k, request.response_format),
+    )
+    response = generation_cache.get(cache_key)
+    if response is None:
+        if request.count_only:
+            response = _count_schedules(request, subjects_data)
+        else:
+            response = _generate_schedules(request, subjects_data, top_k)
+        # Un diagnóstico parcial (venció su plazo) no se guarda: con el servidor
+        # más libre, la próxima petición puede completarlo.
+        if response.diagnosis is None or not response.diagnosis.partial:
+            generation_cache.put(cache_key, response)
+
+    if request.limit is not None and response.schedules:
+        result_id = schedule_store.put(response.schedules)
+        return _json_response(_schedule_page(response.schedules, result_id, 0, request.limit))
+    return _json_response(response)
+
+
+def _json_response(
+    response: Union[GenerateScheduleResponse, NormalizedScheduleResponse],
+) -> Response:
+    """
+    La respuesta ya serializada, sin pasar por `response_model`.
+
+    Devolver el modelo hace que FastAPI lo revalide y lo pase a dicts antes de
+    serializar: con miles de horarios eso era buena parte del tiempo de la
+    petición. Aquí pydantic-core escribe los bytes directo, con los mismos
+    alias y el mismo JSON compacto en UTF-8 que emitía FastAPI.
+    `response_model` se conserva en el decorador solo para el esquema OpenAPI.
+    """
+    return Response(
+        content=_response_adapters[type(response)].dump_json(response, by_alias=True),
+        media_type="application/json",
+    )
+
+
+@app.get("/api/schedules/cache-stats", summary="Contadores del caché de horarios")
+def get_schedule_cache_stats() -> Dict[str, Any]:
+    """Aciertos, fallos y ocupación del caché de generación, para dimensionarlo."""
+    return generation_cache.stats()
+
+
+@app.post("/api/schedules/generate/stream", summary="Generar horarios válidos (NDJSON en streaming)")
+def generate_schedules_stream_endpoint(request: GenerateScheduleRequest) -> StreamingResponse:
+    """
+    Variante en streaming de `/api/schedules/generate` (opcional).
+
+    Responde `application/x-ndjson`: una línea `{"type": "schedule", ...}` por
+    horario, escrita a medida que el generador lo produce, y al final una línea
+    `{"type": "trailer", ...}` con `truncated`, `total` y `diagnosis`. El
+    servidor no arma la lista completa y el cliente ve los primeros horarios en
+    milisegundos.
+
+    Sin criterio de orden, los horarios salen del generador perezoso
+    (`iter_valid_schedules`) en el mismo orden que el endpoint normal. Con
+    `optimizeGaps`/`optimizeFreeDays` (o `rankBy`/`rankWeights`) el orden exige
+    verlos todos: se rankean primero (los mejores N en móvil) y luego se
+    transmiten. No pasa por el caché ni pagina.
     """
     if not request.subjects:
         raise HTTPException(status_code=400, detail="La lista de materias no puede estar vacía.")
+    _check_ranking(request)
 
     subjects_data = [s.model_dump() for s in request.subjects]
+    combinations, missing = _build_combinations(request, subjects_data)
+    cap = _MAX_SCHEDULES if request.is_mobile and _MAX_SCHEDULES > 0 else None
+    return StreamingResponse(
+        _stream_schedules(combinations, missing, _generation_params(request), cap),
+        media_type="application/x-ndjson",
+    )
+
+
+def _stream_schedules(
+    combinations: List[Any],
+    missing: List[str],
+    generation_params: Dict[str, Any],
+    cap: Optional[int],
+) -> Iterator[bytes]:
+    """Las líneas NDJSON de `generate_schedules_stream_endpoint`."""
+    if missing:
+        yield _trailer_line(False, 0, _missing_offer_diagnosis(missing))
+        return
+
+    truncated = False
+    if schedule_generator.ranks_schedules(generation_params):
+        if cap is not None:
+            schedules, truncated = schedule_generator.find_top_schedules(
+                combinations, generation_params, cap
+            )
+        else:
+            schedules = schedule_generator.find_valid_schedules(
+                combinations, generation_params, workers=_SEARCH_WORKERS
+            )
+        produced: Iterator[List[ClassOptionRecord]] = iter(schedules)
+    else:
+        produced = schedule_generator.iter_valid_schedules(combinations, generation_params)
+        if cap is not None:
+            # Uno de más para saber si había más horarios que el cap.
+            produced = itertools.islice(produced, cap + 1)
+
+    count = 0
+    for schedule in produced:
+        if cap is not None and count == cap:
+            truncated = True
+            break
+        count += 1
+        yield b'{"type":"schedule","schedule":' + _schedule_adapter.dump_json(_as_models(schedule), by_alias=True) + b'}\n'
+
+    diagnosis = None
+    if count == 0:
+        found = schedule_diagnostics.diagnose(combinations, generation_params)
+        if found is not None:
+            diagnosis = ScheduleDiagnosis.model_validate(found)
+    yield _trailer_line(truncated, None if truncated else count, diagnosis)
+
+
+def _trailer_line(truncated: bool, total: Optional[int], diagnosis: Optional[ScheduleDiagnosis]) -> bytes:
+    """Última línea del streaming: lo que en el endpoint normal acompaña a la lista."""
+    trailer = {
+        "type": "trailer",
+        "truncated": truncated,
+        "total": total,
+        "diagnosis": diagnosis.model_dump(mode="json") if diagnosis is not None else None,
+    }
+    # Compacto, como las líneas de horario que escribe pydantic.
+    return json.dumps(trailer, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _generate_schedules(
+    request: GenerateScheduleRequest,
+    subjects_data: List[Dict[str, Any]],
+    top_k: Optional[int],
+) -> Union[GenerateScheduleResponse, NormalizedScheduleResponse]:
+    """
+    Arma las combinaciones de la petición y corre el generador.
+
+    Con `top_k` devuelve solo los mejores N (`truncated` avisa al frontend que
+    había más, para mostrar "N+"); sin él, la lista completa con su total.
+    La respuesta sale en el formato pedido (`responseFormat`).
+    """
+    combinations, missing = _build_combinations(request, subjects_data)
+    normalized = request.response_format == "normalized"
+
+    # Materia sin oferta y sin curso personalizado: el generador no puede correr.
+    # No es un cruce (ver RFC diagnóstico §6.1).
+    if missing:
+        return _schedules_response(
+            [],
+            normalized,
+            truncated=False,
+            diagnosis=_missing_offer_diagnosis(missing),
+        )
+
+    generation_params = _generation_params(request)
+
+    # 2. Se pasan los dos argumentos que la función expecta.
+    truncated = False
+    if top_k is not None:
+        valid_schedules, truncated = schedule_generator.find_top_schedules(
+            combinations, generation_params, top_k, grouped=normalized
+        )
+    else:
+        valid_schedules = schedule_generator.find_valid_schedules(
+            combinations, generation_params, workers=_SEARCH_WORKERS, grouped=normalized
+        )
+
+    # Sin horarios: se explica por qué (materia sin opciones, par incompatible o
+    # el conjunto). Solo se calcula en este camino, así que no cuesta nada cuando
+    # sí hay resultados. Ver docs/issues/17-07-2026-rfc-diagnostico-sin-horarios.md
+    if not valid_schedules:
+        return _schedules_response(
+            [],
+            normalized,
+            truncated=False,
+            total=0,
+            diagnosis=schedule_diagnostics.diagnose(combinations, generation_params),
+        )
+
+    total = None if truncated else len(valid_schedules)
+    return _schedules_response(valid_schedules, normalized, truncated=truncated, total=total)
+
+
+def _schedules_response(
+    schedules: Sequence[Any],
+    normalized: bool,
+    **fields: Any,
+) -> Union[GenerateScheduleResponse, NormalizedScheduleResponse]:
+    """
+    La respuesta con estos horarios del generador, en el formato pedido.
+
+    Con `normalized` los horarios vienen agrupados (`GroupedSchedule`): cada
+    opción entra una vez a la tabla `options`, por NRC, y cada horario queda
+    como índices, con los grupos equivalentes como `alternatives` en el orden
+    de la fusión. Grupos seguidos de la misma materia van en una sola entrada.
+    """
+    if not normalized:
+        return GenerateScheduleResponse(schedules=[_as_models(s) for s in schedules], **fields)
+
+    index: Dict[str, int] = {}
+    options: List[ClassOption] = []
+
+    def _indices(group: Sequence[ClassOptionRecord]) -> List[int]:
+        positions = []
+        for option in group:
+            position = index.get(option.nrc)
+            if position is None:
+                position = index[option.nrc] = len(options)
+                options.append(option.to_model())
+            positions.append(position)
+        return positions
+
+    compact: List[CompactSchedule] = []
+    for schedule in schedules:
+        chosen = [_indices(group) for group in schedule.base]
+        alternatives: List[ScheduleAlternative] = []
+        last_position = None
+        for position, group in schedule.alternatives:
+            if position != last_position:
+                alternatives.append(ScheduleAlternative.model_construct(base=chosen[position], groups=[]))
+                last_position = position
+            alternatives[-1].groups.append(_indices(group))
+        compact.append(CompactSchedule.model_construct(
+            options=[index for group in chosen for index in group], alternatives=alternatives
+        ))
+    return NormalizedScheduleResponse(options=options, schedules=compact, **fields)
+
+
+def _count_schedules(
+    request: GenerateScheduleRequest,
+    subjects_data: List[Dict[str, Any]],
+) -> GenerateScheduleResponse:
+    """Como `_generate_schedules`, pero solo el total (`count_valid_schedules`)."""
+    combinations, missing = _build_combinations(request, subjects_data)
+    if missing:
+        return GenerateScheduleResponse(
+            schedules=[],
+            truncated=False,
+            total=0,
+            diagnosis=_missing_offer_diagnosis(missing),
+        )
+
+    generation_params = _generation_params(request)
+    total = schedule_generator.count_valid_schedules(combinations, generation_params)
+    diagnosis = None
+    if total == 0:
+        diagnosis = schedule_diagnostics.diagnose(combinations, generation_params)
+    return GenerateScheduleResponse(schedules=[], truncated=False, total=total, diagnosis=diagnosis)
+
+
+def _build_combinations(
+    request: GenerateScheduleRequest,
+    subjects_data: List[Dict[str, Any]],
+) -> Tuple[List[Any], List[str]]:
+    """
+    Las combinaciones de cada materia de la petición, en su orden, y los
+    nombres de las materias que no tienen ni oferta ni curso personalizado.
+    """
     real_combos = repository.get_combinations_for_subjects(subjects_data)
 
     # Índice de la oferta real por (código, nombre).
@@ -155,52 +504,73 @@ def generate_schedules_endpoint(request: GenerateScheduleRequest) -> GenerateSch
         else:
             missing.append(s.name)
 
-    # Materia sin oferta y sin curso personalizado: el generador no puede correr.
-    # No es un cruce (ver RFC diagnóstico §6.1).
-    if missing:
-        return GenerateScheduleResponse(
-            schedules=[],
-            truncated=False,
-            diagnosis=ScheduleDiagnosis(
-                shape="sin_oferta",
-                blame="datos",
-                subjects=missing,
-                removalOptions=missing,
-            ),
-        )
+    return combinations, missing
+
+
+def _missing_offer_diagnosis(missing: List[str]) -> ScheduleDiagnosis:
+    """Diagnóstico de materias sin oferta: no es un cruce (ver RFC diagnóstico §6.1)."""
+    return ScheduleDiagnosis(
+        shape="sin_oferta",
+        blame="datos",
+        subjects=missing,
+        removalOptions=missing,
+    )
+
+
+def _check_ranking(request: GenerateScheduleRequest) -> None:
+    """400 si `rankBy`/`rankWeights` traen un criterio desconocido o un peso inválido."""
+    try:
+        schedule_generator.parse_ranking(request.filters)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
+def _generation_params(request: GenerateScheduleRequest) -> Dict[str, Any]:
+    """Filtros de la petición más el tope de créditos, como los lee el generador."""
     # Se define explícitamente el tipo del diccionario para Pylance.
     # El generador lee el tope bajo la clave 'max_credits'.
     generation_params: Dict[str, Any] = {
         **request.filters,
         "max_credits": request.credit_limit
     }
+    return generation_params
 
-    # 2. Se pasan los dos argumentos que la función expecta.
-    valid_schedules = schedule_generator.find_valid_schedules(
-        combinations, generation_params
+
+def _schedule_page(
+    schedules: Sequence[List[ClassOption]],
+    result_id: str,
+    offset: int,
+    limit: int,
+) -> GenerateScheduleResponse:
+    """Una página de un resultado guardado, con el total y el cursor siguiente."""
+    end = offset + limit
+    has_more = end < len(schedules)
+    return GenerateScheduleResponse(
+        schedules=list(schedules[offset:end]),
+        truncated=has_more,
+        total=len(schedules),
+        nextCursor=encode_cursor(result_id, end) if has_more else None,
     )
 
-    # Sin horarios: se explica por qué (materia sin opciones, par incompatible o
-    # el conjunto). Solo se calcula en este camino, así que no cuesta nada cuando
-    # sí hay resultados. Ver docs/issues/17-07-2026-rfc-diagnostico-sin-horarios.md
-    if not valid_schedules:
-        return GenerateScheduleResponse(
-            schedules=[],
-            truncated=False,
-            diagnosis=schedule_diagnostics.diagnose(combinations, generation_params),
-        )
 
-    # Cap solo para clientes móviles: devuelve los mejores N (ya vienen
-    # ordenados del generador). Escritorio recibe todos. `truncated` avisa al
-    # frontend que había más (para mostrar "N+").
-    truncated = False
-    if request.is_mobile and 0 < _MAX_SCHEDULES < len(valid_schedules):
-        truncated = True
-        valid_schedules = valid_schedules[:_MAX_SCHEDULES]
+def _schedule_page_from_cursor(cursor: str, limit: int) -> GenerateScheduleResponse:
+    """
+    Sirve la página de un cursor desde el resultado guardado, sin buscar.
 
-    return GenerateScheduleResponse(schedules=valid_schedules, truncated=truncated)
+    Un cursor mal formado es 400. Uno vencido (o de otro worker) es 410: el
+    cliente debe volver a generar desde la primera página.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    result_id, offset = decoded
+    schedules = schedule_store.get(result_id)
+    if schedules is None:
+        raise HTTPException(
+            status_code=410,
+            detail="El resultado expiró. Vuelve a generar los horarios.",
+        )
+    return _schedule_page(schedules, result_id, offset, limit)
 
 @app.get("/subjects")
 def get_subject_data():
@@ -1,5 +1,6 @@
+from dataclasses import dataclass, field
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Literal, NamedTuple, Optional
 
 # Nota: Usamos alias para que los modelos Pydantic puedan trabajar con snake_case en Python pero exponer camelCase en el JSON, manteniendo la compatibilidad con los modelos de Dart.
 
@@ -27,6 +28,58 @@ class ClassOption(BaseModel):
     # True si es un curso personalizado del usuario (para distinguirlo en la grilla).
     is_custom: bool = Field(default=False, alias='isCustom')
 
+
+class ClassSlot(NamedTuple):
+    """Un `Schedule` sin pydantic: lo que guarda `ClassOptionRecord`."""
+    day: str
+    time: str
+
+
+@dataclass(eq=False, slots=True)
+class ClassOptionRecord:
+    """
+    `ClassOption` liviano, para hidratar la oferta y buscar.
+
+    Tiene los mismos atributos (en snake_case) que `ClassOption`, así que el
+    generador y el diagnóstico trabajan con cualquiera de los dos. Crearlo no
+    valida nada: el repositorio arma uno por NRC y la búsqueda solo guarda
+    referencias. Solo las opciones de los horarios que se devuelven pasan a
+    `ClassOption` (`to_model`), una vez por opción.
+    """
+    subject_name: str
+    subject_code: str
+    type: str
+    schedules: List[ClassSlot]
+    professor: str
+    nrc: str
+    group_id: int
+    credits: float
+    campus: str
+    seats_available: int
+    seats_maximum: int
+    is_custom: bool = False
+    _model: Optional[ClassOption] = field(default=None, repr=False)
+
+    def to_model(self) -> ClassOption:
+        """El `ClassOption` de la respuesta; se arma la primera vez y se reusa."""
+        if self._model is None:
+            # Sin validar: los datos ya vienen tipados de la base o del request.
+            self._model = ClassOption.model_construct(
+                subject_name=self.subject_name,
+                subject_code=self.subject_code,
+                type=self.type,
+                schedules=[Schedule.model_construct(day=s.day, time=s.time) for s in self.schedules],
+                professor=self.professor,
+                nrc=self.nrc,
+                group_id=self.group_id,
+                credits=self.credits,
+                campus=self.campus,
+                seats_available=self.seats_available,
+                seats_maximum=self.seats_maximum,
+                is_custom=self.is_custom,
+            )
+        return self._model
+
 class Subject(BaseModel):
     # Configuración para que los modelos Pydantic usen camelCase en lugar de snake_case
     # en el JSON generado, pero mantengan snake_case en Python.
@@ -78,6 +131,19 @@ class GenerateScheduleRequest(BaseModel):
     # Cursos personalizados activos (opcional). El frontend manda solo los que el
     # usuario dejó activos; el backend arma el dominio de esas materias con ellos.
     custom_courses: List[CustomCourseInput] = Field(default_factory=list, alias='customCourses')
+    # Paginación por cursor (opcional). Con `limit` la respuesta trae solo esa
+    # cantidad de horarios y un `nextCursor`; para las páginas siguientes se
+    # reenvía ese cursor y el backend las sirve del resultado ya calculado.
+    limit: Optional[int] = Field(default=None, ge=1)
+    cursor: Optional[str] = None
+    # Solo contar (opcional): la respuesta trae `total` y ningún horario. Es lo
+    # que usa la UI para mostrar "N horarios posibles" mientras se ajustan los
+    # filtros, sin generar ni transferir la lista.
+    count_only: bool = Field(default=False, alias='countOnly')
+    # Formato de la respuesta (opcional). 'normalized' manda cada opción una
+    # sola vez en una tabla y los horarios como índices a ella (ver
+    # `NormalizedScheduleResponse`). No se combina con la paginación.
+    response_format: Literal['full', 'normalized'] = Field(default='full', alias='responseFormat')
 
 
 class FilterLabel(BaseModel):
@@ -110,13 +176,61 @@ class ScheduleDiagnosis(BaseModel):
     # Filtros que, quitados por sí solos, desbloquean. Solo con blame='filtros';
     # vacío ahí significa que es la combinación de filtros, no uno puntual.
     blockingFilters: List[FilterLabel] = []
+    # Si ninguno solo alcanza: el conjunto más chico de filtros que, quitados
+    # juntos, sí desbloquea. Vacío si no aplica o si se agotó el presupuesto.
+    relaxation: List[FilterLabel] = []
+    # Conjunto mínimo de materias que no caben juntas (solo conjunto_incompatible
+    # cuando removalOptions viene vacío): quitar cualquiera de ellas lo rompe.
+    # Vacío si no aplica o si la búsqueda agotó su presupuesto.
+    core: List[str] = []
+    # True si el diagnóstico se cortó por su plazo: lo reportado es cierto,
+    # pero las listas pueden estar incompletas.
+    partial: bool = False
 
 
 class GenerateScheduleResponse(BaseModel):
     """Respuesta del generador: horarios + si la lista fue truncada por el cap."""
     schedules: List[List[ClassOption]]
-    # True si se aplicó el cap móvil y había más horarios de los devueltos.
+    # True si había más horarios de los devueltos (cap móvil o más páginas).
     truncated: bool = False
+    # Total real de horarios del resultado. Se conoce cuando se calculó la
+    # lista completa (escritorio o paginado); con el cap móvil es None.
+    total: Optional[int] = None
+    # Cursor de la página siguiente; None en la última (o sin paginación).
+    nextCursor: Optional[str] = None
     # Solo cuando `schedules` viene vacío: explica por qué. En el camino feliz es
     # None y no se calcula nada.
-    diagnosis: Optional[ScheduleDiagnosis] = None
\ No newline at end of file
+    diagnosis: Optional[ScheduleDiagnosis] = None
+
+
+class ScheduleAlternative(BaseModel):
+    """Grupos equivalentes al de una materia del horario (mismo profesor y horas)."""
+    # Índices en `options` del grupo del horario que se puede cambiar.
+    base: List[int]
+    # Cada grupo equivalente, también como índices en `options`.
+    groups: List[List[int]]
+
+
+class CompactSchedule(BaseModel):
+    """Un horario del formato normalizado."""
+    # Índices en `options` de las opciones del horario, en orden de materia.
+    options: List[int]
+    # Solo las materias con grupos equivalentes. En el formato completo esas
+    # opciones van sueltas al final del horario (NRCs alternos), en el orden
+    # de esta lista; una materia puede aparecer en más de una entrada.
+    alternatives: List[ScheduleAlternative] = []
+
+
+class NormalizedScheduleResponse(BaseModel):
+    """
+    Respuesta del generador con `responseFormat: "normalized"`.
+
+    Un mismo NRC aparece en cientos de horarios: aquí va una sola vez en
+    `options` y cada horario lo referencia por índice. El resto de los campos
+    significa lo mismo que en `GenerateScheduleResponse` (no hay paginación).
+    """
+    options: List[ClassOption]
+    schedules: List[CompactSchedule]
+    truncated: bool = False
+    total: Optional[int] = None
+    diagnosis: Optional[ScheduleDiagnosis] = None
@@ -0,0 +1,168 @@
+"""
+Caché en memoria de resultados del generador, por petición canónica.
+
+Muchos estudiantes piden las mismas materias (las del ciclo básico dominan), y
+cada petición repetía la consulta a la base y la búsqueda completa. Este caché
+se pone delante de `find_valid_schedules`: la llave es un hash canónico de la
+petición (materias, filtros normalizados, tope de créditos y cursos
+personalizados) más la versión de la oferta académica.
+
+La versión de la oferta (`oferta_version`) la sube el ETL en la misma
+transacción en que reemplaza `Curso`/`Clase` (ver `scripts/insertar_en_db.py`).
+Como forma parte de la llave, tras una actualización ninguna entrada vieja
+vuelve a acertar: quedan huérfanas y las desaloja el LRU o el TTL. Así la
+invalidación funciona aunque el ETL corra en otro proceso. La versión se lee
+de la base a lo sumo cada `OFFER_VERSION_TTL` segundos (`OfferVersion`): un
+acierto no abre conexión, a cambio de que tras un ETL las respuestas viejas
+sigan sirviéndose hasta ese plazo.
+
+Las materias NO se ordenan en la llave: su orden define el orden canónico de
+los horarios (y de las opciones dentro de cada uno), así que dos peticiones con
+las mismas materias en otro orden no tienen la misma respuesta.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+V = TypeVar('V')
+
+
+class LruTtlCache(Generic[V]):
+    """Diccionario acotado: desaloja el menos usado y vence cada entrada a su TTL."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        # Los endpoints síncronos de FastAPI corren en un pool de hilos.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """El valor guardado bajo `key`, o None si no existe o venció."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._evict_expired()
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores para dimensionar el caché."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxEntries': self._max_entries,
+                'ttlSeconds': self._ttl,
+            }
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+class OfferVersion:
+    """La versión de la oferta, leída con `read` a lo sumo cada `ttl_seconds`."""
+
+    def __init__(self, read: Callable[[], int], ttl_seconds: float) -> None:
+        self._read = read
+        self._ttl = ttl_seconds
+        self._cached: Optional[Tuple[float, int]] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if self._cached is None or self._cached[0] <= now:
+                self._cached = (now + self._ttl, self._read())
+            return self._cached[1]
+
+
+# Filtros cuyas listas son secuencias, no conjuntos: no se ordenan.
+_ORDERED_FILTERS = ('rankBy',)
+
+
+def _normalize_filters(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Forma canónica de los filtros: misma forma ⇔ mismo resultado.
+
+    Se descartan los filtros vacíos o en False (el generador los trata igual que
+    ausentes) y las listas se ordenan (NRCs, profesores y horas son conjuntos),
+    salvo `rankBy`: su orden es el orden de los criterios.
+    Los días de `unavailable_slots` se pasan a minúscula como los lee el
+    compilador: si un día llega con dos grafías, gana la última.
+    """
+    normalized: Dict[str, Any] = {}
+    for name, value in filters.items():
+        if not value:
+            continue
+        if name == 'unavailable_slots' and isinstance(value, dict):
+            value = {day.lower(): hours for day, hours in value.items()}
+        if name in _ORDERED_FILTERS and isinstance(value, list):
+            normalized[name] = list(value)
+            continue
+        normalized[name] = _canonical(value)
+    return normalized
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_canonical(v) for v in value]
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def request_key(
+    subjects: List[Dict[str, Any]],
+    filters: Dict[str, Any],
+    credit_limit: float,
+    custom_courses: List[Dict[str, Any]],
+    offer_version: int,
+) -> str:
+    """Hash canónico de una petición de generación (ver docstring del módulo)."""
+    payload = {
+        'subjects': [[s['code'], s['name']] for s in subjects],
+        'filters': _normalize_filters(filters),
+        'creditLimit': float(credit_limit),
+        'customCourses': custom_courses,
+        'offerVersion': offer_version,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+# Instancia del proceso. Configurable por env (segundos / cantidad de resultados).
+generation_cache: LruTtlCache[Any] = LruTtlCache(
+    ttl_seconds=float(os.getenv("SCHEDULE_CACHE_TTL", "900")),
+    max_entries=int(os.getenv("SCHEDULE_CACHE_MAX", "128")),
+)
@@ -0,0 +1,445 @@
+"""
+Compilación por petición del problema de horarios a un modelo entero.
+
+El generador compara bloques de clase millones de veces por petición. Hacerlo
+sobre `Schedule.time` ("HH:MM - HH:MM") obligaba a partir la cadena y crear
+objetos `time` en cada comparación. Aquí se hace una sola vez: cada
+`option_group` pasa a ser un `CompiledGroup` con sus bloques como tuplas
+`(dia, inicio, fin)` de enteros (índice de día y minutos desde la medianoche), y
+la búsqueda trabaja solo sobre esos enteros.
+
+Además, cada grupo lleva su ocupación de la semana como máscara de bits en un
+`int` de Python: un bit por franja de `slot_minutes` minutos de cada día. Dos
+grupos se solapan si y solo si sus máscaras comparten un bit, así que el choque
+contra todo un horario parcial es un solo AND contra el OR de lo ya elegido.
+La franja es el MCD de todos los minutos de la petición, de modo que la
+discretización es exacta (no hay falsos positivos por redondeo).
+
+Con las máscaras se precalcula una matriz de compatibilidad entre todos los
+grupos de todas las materias (`CompiledProblem.compat`), también en bits: la
+fila de un grupo es un `int` con un bit por grupo compatible. El backtracking
+solo intersecta filas; nunca vuelve a calcular un solape.
+
+Las opciones originales se conservan dentro de cada grupo: son las que se
+devuelven en la respuesta, así que el JSON público no cambia. Pueden ser
+`ClassOption` o `ClassOptionRecord` (el repositorio hidrata estos últimos, sin
+pydantic); aquí solo se leen sus atributos, que son los mismos.
+"""
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from math import gcd
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..models import ClassOption
+
+# (índice de día, minuto de inicio, minuto de fin).
+Block = Tuple[int, int, int]
+
+
+def parse_minutes(time_str: str) -> int:
+    """Convierte 'HH:MM' en minutos desde la medianoche."""
+    hours, minutes = time_str.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_range(time_range_str: str) -> Tuple[int, int]:
+    """Convierte 'HH:MM - HH:MM' en (minuto de inicio, minuto de fin)."""
+    start_str, end_str = time_range_str.split(' - ')
+    return parse_minutes(start_str.strip()), parse_minutes(end_str.strip())
+
+
+def subject_key(option: ClassOption) -> str:
+    """
+    Identidad de la materia de una clase: el par (código, nombre).
+
+    Ninguno de los dos identifica una materia por sí solo —así lo declara la PK
+    compuesta `materia_pkey (codigomateria, nombre)` y por eso la API pide
+    ambos—: hay nombres repartidos entre varios códigos ("Práctica Profesional"
+    aparece en 14 carreras) y códigos con varios nombres (`RULEI02B` es "Inglés
+    Ii" e "Inglés Ii - Derecho"). Agrupar los filtros por el código solo hacía
+    que el filtro de una materia se le aplicara a la otra.
+
+    Debe coincidir con `Subject.key` / `ClassOption.subjectKey` del frontend: es
+    la llave con la que llegan los filtros por materia.
+    """
+    return f"{option.subject_code}|{option.subject_name}"
+
+
+def option_signature(option: ClassOption) -> str:
+    """
+    Parte de la 'huella digital' de un horario que aporta una opción: materia,
+    profesor y bloques. Dos opciones con la misma parte son intercambiables para
+    el estudiante aunque tengan NRCs distintos (ver `_get_schedule_signature`).
+    """
+    signature_part = f"{option.subject_code}:{option.professor}"
+    for s in option.schedules:
+        signature_part += f"@{s.day}:{s.time.replace(' ', '')}"
+    return signature_part
+
+
+@dataclass(eq=False, slots=True)
+class CompiledGroup:
+    """
+    Un `option_group` ya compilado: lo que la búsqueda necesita, en enteros.
+
+    `options` son las opciones originales, en su orden. `key` identifica la
+    exención de conflicto (mismo código de materia y mismo grupo: ej. labs
+    alternos). Todas las opciones de un grupo comparten código y `group_id` (así
+    los arma `repository._get_option_combinations` y un curso personalizado es
+    una sola opción), por eso basta una llave por grupo.
+    """
+    level: int
+    index: int
+    # Índice global (todas las materias): es el bit del grupo en `compat`.
+    id: int
+    options: List[ClassOption]
+    credits: float
+    key: Tuple[str, int]
+    subject: str
+    nrcs: frozenset
+    # Profesores en minúscula, uno por opción (pueden repetirse).
+    professors: Tuple[str, ...]
+    blocks: Tuple[Block, ...]
+    # Ocupación semanal: un bit por franja (ver `CompiledProblem.slot_minutes`).
+    mask: int = 0
+
+
+@dataclass(eq=False, slots=True)
+class CompiledProblem:
+    """
+    Las materias de una petición, compiladas una sola vez.
+
+    `levels[i]` son los grupos de la materia i en el mismo orden de
+    `combinations_per_subject[i]`. Los días se indexan por la cadena exacta
+    (igual que comparaba `_schedules_overlap`); `day_keys[d]` agrupa los índices
+    que solo difieren en mayúsculas, que es como cuentan los días el puntaje y
+    las horas no disponibles.
+
+    `groups` son todos los grupos en orden de `id`. `level_bits[i]` tiene
+    prendidos los bits de los grupos de la materia i, y `compat[id]` los de los
+    grupos de OTRAS materias que pueden convivir con ese grupo.
+    """
+    levels: List[List[CompiledGroup]]
+    day_names: List[str]
+    day_keys: List[int]
+    slot_minutes: int
+    day_slots: int
+    groups: List[CompiledGroup]
+    level_bits: List[int]
+    compat: List[int]
+
+
+def compile_problem(combinations_per_subject: List[List[List[ClassOption]]]) -> CompiledProblem:
+    """Compila las combinaciones de una petición al modelo entero."""
+    day_index: Dict[str, int] = {}
+    day_names: List[str] = []
+    day_keys: List[int] = []
+    lower_index: Dict[str, int] = {}
+
+    def _day(name: str) -> int:
+        index = day_index.get(name)
+        if index is None:
+            index = len(day_names)
+            day_index[name] = index
+            day_names.append(name)
+            day_keys.append(lower_index.setdefault(name.lower(), len(lower_index)))
+        return index
+
+    levels: List[List[CompiledGroup]] = []
+    groups: List[CompiledGroup] = []
+    for level, subject_combinations in enumerate(combinations_per_subject):
+        compiled: List[CompiledGroup] = []
+        for index, option_group in enumerate(subject_combinations):
+            first = option_group[0]
+            blocks: List[Block] = []
+            for option in option_group:
+                for s in option.schedules:
+                    start, end = parse_range(s.time)
+                    blocks.append((_day(s.day), start, end))
+            compiled.append(CompiledGroup(
+                level=level,
+                index=index,
+                id=len(groups) + len(compiled),
+                options=option_group,
+                credits=first.credits,
+                key=(first.subject_code, first.group_id),
+                subject=subject_key(first),
+                nrcs=frozenset(opt.nrc for opt in option_group),
+                professors=tuple(opt.professor.lower() for opt in option_group),
+                blocks=tuple(blocks),
+            ))
+        levels.append(compiled)
+        groups.extend(compiled)
+
+    slot_minutes, day_slots = _slot_grid(levels)
+    for group in groups:
+        group.mask = _blocks_mask(group.blocks, slot_minutes, day_slots)
+
+    level_bits = [sum(1 << g.id for g in compiled) for compiled in levels]
+
+    return CompiledProblem(
+        levels=levels,
+        day_names=day_names,
+        day_keys=day_keys,
+        slot_minutes=slot_minutes,
+        day_slots=day_slots,
+        groups=groups,
+        level_bits=level_bits,
+        compat=_compatibility_matrix(groups, level_bits),
+    )
+
+
+def iter_bits(bits: int):
+    """Índices de los bits prendidos de `bits`, de menor a mayor."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _compatibility_matrix(groups: List[CompiledGroup], level_bits: List[int]) -> List[int]:
+    """
+    Fila de compatibilidad de cada grupo contra los grupos de las otras materias.
+
+    Dos grupos chocan si sus máscaras comparten una franja, salvo que tengan la
+    misma llave de exención (misma materia y grupo: ej. labs alternos). En vez
+    de comparar todos los pares, se arma para cada franja el conjunto (en bits)
+    de grupos que la ocupan; los choques de un grupo son el OR de esos
+    conjuntos sobre sus franjas. Es el mismo AND de máscaras, hecho en bloque.
+    """
+    occupants: Dict[int, int] = {}
+    same_key: Dict[Tuple[str, int], int] = {}
+    for group in groups:
+        bit = 1 << group.id
+        for slot in iter_bits(group.mask):
+            occupants[slot] = occupants.get(slot, 0) | bit
+        same_key[group.key] = same_key.get(group.key, 0) | bit
+
+    everything = (1 << len(groups)) - 1
+    compat: List[int] = []
+    for group in groups:
+        clashes = 0
+        for slot in iter_bits(group.mask):
+            clashes |= occupants[slot]
+        clashes &= ~same_key[group.key]
+        # Nunca se eligen dos grupos de la misma materia.
+        compat.append(everything & ~clashes & ~level_bits[group.level])
+    return compat
+
+
+def _slot_grid(levels: List[List[CompiledGroup]]) -> Tuple[int, int]:
+    """
+    Tamaño de franja (minutos) y franjas por día para las máscaras.
+
+    La franja es el MCD de todos los inicios y fines: con eso cada bloque cae
+    exactamente sobre franjas enteras. El día ocupa al menos 24 h de franjas
+    (más si algún bloque pasa de medianoche) para que un día no invada al otro.
+    """
+    step = 0
+    latest = 24 * 60
+    for compiled in levels:
+        for group in compiled:
+            for _, start, end in group.blocks:
+                step = gcd(gcd(step, start), end)
+                latest = max(latest, end)
+    step = gcd(step, 24 * 60) or 24 * 60
+    return step, -(-latest // step)
+
+
+def _blocks_mask(blocks: Tuple[Block, ...], slot_minutes: int, day_slots: int) -> int:
+    """
+    Máscara semanal de unos bloques.
+
+    Un bloque sin duración (fin <= inicio) no ocupa franjas: es un dato roto y
+    no hay clase real que dure cero minutos.
+    """
+    mask = 0
+    for day, start, end in blocks:
+        if end <= start:
+            continue
+        first = day * day_slots + start // slot_minutes
+        width = (end - start) // slot_minutes
+        mask |= ((1 << width) - 1) << first
+    return mask
+
+
+@dataclass(eq=False, slots=True)
+class CompiledFilters:
+    """
+    Los filtros del usuario compilados una sola vez por petición.
+
+    Todos los filtros son unarios (ver `schedule_diagnostics`): deciden grupo
+    por grupo, sin mirar a las otras materias. Por eso se aplican antes de
+    buscar, como poda de dominios: `domains[i]` son los bits de los grupos de
+    la materia i que los cumplen. La búsqueda ya no arma combinaciones que un
+    filtro iba a descartar en la hoja.
+
+    La única excepción es `include_professors` ("al menos uno de estos
+    profesores en la materia") cuando la misma materia ocupa más de un nivel:
+    ahí el "al menos uno" es sobre la unión de los niveles y no se puede decidir
+    grupo por grupo. Esas materias quedan en `residual_include` y se revisan en
+    la hoja (`_meets_filters` del generador).
+
+    `unavailable[d]` son los minutos bloqueados del día con índice d.
+    """
+    selected_nrcs: Dict[str, frozenset]
+    include_professors: Dict[str, frozenset]
+    exclude_professors: Dict[str, frozenset]
+    unavailable: Dict[int, Tuple[int, ...]]
+    # El límite de créditos se obtiene de los filtros, con un valor por defecto.
+    # Es float: las materias pueden tener créditos fraccionarios (ej. 0.5), así
+    # que un horario puede sumar 19.5.
+    max_credits: float = 20.0
+    domains: List[int] = field(default_factory=list)
+    residual_include: Dict[str, frozenset] = field(default_factory=dict)
+    # Grupos equivalentes colapsados: id del representante -> los demás miembros
+    # de su clase, en orden. None si no se pudo colapsar (ver `_collapse_equivalent`).
+    alternatives: Optional[Dict[int, List[CompiledGroup]]] = None
+
+
+def compile_filters(
+    filters: Dict[str, Any],
+    problem: CompiledProblem,
+    collapse: bool = True,
+) -> CompiledFilters:
+    """
+    Normaliza los filtros de `filters` y poda con ellos los dominios de `problem`.
+
+    Con `collapse=False` los dominios quedan sin colapsar los grupos
+    equivalentes (y `alternatives` en None): así se pueden intersecar con los
+    de otros filtros y colapsar después con `restrict_filters`.
+    """
+    selected = filters.get('selected_nrcs') or {}
+    include = filters.get('include_professors') or {}
+    exclude = filters.get('exclude_professors') or {}
+    slots = filters.get('unavailable_slots') or {}
+
+    minutes_by_day: Dict[str, List[int]] = {}
+    for day, hours in slots.items():
+        minutes_by_day[day.lower()] = [parse_minutes(h) for h in hours]
+
+    unavailable: Dict[int, Tuple[int, ...]] = {}
+    for index, name in enumerate(problem.day_names):
+        minutes = minutes_by_day.get(name.lower())
+        if minutes:
+            unavailable[index] = tuple(minutes)
+
+    compiled = CompiledFilters(
+        selected_nrcs={k: frozenset(v) for k, v in selected.items()},
+        include_professors={k: frozenset(p.lower() for p in v) for k, v in include.items()},
+        exclude_professors={k: frozenset(p.lower() for p in v) for k, v in exclude.items()},
+        unavailable=unavailable,
+        max_credits=float(filters.get('max_credits', 20)),
+    )
+
+    levels_per_subject = Counter(level[0].subject for level in problem.levels if level)
+    compiled.residual_include = {
+        subject: professors
+        for subject, professors in compiled.include_professors.items()
+        if levels_per_subject[subject] > 1
+    }
+    compiled.domains = [
+        sum(1 << g.id for g in level if group_meets_filters(g, compiled))
+        for level in problem.levels
+    ]
+    if collapse:
+        compiled.alternatives = _collapse_equivalent(problem, compiled.domains)
+    return compiled
+
+
+def restrict_filters(
+    filters: CompiledFilters,
+    problem: CompiledProblem,
+    domains: List[int],
+) -> CompiledFilters:
+    """
+    Copia de `filters` con otros dominios (sin colapsar), ya colapsados.
+
+    Como todos los filtros son unarios, los dominios de varios filtros juntos
+    son la intersección de los de cada uno: quien los combina (el diagnóstico)
+    arma esa intersección y aquí queda igual a haberlos compilado juntos.
+    """
+    domains = list(domains)
+    return replace(filters, domains=domains, alternatives=_collapse_equivalent(problem, domains))
+
+
+def _collapse_equivalent(
+    problem: CompiledProblem,
+    domains: List[int],
+) -> Optional[Dict[int, List[CompiledGroup]]]:
+    """
+    Colapsa en un solo nodo de búsqueda los grupos equivalentes de cada materia.
+
+    Dos grupos de la misma materia son equivalentes si sus opciones tienen las
+    mismas partes de firma (`option_signature`: profesor y bloques) y los mismos
+    créditos: chocan con lo mismo, pasan los mismos filtros (ya están dentro del
+    dominio filtrado) y dan horarios con la misma firma, que la fusión iba a
+    juntar de todos modos. Es el caso de las secciones paralelas (idiomas,
+    laboratorios), que hoy multiplican el espacio de búsqueda sin dar nada nuevo.
+
+    Queda en `domains` solo el primer grupo de cada clase (el de menor id, que
+    es el horario base de la fusión); el resto se devuelve por representante
+    para expandirlo en la salida.
+
+    Solo aplica si cada materia tiene un código distinto: la firma de un
+    horario es un conjunto de partes que empiezan por el código, así que con
+    códigos repetidos dos horarios pueden coincidir en firma intercambiando
+    partes entre niveles, y la fusión ya no se descompone materia por materia.
+    En ese caso devuelve None y la fusión se hace sobre la firma completa.
+    """
+    codes = {level[0].key[0] for level in problem.levels if level}
+    if len(codes) != len(problem.levels):
+        return None
+
+    alternatives: Dict[int, List[CompiledGroup]] = {}
+    groups = problem.groups
+    for level, domain in enumerate(domains):
+        representatives: Dict[Tuple[frozenset, float], CompiledGroup] = {}
+        for g_id in iter_bits(domain):
+            group = groups[g_id]
+            signature = (frozenset(option_signature(o) for o in group.options), group.credits)
+            representative = representatives.get(signature)
+            if representative is None:
+                representatives[signature] = group
+            else:
+                alternatives.setdefault(representative.id, []).append(group)
+                domain &= ~(1 << g_id)
+        domains[level] = domain
+    return alternatives
+
+
+def group_meets_filters(group: CompiledGroup, filters: CompiledFilters) -> bool:
+    """
+    ¿Cumple un grupo, por sí solo, los filtros de NRCs, profesores y horas?
+
+    Las comparaciones son insensibles a mayúsculas/minúsculas (los filtros ya
+    vienen normalizados). `include_professors` de una materia repetida no se
+    revisa aquí (ver `CompiledFilters.residual_include`).
+    """
+    subject = group.subject
+
+    # Si se especifican NRCs para una materia, solo se aceptan esos NRCs.
+    selected_nrcs = filters.selected_nrcs.get(subject)
+    if selected_nrcs is not None and not group.nrcs <= selected_nrcs:
+        return False
+
+    # Ningún profesor del grupo puede estar en la lista de exclusión.
+    excluded = filters.exclude_professors.get(subject)
+    if excluded is not None and any(p in excluded for p in group.professors):
+        return False
+
+    # Al menos un profesor requerido debe estar en el grupo.
+    included = filters.include_professors.get(subject)
+    if (included is not None and subject not in filters.residual_include
+            and not any(p in included for p in group.professors)):
+        return False
+
+    # Ninguna hora no disponible puede caer dentro de una clase del grupo.
+    unavailable = filters.unavailable
+    if unavailable:
+        for day, start, end in group.blocks:
+            for minute in unavailable.get(day, ()):
+                if start <= minute < end:
+                    return False
+
+    return True
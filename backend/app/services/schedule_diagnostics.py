@@ -4,8 +4,8 @@ Diagnóstico de por qué no se generó ningún horario.
 Ver `docs/issues/17-07-2026-rfc-diagnostico-sin-horarios.md`.
 
 Resumen del marco: el problema es un CSP (variables = materias, dominio = sus
-`option_group`s, restricción binaria = no-solape). Todos los filtros de
-`_meets_filters` son **unarios**: solo encogen dominios, nunca crean una
+`option_group`s, restricción binaria = no-solape). Todos los filtros
+(`compile_filters`) son **unarios**: solo encogen dominios, nunca crean una
 restricción nueva entre materias. Por eso un resultado vacío solo puede tener
 tres formas, y son exhaustivas:
 
@@ -20,14 +20,25 @@ problema persiste con F=∅ es estructural; si desaparece, es del filtro.
 Solo se ejecuta cuando el generador ya devolvió vacío, así que no cuesta nada en
 el camino feliz.
 """
-from typing import Any, Dict, List, Optional, Tuple
+import dataclasses
+import itertools
+import os
+import time
+from typing import Any, Callable, Collection, Dict, List, Optional, Sequence, Tuple
 
 from ..models import ClassOption
-from .schedule_generator import has_any_schedule, subject_key
+from .schedule_compiler import CompiledFilters, CompiledProblem, restrict_filters
+from .schedule_generator import (
+    FeasibilityOracle,
+    SearchTimeout,
+    pair_has_support,
+    prepare_filters,
+    subject_key,
+)
 
 # Claves de `filters` que NO son filtros del usuario: son parámetros de
 # generación y deben conservarse al preguntar "¿y sin filtros?".
-_NON_FILTER_KEYS = ("max_credits", "optimizeGaps", "optimizeFreeDays")
+_NON_FILTER_KEYS = ("max_credits", "optimizeGaps", "optimizeFreeDays", "rankBy", "rankWeights")
 
 # Filtros unarios por materia: {codigo_materia: [...]}.
 _PER_SUBJECT_FILTERS = ("selected_nrcs", "include_professors", "exclude_professors")
@@ -37,6 +48,57 @@ _PER_DAY_FILTERS = ("unavailable_slots",)
 
 Combos = List[List[List[ClassOption]]]
 
+# Tope de consultas al oráculo para buscar el conflicto mínimo (`_minimal_core`).
+# QuickXplain usa O(k log(n/k)) para un núcleo de k materias entre n: con las
+# materias de un semestre alcanza de sobra. Si se agota, no se reporta núcleo.
+MAX_CORE_PROBES = 40
+
+# Tope de consultas al oráculo para buscar la relajación mínima de filtros
+# (`_minimal_relaxation`). Cada consulta fallida descarta todas las
+# relajaciones contenidas en ella; si se agota, no se reporta relajación.
+MAX_RELAXATION_PROBES = 40
+
+
+# Plazo total (segundos) de un diagnóstico. Al vencer se responde con lo ya
+# demostrado y `partial: true`: el camino vacío nunca tarda más que esto.
+DIAGNOSIS_TIME_BUDGET = float(os.getenv("DIAGNOSIS_TIME_BUDGET", "2.0"))
+
+# Procesos para las consultas independientes (por materia, por filtro). Es el
+# mismo pool de la búsqueda en paralelo del generador.
+DIAGNOSIS_WORKERS = int(os.getenv("SCHEDULE_WORKERS", "1"))
+
+
+class _ProbeBudgetExceeded(Exception):
+    """Se agotaron las consultas de `_minimal_core`."""
+
+
+class _Prober:
+    """
+    Las consultas de un diagnóstico al oráculo, bajo un plazo común.
+
+    Una consulta que no alcanzó a responderse vuelve como None y marca el
+    diagnóstico como parcial: quien llama usa solo lo demostrado.
+    """
+
+    def __init__(self, oracle: FeasibilityOracle, deadline: float, workers: int) -> None:
+        self.oracle = oracle
+        self.deadline = deadline
+        self.workers = workers
+        self.partial = False
+
+    def many(self, queries: Sequence[Tuple[Sequence[int], Dict[str, Any]]]) -> List[Optional[bool]]:
+        """Respuestas de consultas independientes; se reparten entre los procesos."""
+        if time.monotonic() >= self.deadline:
+            answers: List[Optional[bool]] = [None] * len(queries)
+        else:
+            answers = self.oracle.has_any_many(queries, self.deadline, self.workers)
+        if None in answers:
+            self.partial = True
+        return answers
+
+    def one(self, subjects: Sequence[int], filters: Dict[str, Any]) -> Optional[bool]:
+        return self.many([(subjects, filters)])[0]
+
 
 def _subject_name(subject_combos: List[List[ClassOption]]) -> str:
     """Nombre visible de la materia a partir de sus combinaciones."""
@@ -71,16 +133,44 @@ def _user_filter_keys(filters: Dict[str, Any]) -> List[Tuple[str, str]]:
     return keys
 
 
-def _without_filter(filters: Dict[str, Any], ftype: str, target: str) -> Dict[str, Any]:
-    """Copia de `filters` sin ese filtro puntual."""
-    reduced = dict(filters)
-    section = dict(reduced.get(ftype) or {})
-    section.pop(target, None)
-    if section:
-        reduced[ftype] = section
-    else:
-        reduced.pop(ftype, None)
-    return reduced
+class _FilterUnits:
+    """
+    Los filtros del usuario compilados uno por uno (`_user_filter_keys`).
+
+    Como todos son unarios, los dominios de un conjunto de filtros son la
+    intersección de los dominios de cada uno: quitar filtros es volver a
+    intersecar bitsets, no volver a compilar. Por eso se compilan sin colapsar
+    los grupos equivalentes; se colapsa ya intersecado (`restrict_filters`).
+    El filtro residual de `include_professors` es por materia y se une igual.
+    """
+
+    def __init__(self, problem: CompiledProblem, filters: Dict[str, Any]) -> None:
+        self.keys = _user_filter_keys(filters)
+        decomposed = _PER_SUBJECT_FILTERS + _PER_DAY_FILTERS
+        # Lo que no se descompone (parámetros de generación) queda en la base.
+        base = {
+            k: v for k, v in filters.items()
+            if k not in decomposed or not isinstance(v, dict)
+        }
+        self._problem = problem
+        self._base, _ = prepare_filters(problem, base, collapse=False)
+        self._units = [
+            prepare_filters(problem, {**base, ftype: {target: filters[ftype][target]}}, collapse=False)[0]
+            for ftype, target in self.keys
+        ]
+
+    def without(self, removed: Collection[int]) -> CompiledFilters:
+        """Los filtros compilados sin los de índice en `removed`."""
+        domains = list(self._base.domains)
+        residual = dict(self._base.residual_include)
+        for index, unit in enumerate(self._units):
+            if index in removed:
+                continue
+            domains = [kept & allowed for kept, allowed in zip(domains, unit.domains)]
+            residual.update(unit.residual_include)
+        return restrict_filters(
+            dataclasses.replace(self._base, residual_include=residual), self._problem, domains
+        )
 
 
 def _filter_label(ftype: str, target: str, key_to_name: Dict[str, str]) -> Dict[str, str]:
@@ -94,7 +184,11 @@ def _filter_label(ftype: str, target: str, key_to_name: Dict[str, str]) -> Dict[
     }
 
 
-def _removal_options(combos: Combos, filters: Dict[str, Any]) -> List[str]:
+def _removal_options(
+    prober: _Prober,
+    names: List[str],
+    filters: Dict[str, Any],
+) -> List[str]:
     """
     Menú de "qué quitar": materias tales que, quitándolas, sí hay horarios.
 
@@ -102,28 +196,189 @@ def _removal_options(combos: Combos, filters: Dict[str, Any]) -> List[str]:
     contra el mismo estado. Puede salir vacío, y eso también informa — significa
     que quitar una sola no alcanza.
     """
-    options: List[str] = []
-    for i in range(len(combos)):
-        rest = combos[:i] + combos[i + 1:]
-        if rest and has_any_schedule(rest, filters):
-            options.append(_subject_name(combos[i]))
-    return options
+    answers = prober.many([
+        ([j for j in range(len(names)) if j != i], filters) for i in range(len(names))
+    ])
+    return [name for name, fits in zip(names, answers) if fits]
 
 
-def _blocking_filters(
-    combos: Combos,
+def _quickxplain(consistent: Callable[[List[int]], bool], constraints: List[int]) -> List[int]:
+    """
+    Un subconjunto mínimo inconsistente de `constraints` (QuickXplain).
+
+    Divide y vence: O(k log(n/k)) llamadas a `consistent` para un conflicto de
+    k elementos entre n. **Precondición:** `constraints` completo es
+    inconsistente y el vacío es consistente.
+    """
+    def _split(background: List[int], added: bool, pending: List[int]) -> List[int]:
+        # Si lo recién agregado al fondo ya choca, nada de `pending` hace falta.
+        if added and not consistent(background):
+            return []
+        if len(pending) == 1:
+            return pending
+        half = len(pending) // 2
+        first, second = pending[:half], pending[half:]
+        core_second = _split(background + first, True, second)
+        core_first = _split(background + core_second, bool(core_second), first)
+        return core_first + core_second
+
+    return _split([], False, constraints)
+
+
+def _minimal_core(
+    prober: _Prober,
+    names: List[str],
     filters: Dict[str, Any],
+) -> List[str]:
+    """
+    Un conjunto mínimo de materias que ya no caben juntas (QuickXplain).
+
+    Mínimo en el sentido de que quitar cualquiera de ellas deja de ser
+    conflicto: es lo que el estudiante tiene que resolver aunque ninguna
+    materia sola lo destrabe (`removalOptions` vacío). Divide y vence sobre
+    las materias; parte del conflicto más chico que el oráculo ya haya
+    demostrado (`known_conflict`), si hay uno.
+
+    **Precondición:** el conjunto completo no tiene horario con `filters`.
+    Acotado por `MAX_CORE_PROBES` y por el plazo del diagnóstico: si no
+    alcanza, devuelve vacío antes que un conjunto que no sea mínimo.
+    """
+    oracle = prober.oracle
+    known = oracle.known_conflict(filters)
+    candidates = known if known is not None else list(range(len(names)))
+    probes = 0
+
+    def _consistent(subset: List[int]) -> bool:
+        nonlocal probes
+        if not subset:
+            return True
+        if probes >= MAX_CORE_PROBES:
+            raise _ProbeBudgetExceeded
+        probes += 1
+        # Secuencial: cada consulta depende de la anterior.
+        return oracle.has_any(subset, filters, prober.deadline)
+
+    try:
+        core = _quickxplain(_consistent, candidates)
+    except _ProbeBudgetExceeded:
+        return []
+    except SearchTimeout:
+        prober.partial = True
+        return []
+    return [names[i] for i in sorted(core)]
+
+
+def _blocking_filters(
+    prober: _Prober,
+    units: _FilterUnits,
     key_to_name: Dict[str, str],
 ) -> List[Dict[str, str]]:
     """Filtros que, quitados por sí solos, desbloquean la generación."""
-    blocking: List[Dict[str, str]] = []
-    for ftype, target in _user_filter_keys(filters):
-        if has_any_schedule(combos, _without_filter(filters, ftype, target)):
-            blocking.append(_filter_label(ftype, target, key_to_name))
-    return blocking
+    everything = list(range(len(prober.oracle.problem.levels)))
+    answers = prober.many([
+        (everything, units.without({index})) for index in range(len(units.keys))
+    ])
+    return [
+        _filter_label(ftype, target, key_to_name)
+        for (ftype, target), unblocks in zip(units.keys, answers) if unblocks
+    ]
 
 
-def diagnose(combos: Combos, filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+def _min_hitting_set(conflicts: List[int], size: int) -> Optional[int]:
+    """
+    El conjunto más chico de filtros (máscara) que toca a todos los conflictos.
+
+    Fuerza bruta por tamaño creciente: los filtros de una petición son pocos.
+    None si algún conflicto está vacío (ninguna relajación lo rompe).
+    """
+    if 0 in conflicts:
+        return None
+    for width in range(1, size + 1):
+        for chosen in itertools.combinations(range(size), width):
+            mask = sum(1 << index for index in chosen)
+            if all(conflict & mask for conflict in conflicts):
+                return mask
+    return None
+
+
+def _minimal_relaxation(
+    prober: _Prober,
+    units: _FilterUnits,
+    key_to_name: Dict[str, str],
+) -> List[Dict[str, str]]:
+    """
+    El conjunto más chico de filtros que, quitados juntos, desbloquea.
+
+    Es lo que se ofrece cuando ningún filtro solo alcanza (`blockingFilters`
+    vacío). Hitting set implícito: cada relajación candidata que falla deja
+    un conflicto, que se achica con QuickXplain a un conjunto mínimo de
+    filtros que no caben juntos (de ahí hay que quitar al menos uno). La
+    siguiente candidata es la más chica que toca a todos los conflictos
+    conocidos, así que la primera que desbloquea es mínima. Las consultas
+    arman los filtros intersecando los dominios ya compilados
+    (`_FilterUnits`), sin recompilar.
+
+    **Precondición:** ningún filtro quitado solo desbloquea. Acotado por
+    `MAX_RELAXATION_PROBES` y por el plazo; si no alcanza, o si ni sin
+    filtros hay horario, devuelve vacío antes que un conjunto que no sea mínimo.
+    """
+    oracle = prober.oracle
+    everything = list(range(len(oracle.problem.levels)))
+    size = len(units.keys)
+    full = (1 << size) - 1
+    probes = 0
+
+    def _consistent(kept: List[int]) -> bool:
+        nonlocal probes
+        if probes >= MAX_RELAXATION_PROBES:
+            raise _ProbeBudgetExceeded
+        probes += 1
+        removed = set(range(size)).difference(kept)
+        return oracle.has_any(everything, units.without(removed), prober.deadline)
+
+    # Quitar uno solo no alcanzó: de los demás hay que quitar alguno más.
+    conflicts = [full & ~(1 << index) for index in range(size)]
+    try:
+        if not _consistent([]):
+            return []
+        while True:
+            candidate = _min_hitting_set(conflicts, size)
+            if candidate is None:
+                return []
+            kept = [index for index in range(size) if not candidate >> index & 1]
+            if _consistent(kept):
+                break
+            conflicts.append(sum(1 << index for index in _quickxplain(_consistent, kept)))
+    except _ProbeBudgetExceeded:
+        return []
+    except SearchTimeout:
+        prober.partial = True
+        return []
+    return [
+        _filter_label(ftype, target, key_to_name)
+        for index, (ftype, target) in enumerate(units.keys) if candidate >> index & 1
+    ]
+
+
+def _filter_advice(
+    prober: _Prober,
+    filters: Dict[str, Any],
+    key_to_name: Dict[str, str],
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """(`blockingFilters`, `relaxation`): qué filtro quitar, o qué filtros juntos."""
+    units = _FilterUnits(prober.oracle.problem, filters)
+    blocking = _blocking_filters(prober, units, key_to_name)
+    if blocking or prober.partial:
+        return blocking, []
+    return blocking, _minimal_relaxation(prober, units, key_to_name)
+
+
+def diagnose(
+    combos: Combos,
+    filters: Dict[str, Any],
+    time_budget: float = DIAGNOSIS_TIME_BUDGET,
+    workers: int = DIAGNOSIS_WORKERS,
+) -> Optional[Dict[str, Any]]:
     """
     Explica un resultado vacío.
 
@@ -134,6 +389,12 @@ def diagnose(combos: Combos, filters: Dict[str, Any]) -> Optional[Dict[str, Any]
 
     La cascada va de específico/barato a vago/caro (U1 → U2 → U3); la primera
     forma que dispare manda, porque cualquiera de ellas ya explica el vacío.
+
+    Las consultas independientes de cada paso (una por materia, por filtro)
+    se reparten en `workers` procesos, y todo el diagnóstico corre bajo
+    `time_budget` segundos. Si el plazo vence, se responde con lo demostrado
+    hasta ahí y `partial: true`: las listas pueden quedar incompletas, pero
+    nada de lo que traen es falso.
     """
     if not combos:
         return None
@@ -142,44 +403,58 @@ def diagnose(combos: Combos, filters: Dict[str, Any]) -> Optional[Dict[str, Any]
     has_user_filters = bool(_user_filter_keys(filters))
     names = [_subject_name(c) for c in combos]
     key_to_name = {_subject_key(c): _subject_name(c) for c in combos}
+    everything = list(range(len(combos)))
+
+    # Todas las preguntas "¿hay horario?" van al mismo oráculo: compila una
+    # vez y lo que demuestra una consulta (nogoods) lo aprovechan las demás.
+    prober = _Prober(FeasibilityOracle(combos), time.monotonic() + time_budget, workers)
 
     # ── U1: ¿alguna materia se quedó sin opciones ella sola? ────────────────
     # Barato (1 materia por llamada) y es lo más específico que se puede decir.
-    dead = [
-        names[i] for i in range(len(combos))
-        if not has_any_schedule([combos[i]], filters)
-    ]
+    alone = prober.many([([i], filters) for i in everything])
+    dead = [name for name, fits in zip(names, alone) if fits is False]
     if dead:
         # Sin filtros esto es imposible: un grupo solo nunca choca consigo mismo
         # (`_has_conflict` salta misma materia+grupo), así que el dominio no
         # puede quedar vacío. Si igual pasara, es un problema de datos.
         blame = "filtros" if has_user_filters else "datos"
+        blocking, relaxation = (
+            _filter_advice(prober, filters, key_to_name) if blame == "filtros" else ([], [])
+        )
         return {
             "shape": "materia_sin_opciones",
             "blame": blame,
             "subjects": dead,
             "pairs": [],
             "removalOptions": dead,
-            "blockingFilters": (
-                _blocking_filters(combos, filters, key_to_name)
-                if blame == "filtros" else []
-            ),
+            "blockingFilters": blocking,
+            "relaxation": relaxation,
+            "core": [],
+            "partial": prober.partial,
         }
 
     # ── U2: ¿algún par no tiene ninguna combinación compatible? ─────────────
-    # n(n-1)/2 llamadas de 2 materias: microscópicas.
+    # n(n-1)/2 preguntas de 2 materias. Se compila una sola vez y cada par se
+    # responde con la matriz de compatibilidad, sin volver a buscar.
+    problem = prober.oracle.problem
+    compiled_filters, _ = prepare_filters(problem, filters)
+    compiled_bare, _ = prepare_filters(problem, bare)
     pairs: List[List[str]] = []
     structural_pair = False
     for i in range(len(combos)):
         for j in range(i + 1, len(combos)):
-            if has_any_schedule([combos[i], combos[j]], filters):
+            if pair_has_support(problem, compiled_filters, i, j):
                 continue
             pairs.append([names[i], names[j]])
             # La culpa, par por par: ¿chocan también sin filtros?
-            if not has_any_schedule([combos[i], combos[j]], bare):
+            if not pair_has_support(problem, compiled_bare, i, j):
                 structural_pair = True
 
     if pairs:
+        removal = _removal_options(prober, names, filters)
+        blocking, relaxation = (
+            _filter_advice(prober, filters, key_to_name) if not structural_pair else ([], [])
+        )
         return {
             "shape": "par_incompatible",
             # Si algún par choca hasta sin filtros, el problema es estructural
@@ -187,25 +462,35 @@ def diagnose(combos: Combos, filters: Dict[str, Any]) -> Optional[Dict[str, Any]
             "blame": "estructural" if structural_pair else "filtros",
             "subjects": [],
             "pairs": pairs,
-            "removalOptions": _removal_options(combos, filters),
-            "blockingFilters": (
-                _blocking_filters(combos, filters, key_to_name)
-                if not structural_pair else []
-            ),
+            "removalOptions": removal,
+            "blockingFilters": blocking,
+            "relaxation": relaxation,
+            "core": [],
+            "partial": prober.partial,
         }
 
     # ── U3: todos los pares tienen soporte y aun así no cabe (palomar) ──────
     # Es el caso común con varios cursos por materia. No hay culpable individual:
     # lo único honesto es el menú de qué quitar.
-    blame = "estructural" if not has_any_schedule(combos, bare) else "filtros"
+    # Sin filtros del usuario, "sin filtros" es la misma pregunta que ya dio
+    # vacío. Si el plazo no alcanza para saberlo, se da por culpa de los
+    # filtros: el mensaje ofrece relajarlos y también quitar materias.
+    bare_fits = prober.one(everything, bare) if has_user_filters else False
+    blame = "estructural" if bare_fits is False else "filtros"
+    removal = _removal_options(prober, names, filters)
+    blocking, relaxation = (
+        _filter_advice(prober, filters, key_to_name) if blame == "filtros" else ([], [])
+    )
     return {
         "shape": "conjunto_incompatible",
         "blame": blame,
         "subjects": names,
         "pairs": [],
-        "removalOptions": _removal_options(combos, filters),
-        "blockingFilters": (
-            _blocking_filters(combos, filters, key_to_name)
-            if blame == "filtros" else []
-        ),
+        "removalOptions": removal,
+        "blockingFilters": blocking,
+        "relaxation": relaxation,
+        # Si ninguna materia sola lo destraba, al menos el grupo más chico que
+        # no cabe junto: de ahí hay que quitar alguna.
+        "core": _minimal_core(prober, names, filters) if not removal and not prober.partial else [],
+        "partial": prober.partial,
     }
@@ -5,53 +5,51 @@ Contiene la lógica principal para encontrar combinaciones de clases válidas
 (horarios) basadas en las materias seleccionadas, aplicando filtros y optimizaciones.
 """
 
-from typing import List, Dict, Tuple, Any, cast
-from datetime import time
-from ..models import ClassOption, Schedule
+import dataclasses
+import heapq
+import itertools
+import json
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from ..models import ClassOption
+# `subject_key` vive en el compilador (la necesita para llavear los grupos) y se
+# re-exporta aquí, donde la buscan el diagnóstico y las rutas.
+from .schedule_compiler import (
+    CompiledFilters,
+    CompiledGroup,
+    CompiledProblem,
+    compile_filters,
+    compile_problem,
+    iter_bits,
+    option_signature,
+    subject_key,
+)
 
-# --- Funciones de Ayuda para Manejar Tiempos ---
+# Tolerancia del tope de créditos (`CompiledFilters.max_credits`): absorbe el
+# error de coma flotante para que una suma que da exactamente el tope (ej.
+# 19.5 + 0.5) no se descarte.
+EPSILON = 1e-9
 
-# Convierte una cadena de texto 'HH:MM' a un objeto `time` de Python.
-def _parse_time(time_str: str) -> time:
-    """Convierte una cadena de texto 'HH:MM' a un objeto `time`."""
-    parts = time_str.split(':')
-    return time(hour=int(parts[0]), minute=int(parts[1]))
 
-
-# Convierte un rango de tiempo 'HH:MM - HH:MM' a una tupla de objetos `time`.
-def _parse_time_range(time_range_str: str) -> Tuple[time, time]:
-    """Convierte un rango de tiempo 'HH:MM - HH:MM' en una tupla de objetos `time`."""
-    start_str, end_str = time_range_str.split(' - ')
-    return _parse_time(start_str.strip()), _parse_time(end_str.strip())
-
-# --- Función para verificar solapamientos de horarios ---
-def subject_key(option: ClassOption) -> str:
+class GroupedSchedule(NamedTuple):
     """
-    Identidad de la materia de una clase: el par (código, nombre).
-
-    Ninguno de los dos identifica una materia por sí solo —así lo declara la PK
-    compuesta `materia_pkey (codigomateria, nombre)` y por eso la API pide
-    ambos—: hay nombres repartidos entre varios códigos ("Práctica Profesional"
-    aparece en 14 carreras) y códigos con varios nombres (`RULEI02B` es "Inglés
-    Ii" e "Inglés Ii - Derecho"). Agrupar los filtros por el código solo hacía
-    que el filtro de una materia se le aplicara a la otra.
+    Un horario fusionado con estructura, en vez de la lista plana.
 
-    Debe coincidir con `Subject.key` / `ClassOption.subjectKey` del frontend: es
-    la llave con la que llegan los filtros por materia.
+    Las opciones de `alternatives`, en orden y sin repetir NRC, son justo las
+    que la fusión agrega al final de la lista plana (ver `_group_alternatives`
+    y `_merge_by_signature`).
     """
-    return f"{option.subject_code}|{option.subject_name}"
-
-
-def _schedules_overlap(schedule1: Schedule, schedule2: Schedule) -> bool:
-    """Verifica si dos bloques de clase se solapan en el tiempo."""
-    if schedule1.day != schedule2.day:
-        return False
-    
-    start1, end1 = _parse_time_range(schedule1.time)
-    start2, end2 = _parse_time_range(schedule2.time)
-
-    # Hay solapamiento si uno comienza antes de que el otro termine.
-    return start1 < end2 and end1 > start2
+    # Por materia, las opciones del grupo del horario base.
+    base: List[List[ClassOption]]
+    # Grupos equivalentes en el orden en que la fusión agrega sus NRCs: la
+    # posición de su materia en `base` y sus opciones.
+    alternatives: List[Tuple[int, List[ClassOption]]]
 
 # --- Función para crear la "Huella Digital" de un Horario ---
 
@@ -63,13 +61,8 @@ def _get_schedule_signature(schedule: List[ClassOption]) -> str:
     materias, profesores y bloques de tiempo), aunque tengan NRCs diferentes.
     """
     # El conjunto contendrá cadenas que representan cada bloque de clase.
-    time_slots: set[str] = set()
-    for option in schedule:
-        signature_part = f"{option.subject_code}:{option.professor}"
-        for s in option.schedules:
-            signature_part += f"@{s.day}:{s.time.replace(' ', '')}"
-        time_slots.add(signature_part)
-    
+    time_slots = {option_signature(option) for option in schedule}
+
     # Se ordena para garantizar que la firma sea consistente.
     return ";".join(sorted(list(time_slots)))
 
@@ -140,99 +133,474 @@ def _expand_selected_nrcs(
 
 def find_valid_schedules(
     combinations_per_subject: List[List[List[ClassOption]]], 
-    filters: Dict[str, Any]
-) -> List[List[ClassOption]]:
+    filters: Dict[str, Any],
+    propagate: bool = True,
+    workers: int = 1,
+    grouped: bool = False,
+) -> Union[List[List[ClassOption]], List[GroupedSchedule]]:
     """
     Encuentra todos los horarios válidos usando un algoritmo de backtracking.
     
     Aplica filtros, fusiona horarios duplicados y los optimiza según las
-    preferencias del usuario.
+    preferencias del usuario. `propagate` activa la propagación de `_search`
+    (no cambia el resultado, solo cuánto se explora).
+
+    Con `workers` > 1 la búsqueda de una petición grande se reparte entre
+    procesos (ver `_parallel_leaves`); el resultado es idéntico al secuencial.
+
+    Con `grouped` cada horario sale como `GroupedSchedule` en vez de la lista
+    fusionada: los mismos horarios, en el mismo orden.
     """
-    
-    # Expandir NRCs seleccionados si es necesario (teóricos con sus labs)
-    if 'selected_nrcs' in filters:
-        expanded_nrcs = _expand_selected_nrcs(
-            combinations_per_subject, 
-            filters['selected_nrcs']
-        )
-        # Actualizar el filtro con los NRCs expandidos
-        filters = {**filters, 'selected_nrcs': expanded_nrcs}
-    
-    valid_schedules: List[List[ClassOption]] = []
-    # El límite de créditos se obtiene de los filtros, con un valor por defecto.
-    # Es float: las materias pueden tener créditos fraccionarios (ej. 0.5), así
-    # que un horario puede sumar 19.5. EPSILON absorbe el error de coma flotante
-    # para que una suma que da exactamente el tope no se descarte.
-    max_credits = float(filters.get("max_credits", 20))
-    EPSILON = 1e-9
-
-    def _backtrack(level: int, current_schedule: List[ClassOption], current_credits: float):
-        """Función recursiva que construye los horarios paso a paso."""
-        # Condición de éxito: se ha procesado una combinación para cada materia.
-        if level == len(combinations_per_subject):
-            # Aplica filtros de profesor/hora al horario completo.
-            if _meets_filters(current_schedule, filters):
-                valid_schedules.append(list(current_schedule))
-            return
+    problem, compiled_filters, filters = _prepare(combinations_per_subject, filters)
+    return _all_schedules(problem, compiled_filters, filters, propagate, workers, grouped)
 
-        # Itera sobre cada grupo de opciones para la materia actual.
-        for option_group in combinations_per_subject[level]:
-            
-            # Poda por créditos: si añadir esta materia excede el límite, se descarta.
-            credits_for_this_group = option_group[0].credits
-            if current_credits + credits_for_this_group > max_credits + EPSILON:
-                continue
 
-            # Si no hay conflicto de horario, se añade el grupo y se sigue al siguiente nivel.
-            if not _has_conflict(current_schedule, option_group):
-                current_schedule.extend(option_group)
-                _backtrack(level + 1, current_schedule, current_credits + credits_for_this_group)
-                # Backtrack: se elimina el grupo para probar la siguiente opción.
-                for _ in range(len(option_group)):
-                    current_schedule.pop()
+def iter_valid_schedules(
+    combinations_per_subject: List[List[List[ClassOption]]],
+    filters: Dict[str, Any],
+    merge: bool = True,
+    propagate: bool = True,
+) -> Iterator[List[ClassOption]]:
+    """
+    Produce los horarios válidos uno a uno, sin armar la lista completa.
+
+    Sale en el orden canónico (el de `find_valid_schedules` cuando no se
+    ordena por puntaje), así que cortar el generador —`itertools.islice` para
+    una página, contar, muestrear, transmitir— solo cuesta lo consumido. No
+    ordena por puntaje: eso exige ver todos los horarios (para los mejores K,
+    ver `find_top_schedules`).
+
+    Con `merge` cada horario sale ya fusionado con sus equivalentes (mismos
+    NRCs alternos que `find_valid_schedules`); sin él, sale cada combinación
+    por separado, agrupadas por horario fusionado.
+
+    Si no se pudo colapsar antes de buscar (ver `_collapse_equivalent`), la
+    fusión por firma necesita todas las hojas: en ese caso, con `merge`, se
+    enumera todo antes de producir el primero.
+    """
+    problem, compiled_filters, filters = _prepare(combinations_per_subject, filters)
+
+    # Recorrido estático: los horarios salen directamente en orden canónico.
+    search = _search(problem, compiled_filters, propagate, dynamic_order=False)
+    alternatives = compiled_filters.alternatives
+
+    if alternatives is None:
+        if merge:
+            valid_schedules = [list(schedule) for schedule in search]
+            for schedule, _ in _merge_by_signature(valid_schedules):
+                yield schedule
+        else:
+            for schedule in search:
+                yield [opt for g in schedule for opt in g.options]
+        return
+
+    for schedule in search:
+        if merge:
+            yield _expand_alternatives(schedule, alternatives)
+            continue
+        members = [[g] + alternatives.get(g.id, []) for g in schedule]
+        for combination in itertools.product(*members):
+            yield [opt for g in combination for opt in g.options]
+
+
+def find_top_schedules(
+    combinations_per_subject: List[List[List[ClassOption]]],
+    filters: Dict[str, Any],
+    k: int,
+    propagate: bool = True,
+    grouped: bool = False,
+) -> Tuple[Union[List[List[ClassOption]], List[GroupedSchedule]], bool]:
+    """
+    Los K mejores horarios, sin ordenar ni guardar todos los demás.
+
+    Devuelve exactamente los primeros K de `find_valid_schedules` (mismo
+    puntaje y, en empates, mismo orden canónico) y si había más de K. Durante
+    la búsqueda solo se conserva un heap con los K mejores hasta el momento:
+    memoria acotada y O(n log K) para el ranking en vez de ordenar los n.
+    Además, la búsqueda es branch-and-bound: no baja a subárboles que ya no
+    pueden entrar entre los K (ver `_score_upper_bound`). `k` debe ser positivo.
+    `grouped` como en `find_valid_schedules`.
+    """
+    problem, compiled_filters, filters = _prepare(combinations_per_subject, filters)
+
+    if compiled_filters.alternatives is None:
+        # Sin colapso, la fusión por firma junta hojas que pueden caer lejos una
+        # de otra: hace falta tenerlas todas antes de cortar.
+        schedules = _all_schedules(problem, compiled_filters, filters, propagate, grouped=grouped)
+        return schedules[:k], len(schedules) > k
+
+    # Con grupos equivalentes colapsados, cada hoja es un horario ya fusionado.
+    # El heap es de mínimos con el peor de los K en la raíz: el mejor horario
+    # tiene mayor puntaje y, a igual puntaje, menor llave canónica (por eso se
+    # guarda negada).
+    optimize = ranks_schedules(filters)
+    best: List[Tuple[Tuple[float, ...], Tuple[int, ...], List[CompiledGroup]]] = []
+    found = 0
+
+    # Branch-and-bound: se descarta el subárbol cuya cota superior de puntaje
+    # ya no alcanza al K-ésimo mejor. Si la cota empata (siempre, cuando no se
+    # pidió ordenar por puntaje), el subárbol aún podría ganar por orden
+    # canónico: se descarta solo si ni su mejor llave posible (lo asignado y, en
+    # lo pendiente, el menor grupo compatible) le gana a la del K-ésimo. Solo se
+    # poda una vez hallados más de K horarios; así `truncated` sigue siendo exacto.
+    # Un horario completo no se poda: compararlo con el heap decide lo mismo y
+    # puntuarlo cuesta menos que la cota.
+    # Con criterios con nombre, la búsqueda acumula lo que puntúa cada hoja.
+    ranking = parse_ranking(filters)
+    tracker = _RankingTracker(problem, compiled_filters, ranking) if ranking is not None else None
+    upper_bound: Optional[Callable[..., Tuple[float, ...]]] = None
+    scorer: Optional[Callable[[Sequence[CompiledGroup]], Tuple[float, ...]]] = None
+    if tracker is not None:
+        upper_bound, scorer = tracker.upper_bound, tracker.key
+    elif optimize:
+        upper_bound = _score_upper_bound(problem, compiled_filters, filters)
+        scorer = _schedule_scorer(problem, filters)
+    domains = compiled_filters.domains
+
+    def prune(
+        assignment: List[Optional[CompiledGroup]],
+        rest: Tuple[int, ...],
+        allowed: int,
+    ) -> bool:
+        if found <= k or not rest:
+            return False
+        worst_score, worst_key, _ = best[0]
+        if upper_bound is not None:
+            bound = upper_bound(assignment, rest, allowed)
+            if bound != worst_score:
+                return bound < worst_score
+        best_key = []
+        for j, g in enumerate(assignment):
+            if g is None:
+                pending = domains[j] & allowed
+                best_key.append(-((pending & -pending).bit_length() - 1))
+            else:
+                best_key.append(-g.id)
+        return tuple(best_key) <= worst_key
+
+    for schedule in _search(problem, compiled_filters, propagate, prune=prune, tracker=tracker):
+        found += 1
+        score = scorer(schedule) if scorer is not None else (0.0, 0.0)
+        entry = (score, tuple(-g.id for g in schedule))
+        if len(best) < k:
+            heapq.heappush(best, (*entry, list(schedule)))
+        elif entry > best[0][:2]:
+            heapq.heapreplace(best, (*entry, list(schedule)))
+
+    best.sort(reverse=True)
+    alternatives = compiled_filters.alternatives
+    expand = _group_alternatives if grouped else _expand_alternatives
+    top = [expand(schedule, alternatives) for _, _, schedule in best]
+    return top, found > k
+
+
+def _all_schedules(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    filters: Dict[str, Any],
+    propagate: bool,
+    workers: int = 1,
+    grouped: bool = False,
+) -> Union[List[List[ClassOption]], List[GroupedSchedule]]:
+    """Todos los horarios válidos, fusionados y en el orden de la respuesta."""
+    # La búsqueda reutiliza la misma lista para el horario en curso: se copia.
+    # El orden de exploración es heurístico; el resultado se devuelve siempre
+    # en el orden canónico, el mismo que daría el recorrido materia por materia.
+    # Con criterios con nombre, la búsqueda secuencial deja la llave de cada
+    # hoja ya calculada (por `id` de su copia, que sobrevive a la fusión).
+    ranking = parse_ranking(filters)
+    tracker = _RankingTracker(problem, compiled_filters, ranking) if ranking is not None else None
+    keys: Dict[int, Tuple[float, ...]] = {}
+
+    leaves = _parallel_leaves(problem, compiled_filters, propagate, workers)
+    if leaves is not None:
+        groups = problem.groups
+        valid_schedules = [[groups[i] for i in key] for key in leaves]
+    else:
+        valid_schedules = []
+        for schedule in _search(problem, compiled_filters, propagate, tracker=tracker):
+            valid_schedules.append(list(schedule))
+            if tracker is not None:
+                keys[id(valid_schedules[-1])] = tracker.key(schedule)
+    valid_schedules.sort(key=_canonical_key)
 
-    # Inicia el algoritmo de backtracking.
-    _backtrack(0, [], 0.0)
-    
     # --- PASO DE FUSIÓN DE HORARIOS ---
+    # Los grupos equivalentes ya se colapsaron antes de buscar: cada hoja es una
+    # firma distinta y basta con agregarle los NRCs alternativos.
+    alternatives = compiled_filters.alternatives
+    if alternatives is not None:
+        expand = _group_alternatives if grouped else _expand_alternatives
+        merged_schedules = [
+            (expand(schedule, alternatives), schedule)
+            for schedule in valid_schedules
+        ]
+    else:
+        merged_schedules = _merge_by_signature(valid_schedules, grouped)
+
+    # --- PASO DE OPTIMIZACIÓN Y ORDENAMIENTO ---
+    # Ordena los horarios según la puntuación si los filtros de optimización
+    # están activos (mayor puntuación primero), puntuándolos en bloque.
+    if tracker is not None:
+        if leaves is not None:
+            # Los procesos devuelven solo ids: se puntúa aquí.
+            keys = {id(base): tracker.score(base) for _, base in merged_schedules}
+        merged_schedules.sort(key=lambda m: keys[id(m[1])], reverse=True)
+    elif ranks_schedules(filters):
+        order = _score_order([base for _, base in merged_schedules], problem, filters)
+        merged_schedules = [merged_schedules[i] for i in order]
+
+    return [schedule for schedule, _ in merged_schedules]
+
+
+# --- Búsqueda en paralelo ---
+
+# Debajo de este espacio de búsqueda (producto de los dominios ya filtrados) no
+# compensa repartir: el costo de enviar el problema a otro proceso supera al de
+# buscar aquí mismo.
+PARALLEL_MIN_SPACE = 200_000
+
+# Subárboles por proceso: más de uno para repartir bien cuando unos son mucho
+# más grandes que otros.
+_TASKS_PER_WORKER = 4
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    El pool de procesos del módulo, creado la primera vez que se pide.
+
+    Se reutiliza entre peticiones: levantar procesos cuesta más que una
+    búsqueda mediana. Usa `spawn` porque el servidor ya corre hilos cuando se
+    crea, y `fork` con hilos vivos puede heredar locks tomados.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Suelta un pool roto: si un proceso muere (OOM, segfault), el pool ya no
+    acepta nada y cada envío lanza `BrokenProcessPool`. El próximo `_get_pool`
+    crea uno nuevo, en vez de fallar hasta reiniciar el servidor.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parallel_leaves(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    propagate: bool,
+    workers: int,
+) -> Optional[List[Tuple[int, ...]]]:
+    """
+    Las hojas válidas (como `_canonical_key`) buscadas en `workers` procesos.
+
+    El árbol se parte en sus primeros niveles: cada tarea fija un grupo de la
+    primera materia (y, si eso no alcanza para repartir, también uno de la
+    segunda) restringiendo su dominio a ese único bit. Los subárboles son
+    disjuntos y cubren todo el árbol, así que la unión de sus hojas es
+    exactamente lo que produce `_search` en un solo proceso; el orden lo fija
+    después el `sort` canónico de `_all_schedules`.
+
+    A los procesos no viajan los `ClassOption`: se envía el problema sin
+    opciones, serializado una sola vez, y vuelven solo tuplas de ids.
+
+    Devuelve None si no conviene paralelizar (un solo proceso, una sola
+    materia o un espacio de búsqueda chico) o si se rompió el pool: quien
+    llama busca en secuencial.
+    """
+    domains = compiled_filters.domains
+    if workers <= 1 or len(domains) < 2:
+        return None
+    space = 1
+    for domain in domains:
+        space *= domain.bit_count()
+    if space < PARALLEL_MIN_SPACE:
+        return None
+
+    wanted = workers * _TASKS_PER_WORKER
+    compat = problem.compat
+    prefixes: List[Tuple[int, ...]] = [(g,) for g in iter_bits(domains[0])]
+    if len(prefixes) < wanted:
+        prefixes = [
+            (g, h)
+            for g in iter_bits(domains[0])
+            for h in iter_bits(domains[1] & compat[g])
+        ]
+    if not prefixes:
+        return []  # Ninguna pareja de las dos primeras materias es compatible.
+
+    tasks: List[List[List[int]]] = [[] for _ in range(min(wanted, len(prefixes)))]
+    for position, prefix in enumerate(prefixes):
+        task_domains = list(domains)
+        for level, group_id in enumerate(prefix):
+            task_domains[level] = 1 << group_id
+        # Reparto intercalado: los subárboles vecinos suelen pesar parecido.
+        tasks[position % len(tasks)].append(task_domains)
+
+    encoded = pickle.dumps(
+        (_compact(problem), dataclasses.replace(compiled_filters, alternatives=None)),
+        pickle.HIGHEST_PROTOCOL,
+    )
+    pool = _get_pool(workers)
+    try:
+        futures = [pool.submit(_search_subtrees, encoded, task, propagate) for task in tasks]
+        return [key for future in futures for key in future.result()]
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return None
+
+
+def _compact(problem: CompiledProblem) -> CompiledProblem:
+    """
+    Copia del problema con lo justo para buscar, para enviarla a otro proceso.
+
+    Sin los `ClassOption` de cada grupo: la búsqueda solo mira ids, créditos,
+    compatibilidad y, para el filtro residual, materia y profesores. (De los
+    filtros compilados tampoco viajan los grupos colapsados, `alternatives`.)
+    """
+    groups = [dataclasses.replace(g, options=[]) for g in problem.groups]
+    levels = [[groups[g.id] for g in level] for level in problem.levels]
+    return dataclasses.replace(problem, groups=groups, levels=levels)
+
+
+def _search_subtrees(
+    encoded: bytes,
+    tasks: List[List[int]],
+    propagate: bool,
+) -> List[Tuple[int, ...]]:
+    """Corre en el proceso hijo: las hojas de cada subárbol (dominios) de `tasks`."""
+    problem, compiled_filters = pickle.loads(encoded)
+    leaves: List[Tuple[int, ...]] = []
+    for domains in tasks:
+        task_filters = dataclasses.replace(compiled_filters, domains=domains)
+        leaves.extend(_canonical_key(s) for s in _search(problem, task_filters, propagate))
+    return leaves
+
+
+def _expand_alternatives(
+    schedule: List[CompiledGroup],
+    alternatives: Dict[int, List[CompiledGroup]],
+) -> List[ClassOption]:
+    """
+    Las opciones de un horario más las de sus grupos equivalentes.
+
+    Reproduce el orden de la fusión por firma: tras el horario base, la
+    combinación que sigue en orden canónico cambia primero la última materia,
+    así que los NRCs nuevos aparecen de la última materia a la primera y, en
+    cada una, en el orden de sus grupos.
+    """
+    base_schedule = [opt for g in schedule for opt in g.options]
+    if not alternatives:
+        return base_schedule
+
+    base_nrcs: Optional[set] = None
+    for group in reversed(schedule):
+        for member in alternatives.get(group.id, ()):
+            if base_nrcs is None:
+                base_nrcs = {opt.nrc for opt in base_schedule}
+            for option in member.options:
+                if option.nrc not in base_nrcs:
+                    base_schedule.append(option)
+                    base_nrcs.add(option.nrc)
+    return base_schedule
+
+
+def _group_alternatives(
+    schedule: List[CompiledGroup],
+    alternatives: Dict[int, List[CompiledGroup]],
+) -> GroupedSchedule:
+    """
+    Lo mismo que `_expand_alternatives`, pero sin aplanar: los grupos del
+    horario y, aparte, sus equivalentes en el mismo orden (de la última materia
+    a la primera).
+    """
+    return GroupedSchedule(
+        base=[g.options for g in schedule],
+        alternatives=[
+            (position, member.options)
+            for position in reversed(range(len(schedule)))
+            for member in alternatives.get(schedule[position].id, ())
+        ],
+    )
+
+
+def _merge_by_signature(
+    valid_schedules: List[List[CompiledGroup]],
+    grouped: bool = False,
+) -> List[Tuple[Any, List[CompiledGroup]]]:
+    """
+    Fusión sobre la firma completa, para cuando no se pudo colapsar antes de
+    buscar (materias con código repetido, ver `_collapse_equivalent`).
+
+    Con `grouped` cada horario fusionado sale como `GroupedSchedule`: los
+    grupos distintos que aportan los horarios de la misma firma, en el orden
+    en que la fusión plana agrega sus NRCs.
+    """
     # Agrupa horarios por su "huella digital" para fusionar NRCs de opciones idénticas.
-    grouped_schedules: Dict[str, List[List[ClassOption]]] = {}
+    grouped_schedules: Dict[str, List[List[CompiledGroup]]] = {}
     for schedule in valid_schedules:
-        signature = _get_schedule_signature(schedule)
+        signature = _get_schedule_signature([opt for g in schedule for opt in g.options])
         grouped_schedules.setdefault(signature, []).append(schedule)
-        
-    # Fusiona los grupos en un único horario consolidado por firma.
-    merged_schedules: List[List[ClassOption]] = []
+
+    # Fusiona los grupos en un único horario consolidado por firma. Se conserva
+    # el horario base compilado: es sobre el que se calcula el puntaje.
+    merged_schedules: List[Tuple[Any, List[CompiledGroup]]] = []
     for group in grouped_schedules.values():
         if not group:
             continue
-        
-        base_schedule = group[0]
-        
+
+        base_groups = group[0]
+        if grouped:
+            # Cada horario de la firma agrega, materia por materia, los grupos
+            # que aún no aparecieron: el orden de la fusión plana de abajo.
+            seen = [[g] for g in base_groups]
+            extra: List[Tuple[int, List[ClassOption]]] = []
+            for other_schedule in group[1:]:
+                for position, g in enumerate(other_schedule):
+                    if g not in seen[position]:
+                        seen[position].append(g)
+                        extra.append((position, g.options))
+            merged_schedules.append(
+                (GroupedSchedule([g.options for g in base_groups], extra), base_groups)
+            )
+            continue
+
+        base_schedule = [opt for g in base_groups for opt in g.options]
+
         if len(group) > 1:
             base_nrcs = {opt.nrc for opt in base_schedule}
             for other_schedule in group[1:]:
-                for option in other_schedule:
+                for option in (opt for g in other_schedule for opt in g.options):
                     if option.nrc not in base_nrcs:
                         base_schedule.append(option)
                         base_nrcs.add(option.nrc)
-                        
-        merged_schedules.append(base_schedule)
-            
-    # --- PASO DE OPTIMIZACIÓN Y ORDENAMIENTO ---
-    # Ordena los horarios según la puntuación si los filtros de optimización están activos.
-    if filters.get('optimizeGaps', False) or filters.get('optimizeFreeDays', False):
-        merged_schedules.sort(
-            key=lambda s: _calculate_schedule_score(s, filters),
-            reverse=True  # Mayor puntuación es mejor.
-        )
+
+        merged_schedules.append((base_schedule, base_groups))
 
     return merged_schedules
 
 
 def has_any_schedule(
     combinations_per_subject: List[List[List[ClassOption]]],
-    filters: Dict[str, Any]
+    filters: Dict[str, Any],
+    propagate: bool = True,
 ) -> bool:
     """
     ¿Existe AL MENOS UN horario válido? Corta al encontrar el primero.
@@ -242,162 +610,1374 @@ def has_any_schedule(
     una hoja válida responde True. Eso es lo que hace viable llamarlo decenas de
     veces sobre subconjuntos.
 
-    Replica **exactamente** la noción de validez del generador (mismas podas y el
-    mismo `_meets_filters`); si divergiera, el diagnóstico podría contradecir al
+    Replica **exactamente** la noción de validez del generador (mismos dominios
+    filtrados y el mismo `_meets_filters`); si divergiera, el diagnóstico podría contradecir al
     resultado que se le está explicando.
     """
     if not combinations_per_subject:
         return False
 
-    if 'selected_nrcs' in filters:
-        expanded_nrcs = _expand_selected_nrcs(
-            combinations_per_subject, filters['selected_nrcs']
+    problem, compiled_filters, _ = _prepare(combinations_per_subject, filters)
+    search = _search(problem, compiled_filters, propagate, lcv=True)
+    return next(search, None) is not None
+
+
+# Tope de nogoods por tabla: la memoria de un diagnóstico queda acotada aunque
+# el problema sea enorme. Pasado el tope se sigue buscando, sin aprender más.
+MAX_NOGOODS = 20_000
+
+# Solo se aprenden nogoods de hasta tantos grupos. Los largos casi nunca se
+# repiten (en el palomar hay uno por cada forma de repartir las franjas) y
+# revisarlos cuesta más que volver a demostrarlos.
+MAX_NOGOOD_SIZE = 3
+
+
+# Cada cuántos nodos mira el reloj una búsqueda con plazo (`_cbj_search`).
+_DEADLINE_CHECK_NODES = 256
+
+
+class SearchTimeout(Exception):
+    """Una búsqueda con plazo no terminó a tiempo."""
+
+
+@dataclass(frozen=True, slots=True)
+class _Nogood:
+    """
+    Una combinación de grupos que no se puede completar a un horario.
+
+    `groups` son los bits de los grupos elegidos (`levels` sus materias) y
+    `proof` las materias cuyos dominios se recorrieron para demostrarlo, con el
+    dominio que tenían. Vale en cualquier consulta que tenga activas todas esas
+    materias con dominios iguales o más chicos: la demostración solo usó los
+    choques entre ellas, así que agregar materias o encoger dominios no la
+    invalida. `groups` vacío significa que esas materias, solas, ya no caben.
+    """
+    groups: int
+    levels: Tuple[int, ...]
+    proof: Tuple[Tuple[int, int], ...]
+
+    def holds(self, active_mask: int, domains: List[int]) -> bool:
+        """¿Vale en una consulta con esas materias activas y esos dominios?"""
+        return all(
+            active_mask >> level & 1 and not domains[level] & ~domain
+            for level, domain in self.proof
         )
-        filters = {**filters, 'selected_nrcs': expanded_nrcs}
 
-    max_credits = float(filters.get("max_credits", 20))
-    EPSILON = 1e-9
 
-    def _probe(level: int, current_schedule: List[ClassOption], current_credits: float) -> bool:
-        if level == len(combinations_per_subject):
-            return _meets_filters(current_schedule, filters)
+@dataclass(slots=True)
+class _NogoodTable:
+    """Los nogoods aprendidos, indexados para revisarlos rápido."""
+    # Los que no dependen de ningún grupo elegido: materias que no caben juntas.
+    unconditional: List[_Nogood] = field(default_factory=list)
+    # El resto, bajo cada grupo que contienen.
+    by_group: Dict[int, List[_Nogood]] = field(default_factory=dict)
+    size: int = 0
 
-        for option_group in combinations_per_subject[level]:
-            credits_for_this_group = option_group[0].credits
-            if current_credits + credits_for_this_group > max_credits + EPSILON:
-                continue
 
-            if not _has_conflict(current_schedule, option_group):
-                current_schedule.extend(option_group)
-                if _probe(level + 1, current_schedule, current_credits + credits_for_this_group):
-                    return True
-                for _ in range(len(option_group)):
-                    current_schedule.pop()
+@dataclass(slots=True)
+class _KnownAnswers:
+    """
+    Lo que ya se respondió para unos mismos filtros, por máscara de materias.
+
+    Con `monotone`, una respuesta vale también para otros conjuntos: si un
+    conjunto tiene horario, cualquier subconjunto lo tiene (basta quitarle
+    materias al horario), y si no lo tiene, ningún superconjunto lo tendrá.
+    Por eso basta guardar los conjuntos con horario maximales y los sin
+    horario minimales. No es monótono con el filtro residual de
+    `include_professors`: quitar un nivel de esa materia puede dejarla sin el
+    profesor pedido; ahí solo vale la respuesta exacta.
+    """
+    monotone: bool
+    satisfiable: List[int] = field(default_factory=list)
+    infeasible: List[int] = field(default_factory=list)
+
+    def lookup(self, mask: int) -> Optional[bool]:
+        if self.monotone:
+            if any(not mask & ~known for known in self.satisfiable):
+                return True
+            if any(not known & ~mask for known in self.infeasible):
+                return False
+        else:
+            if mask in self.satisfiable:
+                return True
+            if mask in self.infeasible:
+                return False
+        return None
+
+    def record(self, mask: int, answer: bool) -> None:
+        if answer:
+            if self.monotone:
+                self.satisfiable = [k for k in self.satisfiable if k & ~mask]
+            self.satisfiable.append(mask)
+        else:
+            if self.monotone:
+                self.infeasible = [k for k in self.infeasible if mask & ~k]
+            self.infeasible.append(mask)
+
+
+class FeasibilityOracle:
+    """
+    `has_any_schedule` para muchas consultas sobre un mismo problema.
+
+    El diagnóstico pregunta decenas de veces "¿hay horario?" sobre las mismas
+    materias: por subconjuntos (quitar una materia), con y sin filtros. Aquí el
+    problema se compila una sola vez y cada consulta elige qué materias están
+    activas (`subjects`, índices de `combinations_per_subject`).
+
+    La búsqueda es backjumping dirigido por conflictos (CBJ) con forward
+    checking: cuando una materia se queda sin opciones, se calcula qué
+    materias ya elegidas lo causaron y se salta directo a la más reciente de
+    ellas, en vez de probar en vano los demás grupos de las que no tuvieron
+    nada que ver. Cada fallo se guarda como nogood (ver `_Nogood`) y las
+    consultas siguientes descartan de entrada las ramas ya demostradas
+    muertas. Es justo el caso del palomar (U3): muchas materias que se pelean
+    las mismas franjas, donde el backtracking cronológico repite la misma
+    demostración en cada rama.
+
+    Los nogoods se guardan por tope de créditos (los fallos por créditos solo
+    valen con el mismo tope) y por el filtro residual de `include_professors`
+    (que mira el horario entero). Los demás filtros solo encogen dominios, y
+    eso ya lo cubre `_Nogood.proof`.
+
+    Antes de buscar se consulta la memoria de respuestas (`_KnownAnswers`),
+    por conjunto de materias y huella de los filtros compilados: una pregunta
+    repetida, o implicada por monotonía por una ya respondida, no busca.
+    `hits` cuenta cuántas se respondieron así.
+
+    Replica la noción de validez de `has_any_schedule`: mismo problema
+    compilado, mismos dominios filtrados y el mismo tope de créditos.
+    """
+
+    def __init__(self, combinations_per_subject: List[List[List[ClassOption]]]) -> None:
+        self.problem = compile_problem(combinations_per_subject)
+        self._tables: Dict[Any, _NogoodTable] = {}
+        self._compiled: Dict[str, Tuple[CompiledFilters, _KnownAnswers]] = {}
+        self._answers: Dict[Any, _KnownAnswers] = {}
+        self.hits = 0
+
+    def has_any(
+        self,
+        subjects: Sequence[int],
+        filters: Union[Dict[str, Any], CompiledFilters],
+        deadline: Optional[float] = None,
+    ) -> bool:
+        """
+        ¿Hay al menos un horario válido con solo las materias `subjects`?
+
+        `filters` puede venir ya compilado contra `self.problem` (el
+        diagnóstico arma así sus combinaciones de filtros sin recompilarlas).
+        Con `deadline` (instante de `time.monotonic()`) la búsqueda se corta
+        con `SearchTimeout` si no terminó a tiempo.
+        """
+        active = sorted(set(subjects))
+        if not active:
+            return False
+        compiled_filters, known = self._compile(filters)
+        mask = sum(1 << level for level in active)
+        answer = known.lookup(mask)
+        if answer is not None:
+            self.hits += 1
+            return answer
+        table = self._table(compiled_filters, active)
+        answer = _cbj_search(self.problem, compiled_filters, active, table, deadline)
+        known.record(mask, answer)
+        return answer
+
+    def has_any_many(
+        self,
+        queries: Sequence[Tuple[Sequence[int], Union[Dict[str, Any], CompiledFilters]]],
+        deadline: Optional[float] = None,
+        workers: int = 1,
+    ) -> List[Optional[bool]]:
+        """
+        `has_any` para varias consultas independientes (materias, filtros).
+
+        Devuelve una respuesta por consulta, en su orden; None donde se acabó
+        el tiempo antes de saberla. Con `workers` > 1 las consultas se
+        reparten en el pool de procesos de la búsqueda en paralelo (ver
+        `_get_pool`): cada proceso busca con su propia tabla, así que lo que
+        aprenda no vuelve a este oráculo. En un solo proceso se responden en
+        orden y cada una aprovecha los nogoods de las anteriores. Si el pool
+        se rompe, se responden aquí, en un solo proceso.
+        """
+        if workers <= 1 or len(queries) <= 1:
+            answers: List[Optional[bool]] = []
+            for subjects, filters in queries:
+                try:
+                    answers.append(self.has_any(subjects, filters, deadline))
+                except SearchTimeout:
+                    answers.append(None)
+            return answers
+
+        answers = [None] * len(queries)
+        pending = []
+        for position, (subjects, filters) in enumerate(queries):
+            active = sorted(set(subjects))
+            compiled_filters, known = self._compile(filters)
+            mask = sum(1 << level for level in active)
+            answers[position] = known.lookup(mask) if active else False
+            if answers[position] is not None:
+                self.hits += 1
+            else:
+                pending.append((position, active, compiled_filters, known, mask))
+        if not pending:
+            return answers
+
+        encoded = pickle.dumps(_compact(self.problem), pickle.HIGHEST_PROTOCOL)
+        seconds = None if deadline is None else deadline - time.monotonic()
+        pool = _get_pool(workers)
+        try:
+            futures = [
+                pool.submit(
+                    _probe_subjects,
+                    encoded,
+                    dataclasses.replace(compiled_filters, alternatives=None),
+                    active,
+                    seconds,
+                )
+                for _, active, compiled_filters, _, _ in pending
+            ]
+            wait(futures, timeout=seconds)
+            for (position, _, _, known, mask), future in zip(pending, futures):
+                if not future.done():
+                    # Los que siguen en cola no llegan a empezar; los que ya
+                    # corren se cortan solos con su propio plazo.
+                    future.cancel()
+                    continue
+                answers[position] = future.result()
+                if answers[position] is not None:
+                    known.record(mask, answers[position])
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            # Lo que alcanzó a responderse ya quedó registrado y sale de caché.
+            return self.has_any_many(queries, deadline)
+        return answers
 
+    def known_conflict(self, filters: Dict[str, Any]) -> Optional[List[int]]:
+        """
+        El conjunto de materias más chico que las consultas ya demostraron
+        imposible con estos filtros, o None si todavía no se conoce ninguno.
+
+        Sale gratis de los nogoods sin grupos (`_Nogood.proof`): sirve de punto
+        de partida para buscar un conflicto mínimo sin volver a consultar.
+        """
+        compiled_filters, answers = self._compile(filters)
+        everything = list(range(len(self.problem.levels)))
+        table = self._table(compiled_filters, everything)
+        all_levels = (1 << len(everything)) - 1
+        known: Optional[List[int]] = None
+        for nogood in table.unconditional:
+            if nogood.holds(all_levels, compiled_filters.domains):
+                levels = [level for level, _ in nogood.proof]
+                if known is None or len(levels) < len(known):
+                    known = levels
+        # También las respuestas "sin horario" ya guardadas para estos filtros.
+        if answers.monotone:
+            for mask in answers.infeasible:
+                if known is None or mask.bit_count() < len(known):
+                    known = [level for level in everything if mask >> level & 1]
+        return known
+
+    def _compile(
+        self,
+        filters: Union[Dict[str, Any], CompiledFilters],
+    ) -> Tuple[CompiledFilters, _KnownAnswers]:
+        """
+        Los filtros compilados y la memoria de respuestas que les corresponde.
+
+        Se compilan una vez por forma de los filtros. La memoria va por la
+        huella de lo compilado (dominios, tope y filtro residual), así que
+        filtros escritos distinto pero con el mismo efecto la comparten.
+        """
+        if isinstance(filters, CompiledFilters):
+            return filters, self._known_answers(filters)
+        key = json.dumps(filters, sort_keys=True, default=str)
+        cached = self._compiled.get(key)
+        if cached is None:
+            compiled_filters, _ = prepare_filters(self.problem, filters)
+            cached = self._compiled[key] = (compiled_filters, self._known_answers(compiled_filters))
+        return cached
+
+    def _known_answers(self, compiled_filters: CompiledFilters) -> _KnownAnswers:
+        residual = tuple(sorted(compiled_filters.residual_include.items(), key=lambda item: item[0]))
+        fingerprint = (compiled_filters.max_credits, tuple(compiled_filters.domains), residual)
+        answers = self._answers.get(fingerprint)
+        if answers is None:
+            answers = self._answers[fingerprint] = _KnownAnswers(monotone=not residual)
+        return answers
+
+    def _table(
+        self,
+        compiled_filters: CompiledFilters,
+        active: List[int],
+    ) -> _NogoodTable:
+        """La tabla de nogoods que vale para este tope y este filtro residual."""
+        residual = tuple(sorted(
+            (subject, included, tuple(
+                level for level in active
+                if self.problem.levels[level] and self.problem.levels[level][0].subject == subject
+            ))
+            for subject, included in compiled_filters.residual_include.items()
+        ))
+        key = (compiled_filters.max_credits, residual)
+        table = self._tables.get(key)
+        if table is None:
+            table = self._tables[key] = _NogoodTable()
+        return table
+
+
+def _probe_subjects(
+    encoded: bytes,
+    compiled_filters: CompiledFilters,
+    active: List[int],
+    seconds: Optional[float],
+) -> Optional[bool]:
+    """Corre en el proceso hijo: una consulta de `has_any_many` (None si no alcanzó)."""
+    if not active:
+        return False
+    problem = pickle.loads(encoded)
+    deadline = None if seconds is None else time.monotonic() + seconds
+    try:
+        return _cbj_search(problem, compiled_filters, active, _NogoodTable(), deadline)
+    except SearchTimeout:
+        return None
+
+
+def _cbj_search(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    active: List[int],
+    table: _NogoodTable,
+    deadline: Optional[float] = None,
+) -> bool:
+    """
+    CBJ con forward checking sobre las materias `active`; aprende en la tabla.
+
+    Cada llamada de `_extend` devuelve, si falla, su explicación: las materias
+    elegidas que causaron el fallo (`conflict`) y las materias cuyos dominios
+    se recorrieron para demostrarlo (`proof`), ambas como máscaras de bits por
+    materia.
+    """
+    groups = problem.groups
+    compat = problem.compat
+    domains = compiled_filters.domains
+    max_credits = compiled_filters.max_credits + EPSILON
+    residual = compiled_filters.residual_include
+    active_mask = sum(1 << level for level in active)
+    min_credits = {
+        level: min((groups[i].credits for i in iter_bits(domains[level])), default=0.0)
+        for level in active
+    }
+
+    # Una combinación de materias que ya se sabe imposible: no hay que buscar.
+    if any(nogood.holds(active_mask, domains) for nogood in table.unconditional):
         return False
 
-    return _probe(0, [], 0.0)
+    by_group = table.by_group
+    assignment: Dict[int, int] = {}  # materia -> id del grupo, en orden de elección
+    nodes = 0
+
+    def _learn(conflict: int, proof: int) -> None:
+        if conflict.bit_count() > MAX_NOGOOD_SIZE or table.size >= MAX_NOGOODS:
+            return
+        levels = tuple(level for level in assignment if conflict >> level & 1)
+        nogood = _Nogood(
+            groups=sum(1 << assignment[level] for level in levels),
+            levels=levels,
+            proof=tuple((level, domains[level]) for level in active if proof >> level & 1),
+        )
+        if levels:
+            for level in levels:
+                by_group.setdefault(assignment[level], []).append(nogood)
+        else:
+            table.unconditional.append(nogood)
+        table.size += 1
+
+    def _matching_nogood(candidates: Optional[List[_Nogood]], chosen: int) -> Optional[_Nogood]:
+        """Un nogood vigente contenido en los grupos `chosen`, si lo hay."""
+        if candidates:
+            for nogood in candidates:
+                if not nogood.groups & ~chosen and nogood.holds(active_mask, domains):
+                    return nogood
+        return None
+
+    def _culprits(excluded: int) -> int:
+        """Materias elegidas (las más antiguas) que descartan los grupos `excluded`."""
+        conflict = 0
+        for level, chosen in assignment.items():
+            if not excluded:
+                break
+            hit = excluded & ~compat[chosen]
+            if hit:
+                conflict |= 1 << level
+                excluded &= ~hit
+        return conflict
+
+    def _extend(
+        unassigned: List[int],
+        pending: int,
+        allowed: int,
+        chosen_bits: int,
+        credits: float,
+    ) -> Tuple[bool, int, int]:
+        nonlocal nodes
+        nodes += 1
+        if deadline is not None and not nodes % _DEADLINE_CHECK_NODES and time.monotonic() > deadline:
+            raise SearchTimeout
+        if not unassigned:
+            if residual:
+                chosen = [groups[g] for g in assignment.values()]
+                if not _meets_filters(chosen, compiled_filters):
+                    # El filtro residual mira todas las materias con ese nombre.
+                    conflict = sum(
+                        1 << level for level, g in assignment.items()
+                        if groups[g].subject in residual
+                    )
+                    return False, conflict, 0
+            return True, 0, 0
+
+        # MRV: la materia con menos grupos compatibles restantes.
+        level = min(unassigned, key=lambda j: ((domains[j] & allowed).bit_count(), j))
+        rest = [j for j in unassigned if j != level]
+        level_bit = 1 << level
+        rest_bits = pending & ~level_bit
+        chosen_levels = active_mask & ~pending
+        rest_min_credits = sum(min_credits[j] for j in rest)
+        # Los grupos que ya chocan con lo elegido se explican de una vez.
+        conflict = _culprits(domains[level] & ~allowed)
+        proof = 0
 
+        for group_id in iter_bits(domains[level] & allowed):
+            group_bit = 1 << group_id
+            group_credits = credits + groups[group_id].credits
+            if group_credits + rest_min_credits > max_credits:
+                # Los créditos suman de todo lo elegido y la cota usa los
+                # dominios de lo que falta.
+                conflict |= chosen_levels
+                proof |= rest_bits
+                continue
+
+            chosen_with = chosen_bits | group_bit
+            dead = _matching_nogood(by_group.get(group_id), chosen_with)
+            if dead is not None:
+                for nogood_level in dead.levels:
+                    conflict |= 1 << nogood_level
+                for proof_level, _ in dead.proof:
+                    proof |= 1 << proof_level
+                continue
+
+            child = allowed & compat[group_id]
+            assignment[level] = group_id
+            for wiped in rest:
+                if not domains[wiped] & child:
+                    # Forward checking: cada grupo de `wiped` choca con algo elegido.
+                    conflict |= _culprits(domains[wiped])
+                    proof |= 1 << wiped
+                    break
+            else:
+                found, sub_conflict, sub_proof = _extend(
+                    rest, rest_bits, child, chosen_with, group_credits
+                )
+                del assignment[level]
+                if found:
+                    return True, 0, 0
+                if not sub_conflict & level_bit:
+                    # El fallo no depende de esta materia: los demás grupos
+                    # fallarían igual. Se salta hacia atrás sin probarlos.
+                    return False, sub_conflict, sub_proof
+                conflict |= sub_conflict
+                proof |= sub_proof
+                continue
+            del assignment[level]
+
+        conflict &= ~level_bit
+        proof |= level_bit
+        _learn(conflict, proof)
+        return False, conflict, proof
+
+    found, _, _ = _extend(active, active_mask, -1, 0, 0.0)
+    return found
+
+
+def count_valid_schedules(
+    combinations_per_subject: List[List[List[ClassOption]]],
+    filters: Dict[str, Any],
+) -> int:
+    """
+    Cuántos horarios devolvería `find_valid_schedules` (ya fusionados), sin
+    armar ninguno.
+
+    Es lo que muestra la UI ("N horarios posibles") mientras se ajustan los
+    filtros. No depende de `optimizeGaps`/`optimizeFreeDays`: ordenar no cambia
+    cuántos hay.
+
+    - Con los grupos equivalentes colapsados (ver `_collapse_equivalent`) cada
+      hoja de la búsqueda es un horario fusionado distinto, así que basta
+      contar hojas: se cuentan con memoización (`_count_leaves`), sin
+      recorrerlas una por una.
+    - Si queda el filtro residual de `include_professors`, que mira el horario
+      entero, se recorren las hojas contándolas.
+    - Sin colapso, la fusión es por firma completa: se recorren las hojas y se
+      guardan solo sus firmas, no los horarios.
+    """
+    if not combinations_per_subject:
+        return 0
+
+    problem, compiled_filters, _ = _prepare(combinations_per_subject, filters)
+    if compiled_filters.alternatives is None:
+        return len({
+            _get_schedule_signature([opt for g in schedule for opt in g.options])
+            for schedule in _search(problem, compiled_filters)
+        })
+    if compiled_filters.residual_include:
+        return sum(1 for _ in _search(problem, compiled_filters))
+    return _count_leaves(problem, compiled_filters)
+
+
+def _count_leaves(problem: CompiledProblem, compiled_filters: CompiledFilters) -> int:
+    """
+    Hojas válidas de `_search` (sin filtro residual), contadas con memoización.
+
+    Recorre las materias en orden y, en cada nivel, cuántas formas hay de
+    completar el horario depende solo de qué grupos de las materias que faltan
+    siguen siendo compatibles (`allowed` restringido a ellas) y, si el tope de
+    créditos puede llegar a cortar, de los créditos acumulados. Dos prefijos
+    con el mismo estado tienen las mismas completaciones y se cuentan una vez:
+    materias que no chocan entre sí, o que chocan con pocos grupos, colapsan a
+    pocos estados en vez de multiplicarse.
+    """
+    domains = _arc_consistency(problem, list(compiled_filters.domains))
+    if domains is None:
+        return 0
+
+    groups = problem.groups
+    compat = problem.compat
+    n = len(domains)
+    max_credits = compiled_filters.max_credits + EPSILON
+
+    # Bits de los grupos de las materias desde el nivel i en adelante.
+    pending = [0] * (n + 1)
+    for level in range(n - 1, -1, -1):
+        pending[level] = pending[level + 1] | domains[level]
+
+    # Si ni tomando lo más caro de cada materia se pasa del tope, los créditos
+    # no cortan nada y no hace falta distinguirlos en la memoización.
+    most_credits = sum(
+        max((groups[i].credits for i in iter_bits(domain)), default=0.0)
+        for domain in domains
+    )
+    credits_bind = most_credits > max_credits
+
+    memo: Dict[Tuple[int, int, float], int] = {}
+
+    def _count(level: int, allowed: int, credits: float) -> int:
+        if level == n:
+            return 1
+        key = (level, allowed & pending[level], credits if credits_bind else 0.0)
+        cached = memo.get(key)
+        if cached is not None:
+            return cached
+
+        total = 0
+        for group_id in iter_bits(domains[level] & allowed):
+            group_credits = credits + groups[group_id].credits
+            if group_credits > max_credits:
+                continue
+            total += _count(level + 1, allowed & compat[group_id], group_credits)
+        memo[key] = total
+        return total
+
+    return _count(0, -1, 0.0)
+
+
+def _search(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    propagate: bool = True,
+    dynamic_order: bool = True,
+    lcv: bool = False,
+    prune: Optional[Callable[[List[Optional[CompiledGroup]], Tuple[int, ...], int], bool]] = None,
+    tracker: Optional["_RankingTracker"] = None,
+) -> Iterator[List[CompiledGroup]]:
+    """
+    Backtracking sobre el problema compilado: produce cada horario válido.
+
+    Lo que produce es la lista de grupos elegidos indexada por materia (en el
+    orden de `problem.levels`), que se reutiliza entre horarios: quien la
+    guarde debe copiarla.
+
+    Con `propagate` (modo por defecto) el CSP se poda antes de llegar a la
+    materia muerta:
+
+    - **AC-3 en la raíz:** se quita de cada dominio todo grupo que no tenga
+      ningún compatible en el dominio de alguna otra materia, hasta el punto
+      fijo. Si un dominio queda vacío no hay nada que buscar.
+    - **Forward checking:** al elegir un grupo, el dominio de cada materia que
+      falta se filtra contra su fila de compatibilidad; si alguno queda vacío
+      se retrocede de inmediato, sin bajar al subárbol.
+    - **Cota de créditos:** se descarta una rama si, aun eligiendo lo más
+      barato de cada materia restante, ya no cabe en el tope.
+
+    Ninguna de las tres descarta un horario válido: solo evitan explorar
+    subárboles que no tienen ninguno.
+
+    El orden de exploración es heurístico:
+
+    - `dynamic_order` (MRV + grado): en cada nodo se sigue por la materia con
+      menos grupos compatibles restantes; a igualdad, la que más choques tiene
+      con las demás. Así el costo no depende del orden en que el estudiante
+      agregó las materias. Sin él se recorren en el orden de `problem.levels`
+      y los horarios salen en orden canónico.
+    - `lcv`: dentro de una materia se prueba primero el grupo que menos opciones
+      les quita a las materias pendientes. Solo rinde cuando se corta en la
+      primera solución (`has_any_schedule`); para enumerar todo da igual.
+
+    Con orden dinámico los horarios salen en otro orden; quien necesite el
+    canónico los ordena con `_canonical_key`.
+
+    `prune(assignment, rest, allowed)` es la poda de branch-and-bound de quien
+    llama: se consulta tras elegir cada grupo (con `None` en las materias sin
+    asignar, `rest` las pendientes y `allowed` los grupos aún compatibles) y,
+    si devuelve True, el subárbol no se explora.
+    Como se evalúa en el momento, puede depender de lo que ya se produjo.
+
+    Con `tracker` cada grupo elegido se acumula (`push`, antes de `prune`) y
+    se deshace al retroceder (`pop`): al recibir un horario, `tracker.key` es
+    su llave de orden.
+    """
+    groups = problem.groups
+    compat = problem.compat
+    max_credits = compiled_filters.max_credits + EPSILON
+    n = len(problem.levels)
+
+    # Los filtros ya vienen aplicados como poda de dominios.
+    domains = list(compiled_filters.domains)
+    residual = bool(compiled_filters.residual_include)
+    if propagate:
+        domains = _arc_consistency(problem, domains)
+        if domains is None:
+            return
 
-def _has_conflict(current_schedule: List[ClassOption], new_option_group: List[ClassOption]) -> bool:
-    """Verifica si un nuevo grupo de clases tiene conflicto de horario con el horario actual."""
-    for existing_option in current_schedule:
-        for new_option in new_option_group:
-            # Ignora conflictos entre clases de la misma materia y grupo (ej. labs alternos).
-            if (existing_option.subject_code == new_option.subject_code and
-                existing_option.group_id == new_option.group_id):
+    # Créditos mínimos de cada materia (para la cota de lo que falta sumar).
+    min_credits = [
+        min((groups[i].credits for i in iter_bits(domain)), default=0.0)
+        if propagate else 0.0
+        for domain in domains
+    ]
+
+    # Grado: cuántos pares (grupo propio, grupo ajeno) chocan. Desempata el MRV.
+    everything = (1 << len(groups)) - 1
+    degree = [
+        sum(
+            (everything & ~compat[i] & ~domains[level]).bit_count()
+            for i in iter_bits(domains[level])
+        )
+        for level in range(n)
+    ]
+
+    assignment: List[CompiledGroup] = [None] * n  # type: ignore[list-item]
+
+    def _extend(
+        unassigned: Tuple[int, ...],
+        allowed: int,
+        current_credits: float,
+    ) -> Iterator[List[CompiledGroup]]:
+        """
+        Función recursiva que construye los horarios paso a paso.
+
+        `allowed` es la intersección de las filas de compatibilidad de lo
+        elegido hasta ahora: los grupos que todavía pueden convivir con todo.
+        """
+        # Condición de éxito: se ha procesado una combinación para cada materia.
+        if not unassigned:
+            # Solo queda por revisar lo que no se pudo podar de antemano.
+            if not residual or _meets_filters(assignment, compiled_filters):
+                yield assignment
+            return
+
+        # Elige la materia a asignar (MRV + grado, o la siguiente en orden).
+        if dynamic_order and len(unassigned) > 1:
+            level = min(
+                unassigned,
+                key=lambda j: ((domains[j] & allowed).bit_count(), -degree[j], j),
+            )
+            rest = tuple(j for j in unassigned if j != level)
+        else:
+            level, rest = unassigned[0], unassigned[1:]
+        rest_min_credits = sum(min_credits[j] for j in rest)
+        rest_domains = [domains[j] for j in rest] if propagate else []
+
+        # Grupos de la materia que no chocan con nada de lo elegido; por
+        # defecto en su orden original (los bits siguen el orden de la lista).
+        candidates = iter_bits(domains[level] & allowed)
+        if lcv and rest:
+            rest_bits = 0
+            for domain in rest_domains:
+                rest_bits |= domain
+            candidates = sorted(
+                candidates,
+                key=lambda i: (-(allowed & compat[i] & rest_bits).bit_count(), i),
+            )
+
+        for group_id in candidates:
+            group = groups[group_id]
+            credits = current_credits + group.credits
+
+            # Poda por créditos: si añadir esta materia excede el límite, se descarta.
+            if credits + rest_min_credits > max_credits:
                 continue
 
-            for s1 in existing_option.schedules:
-                for s2 in new_option.schedules:
-                    if _schedules_overlap(s1, s2):
-                        return True
+            child = allowed & compat[group_id]
+            # Forward checking: alguna materia pendiente se quedó sin opciones.
+            for domain in rest_domains:
+                if not domain & child:
+                    break
+            else:
+                assignment[level] = group
+                if tracker is not None:
+                    tracker.push(group)
+                if prune is None or not prune(assignment, rest, child):
+                    yield from _extend(rest, child, credits)
+                if tracker is not None:
+                    tracker.pop()
+        assignment[level] = None  # type: ignore[call-overload]
+
+    # Inicia el algoritmo de backtracking.
+    yield from _extend(tuple(range(n)), -1, 0.0)
+
+
+def _canonical_key(schedule: Sequence[CompiledGroup]) -> Tuple[int, ...]:
+    """
+    Posición del horario en el orden canónico.
+
+    Es el orden en que los produce el recorrido estático (materia por materia,
+    cada una en el orden de sus grupos): lexicográfico por `id` de grupo, que
+    crece con la materia y con la posición dentro de ella.
+    """
+    return tuple(g.id for g in schedule)
+
+
+def _arc_consistency(problem: CompiledProblem, domains: List[int]) -> Optional[List[int]]:
+    """
+    AC-3 sobre el grafo de conflictos compilado.
+
+    Un grupo sobrevive si, para cada otra materia, tiene al menos un compatible
+    en el dominio actual de esa materia. Se repite hasta que nada cambia.
+    Devuelve los dominios reducidos, o None si alguno queda vacío.
+    """
+    compat = problem.compat
+    domains = list(domains)
+    n = len(domains)
+    pending = set(range(n))
+    while pending:
+        level = pending.pop()
+        kept = 0
+        for group_id in iter_bits(domains[level]):
+            row = compat[group_id]
+            if all(row & domains[j] for j in range(n) if j != level):
+                kept |= 1 << group_id
+        if not kept:
+            return None
+        if kept != domains[level]:
+            domains[level] = kept
+            # Al encogerse este dominio, los demás pueden perder soporte.
+            pending.update(j for j in range(n) if j != level)
+    return domains
+
+
+def pair_has_support(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    i: int,
+    j: int,
+) -> bool:
+    """
+    ¿Tienen las materias i y j de `problem` al menos una combinación válida?
+
+    Equivale a `has_any_schedule` sobre ese par, pero reutiliza lo ya
+    compilado en vez de volver a buscar: basta con que algún grupo del dominio
+    filtrado de i tenga en su fila de compatibilidad un grupo del dominio de j
+    y que los dos quepan en el tope de créditos. De `include_professors`
+    residual solo cuentan las materias de i o de j (ver `_meets_filters`).
+    """
+    max_credits = compiled_filters.max_credits + EPSILON
+    groups = problem.groups
+    domain_j = compiled_filters.domains[j]
+    for g_id in iter_bits(compiled_filters.domains[i]):
+        g = groups[g_id]
+        for h_id in iter_bits(problem.compat[g_id] & domain_j):
+            h = groups[h_id]
+            if g.credits + h.credits <= max_credits and _meets_filters([g, h], compiled_filters):
+                return True
     return False
 
 
-def _calculate_schedule_score(schedule: List[ClassOption], filters: Dict[str, Any]) -> Tuple[float, float]:
+def prepare_filters(
+    problem: CompiledProblem,
+    filters: Dict[str, Any],
+    collapse: bool = True,
+) -> Tuple[CompiledFilters, Dict[str, Any]]:
+    """
+    Normaliza los filtros de una petición ya compilada.
+
+    Devuelve los filtros compilados y el diccionario con los NRCs seleccionados
+    ya expandidos (teóricos con sus labs), que es el que manda en adelante.
+    `collapse` pasa tal cual a `compile_filters`.
+    """
+    if 'selected_nrcs' in filters:
+        expanded_nrcs = _expand_selected_nrcs(
+            [[g.options for g in level] for level in problem.levels],
+            filters['selected_nrcs']
+        )
+        # Actualizar el filtro con los NRCs expandidos
+        filters = {**filters, 'selected_nrcs': expanded_nrcs}
+
+    return compile_filters(filters, problem, collapse), filters
+
+
+def _prepare(
+    combinations_per_subject: List[List[List[ClassOption]]],
+    filters: Dict[str, Any],
+) -> Tuple[CompiledProblem, CompiledFilters, Dict[str, Any]]:
+    """
+    Compila la petición una sola vez: de aquí en adelante la búsqueda solo
+    compara enteros.
+    """
+    problem = compile_problem(combinations_per_subject)
+    compiled_filters, filters = prepare_filters(problem, filters)
+    return problem, compiled_filters, filters
+
+
+def _calculate_schedule_score(
+    schedule: Sequence[CompiledGroup],
+    problem: CompiledProblem,
+    filters: Dict[str, Any],
+) -> Tuple[float, float]:
     """
     Calcula una puntuación para un horario. Un puntaje más alto es mejor.
     La puntuación es una tupla para ordenar por días libres y luego por huecos.
     """
     score_free_days = 0.0
     score_gaps = 0.0
+    day_keys = problem.day_keys
 
     # 1. Puntuación por Días Libres.
     if filters.get('optimizeFreeDays', False):
-        days_with_classes = {s.day.lower() for opt in schedule for s in opt.schedules}
+        days_with_classes = {day_keys[d] for g in schedule for d, _, _ in g.blocks}
         score_free_days = 7 - len(days_with_classes)
 
     # 2. Puntuación por Huecos (Gaps).
     if filters.get('optimizeGaps', False):
-        total_gap_hours = 0
-        schedule_by_day: Dict[str, List[Tuple[time, time]]] = {}
-        
-        for option in schedule:
-            for s in option.schedules:
-                day = s.day.lower()
-                time_range = _parse_time_range(s.time)
-                schedule_by_day.setdefault(day, []).append(time_range)
-        
-        for day, times in schedule_by_day.items():
-            if len(times) > 1:
-                # Ordena las clases por hora de inicio para calcular los huecos entre ellas.
-                sorted_times = sorted(times, key=lambda x: x[0])
-                for i in range(len(sorted_times) - 1):
-                    end_of_class1 = sorted_times[i][1]
-                    start_of_class2 = sorted_times[i+1][0]
-                    
-                    # Calcula la diferencia en minutos.
-                    gap_minutes = (start_of_class2.hour * 60 + start_of_class2.minute) - \
-                                  (end_of_class1.hour * 60 + end_of_class1.minute)
-                    
-                    if gap_minutes > 0:
-                        total_gap_hours += gap_minutes / 60
-        
+        # Se acumula en minutos enteros y se convierte a horas una sola vez.
+        total_gap_minutes = 0
+        schedule_by_day: Dict[int, List[Tuple[int, int]]] = {}
+
+        for g in schedule:
+            for d, start, end in g.blocks:
+                schedule_by_day.setdefault(day_keys[d], []).append((start, end))
+
+        for times in schedule_by_day.values():
+            total_gap_minutes += _gap_minutes(times)
+
         # Puntuación inversa: menos huecos = mayor puntuación.
-        score_gaps = 100 - total_gap_hours
+        score_gaps = 100 - total_gap_minutes / 60
 
     # Prioriza días libres, y luego menos huecos.
     return (score_free_days, score_gaps)
 
 
-def _meets_filters(schedule: List[ClassOption], filters: Dict[str, Any]) -> bool:
+def _gap_minutes(times: List[Tuple[int, int]]) -> int:
+    """Minutos de hueco de un día: entre cada clase y la siguiente que empieza."""
+    return sum(end - start for start, end in _gap_holes(times))
+
+
+def _gap_holes(times: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
     """
-    Verifica si un horario cumple con los filtros de profesor, NRCs y horas no disponibles.
-    Las comparaciones son insensibles a mayúsculas/minúsculas.
+    Los huecos de un día como intervalos (fin de una clase, inicio de la que
+    le sigue por hora de inicio); su suma es el hueco del día.
     """
-    # 1. Extraer y normalizar filtros a minúsculas para comparación.
-    exclude_professors_filter = cast(Dict[str, List[str]], filters.get('exclude_professors', {}))
-    include_professors_filter = cast(Dict[str, List[str]], filters.get('include_professors', {}))
-    selected_nrcs_filter = cast(Dict[str, List[str]], filters.get('selected_nrcs', {}))
-    
-    unavailable_slots_input = cast(Dict[str, List[str]], filters.get('unavailable_slots', {}))
-    unavailable_slots_lower = {day.lower(): times for day, times in unavailable_slots_input.items()}
-
-    # 2. Agrupar clases por materia para una validación eficiente. La llave es el
-    # par (código, nombre): ver `subject_key`.
-    schedule_by_subject: Dict[str, List[ClassOption]] = {}
-    for option in schedule:
-        schedule_by_subject.setdefault(subject_key(option), []).append(option)
-
-    # 3. Verificación de filtros de NRCs específicos.
-    # Si se especifican NRCs para una materia, solo se aceptan horarios con esos NRCs.
-    for subject_code, subject_options in schedule_by_subject.items():
-        if subject_code in selected_nrcs_filter:
-            selected_nrcs = set(selected_nrcs_filter[subject_code])
-            schedule_nrcs = {opt.nrc for opt in subject_options}
-            
-            # El horario debe incluir al menos uno de los NRCs seleccionados
-            # y no debe incluir NRCs de esa materia que no fueron seleccionados
-            if not schedule_nrcs.issubset(selected_nrcs):
-                return False
+    holes: List[Tuple[int, int]] = []
+    if len(times) > 1:
+        # Ordena las clases por hora de inicio para calcular los huecos entre ellas.
+        times.sort(key=lambda x: x[0])
+        for i in range(len(times) - 1):
+            if times[i + 1][0] > times[i][1]:
+                holes.append((times[i][1], times[i + 1][0]))
+    return holes
 
-    # 4. Verificación de filtros de Inclusión/Exclusión de Profesores.
-    for subject_code, subject_options in schedule_by_subject.items():
-        # Verifica si algún profesor de la opción está en la lista de exclusión.
-        if subject_code in exclude_professors_filter:
-            excluded_profs_set = {prof.lower() for prof in exclude_professors_filter[subject_code]}
-            for option in subject_options:
-                if option.professor.lower() in excluded_profs_set:
-                    return False # Horario inválido.
-
-        # Verifica si al menos un profesor requerido está en la opción.
-        if subject_code in include_professors_filter:
-            included_profs_set = {prof.lower() for prof in include_professors_filter[subject_code]}
-            professors_in_schedule = {opt.professor.lower() for opt in subject_options}
-            if not professors_in_schedule.intersection(included_profs_set):
-                return False # Horario inválido.
 
-    # 5. Verificación de Horas No Disponibles.
-    for option in schedule:
-        for class_time in option.schedules:
-            day_lower = class_time.day.lower()
-            if day_lower in unavailable_slots_lower:
-                class_start, class_end = _parse_time_range(class_time.time)
-                for unavailable_hour_str in unavailable_slots_lower[day_lower]:
-                    unavailable_time = _parse_time(unavailable_hour_str)
-                    # Comprueba si la hora no disponible cae dentro del rango de la clase.
-                    if class_start <= unavailable_time < class_end:
-                        return False # Horario inválido.
-                        
-    return True # El horario cumple todos los filtros.
\ No newline at end of file
+def _group_lanes(problem: CompiledProblem) -> List[Tuple[int, int, bool]]:
+    """
+    Por grupo, en orden de `id`: sus días (un bit por día en minúscula), su
+    ocupación por franjas con un carril de `day_slots` bits por día en
+    minúscula, y si esa ocupación es exacta (ningún bloque sin duración ni
+    traslapes entre sus propios bloques).
+    """
+    day_keys = problem.day_keys
+    day_slots = problem.day_slots
+    slot_minutes = problem.slot_minutes
+    lanes: List[Tuple[int, int, bool]] = []
+    for group in problem.groups:
+        days = 0
+        slots = 0
+        width = 0
+        exact = True
+        for d, start, end in group.blocks:
+            days |= 1 << day_keys[d]
+            if end > start:
+                span = (end - start) // slot_minutes
+                slots |= ((1 << span) - 1) << (day_keys[d] * day_slots + start // slot_minutes)
+                width += span
+            else:
+                exact = False
+        lanes.append((days, slots, exact and width == slots.bit_count()))
+    return lanes
+
+
+def _schedule_scorer(
+    problem: CompiledProblem,
+    filters: Dict[str, Any],
+) -> Callable[[Sequence[CompiledGroup]], Tuple[float, float]]:
+    """
+    `_calculate_schedule_score` para muchos horarios del mismo problema.
+
+    Lo que depende de cada grupo se calcula una sola vez: sus días (bits por
+    día en minúscula) y su ocupación por franjas, con un carril de
+    `day_slots` bits por día en minúscula. Un horario se puntúa con un OR de
+    esas máscaras y conteos de bits, sin armar listas por día ni ordenarlas.
+
+    Si las clases de un día no se traslapan, su hueco es lo que va de la
+    primera a la última franja ocupada menos lo ocupado: lo mismo que suma
+    `_gap_holes`. Cuando hay traslapes (solo entre grupos con la misma llave
+    de exención) o bloques sin duración, ese atajo no vale y el horario se
+    puntúa con `_calculate_schedule_score`.
+    """
+    optimize_free_days = filters.get('optimizeFreeDays', False)
+    optimize_gaps = filters.get('optimizeGaps', False)
+    day_keys = problem.day_keys
+    day_slots = problem.day_slots
+    slot_minutes = problem.slot_minutes
+    lane = (1 << day_slots) - 1
+
+    # Por grupo: (días, ocupación en carriles por día en minúscula, franjas
+    # ocupadas). Si sus propios bloques se traslapan o alguno no dura nada, las
+    # franjas son un negativo que ningún horario puede compensar: siempre cae
+    # en el cálculo completo.
+    unusable = -(1 << 62)
+    group_scores: List[Tuple[int, int, int]] = [
+        (days, slots, slots.bit_count() if exact else unusable)
+        for days, slots, exact in _group_lanes(problem)
+    ]
+
+    # Desplazamiento de cada carril, por combinación de días usados.
+    lane_shifts: Dict[int, Tuple[int, ...]] = {}
+
+    def score(schedule: Sequence[CompiledGroup]) -> Tuple[float, float]:
+        days = 0
+        slots = 0
+        ones = 0
+        for g in schedule:
+            group_days, group_slots, group_ones = group_scores[g.id]
+            days |= group_days
+            slots |= group_slots
+            ones += group_ones
+
+        score_free_days = 7 - days.bit_count() if optimize_free_days else 0.0
+        score_gaps = 0.0
+        if optimize_gaps:
+            occupied = slots.bit_count()
+            if ones != occupied:
+                return _calculate_schedule_score(schedule, problem, filters)
+            shifts = lane_shifts.get(days)
+            if shifts is None:
+                shifts = lane_shifts[days] = tuple(key * day_slots for key in iter_bits(days))
+            # Sin traslapes, el hueco de un día es su tramo (primera a última
+            # franja ocupada) menos lo ocupado.
+            spans = 0
+            for shift in shifts:
+                day = (slots >> shift) & lane
+                spans += day.bit_length() - (day & -day).bit_length() + 1
+            score_gaps = 100 - (spans - occupied) * slot_minutes / 60
+        return (score_free_days, score_gaps)
+
+    return score
+
+
+def _score_order(
+    schedules: Sequence[Sequence[CompiledGroup]],
+    problem: CompiledProblem,
+    filters: Dict[str, Any],
+) -> List[int]:
+    """
+    Permutación que deja `schedules` de mayor a menor puntaje.
+
+    Estable, como `list.sort(reverse=True)`: a igual puntaje se conserva el
+    orden recibido (el canónico).
+    """
+    score = _schedule_scorer(problem, filters)
+    keys = [score(schedule) for schedule in schedules]
+    return sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+
+
+# --- Criterios de orden con nombre ---
+
+# Lo que aceptan `rankBy` (orden lexicográfico) y `rankWeights` (suma
+# ponderada). Todos se maximizan: los que conviene que sean chicos van con
+# signo negativo. Las horas van en horas (ej. 7:30 -> 7.5).
+RANKING_OBJECTIVES = (
+    "freeDays",       # Días sin clase, como `optimizeFreeDays`.
+    "gaps",           # 100 - horas muertas, como `optimizeGaps`.
+    "earliestStart",  # Hora de la primera clase de la semana: más tarde, mejor.
+    "latestEnd",      # -(hora de la última salida de la semana).
+    "campusHours",    # -(horas en el campus: de la primera a la última clase de cada día).
+    "classesPerDay",  # -(clases del día más cargado).
+    "seats",          # Cupos disponibles, sumados sobre todas las opciones.
+)
+
+# Criterios que salen de `_schedule_scorer` en vez de los acumuladores.
+_SCORED_OBJECTIVES = ("freeDays", "gaps")
+
+# Inicio de la primera clase cuando todavía no hay ninguna (fin del día).
+_NO_CLASS_START = 24 * 60
+
+
+@dataclass(frozen=True, slots=True)
+class Ranking:
+    """
+    Criterio de orden pedido con `rankBy` / `rankWeights`.
+
+    La llave de un horario es la suma ponderada de `weights` (si hay pesos) y
+    después, para desempatar, cada criterio de `order`.
+    """
+    order: Tuple[str, ...]
+    weights: Tuple[Tuple[str, float], ...] = ()
+
+
+def parse_ranking(filters: Dict[str, Any]) -> Optional[Ranking]:
+    """
+    El criterio con nombre de los filtros, o None si no se pidió (entonces
+    ordenan `optimizeFreeDays` / `optimizeGaps`, como siempre).
+
+    Lanza ValueError si un criterio no existe o un peso no es un número
+    mayor o igual a cero.
+    """
+    order = filters.get('rankBy') or []
+    weights = filters.get('rankWeights') or {}
+    if not order and not weights:
+        return None
+    if not isinstance(order, list) or not isinstance(weights, dict):
+        raise ValueError("rankBy debe ser una lista y rankWeights un objeto.")
+
+    for name in (*order, *weights):
+        if name not in RANKING_OBJECTIVES:
+            raise ValueError(f"Criterio de orden desconocido: {name}.")
+    parsed: List[Tuple[str, float]] = []
+    for name, weight in weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) \
+                or not 0 <= weight < float('inf'):
+            raise ValueError(f"Peso inválido para {name}: debe ser un número >= 0.")
+        if weight:
+            parsed.append((name, float(weight)))
+    return Ranking(order=tuple(dict.fromkeys(order)), weights=tuple(parsed))
+
+
+def ranks_schedules(filters: Dict[str, Any]) -> bool:
+    """¿Se pidió ordenar por puntaje (criterios con nombre, días libres u horas muertas)?"""
+    return bool(
+        filters.get('rankBy') or filters.get('rankWeights')
+        or filters.get('optimizeGaps', False) or filters.get('optimizeFreeDays', False)
+    )
+
+
+class _RankingTracker:
+    """
+    Los criterios de un `Ranking` como acumuladores del backtracking.
+
+    `_search` llama a `push` al elegir un grupo y a `pop` al retroceder. Cada
+    `push` toca solo los días del grupo: primera entrada, última salida y
+    clases de ese día, más los agregados de la semana (primera clase, última
+    salida, horas en el campus, día más cargado y cupos). Un registro de
+    deshacer restaura todo en `pop`, así que en una hoja `key` cuesta O(1) por
+    criterio. Días libres y huecos, si se piden, salen de `_schedule_scorer`
+    (O(días)).
+    """
+
+    def __init__(
+        self,
+        problem: CompiledProblem,
+        compiled_filters: CompiledFilters,
+        ranking: Ranking,
+    ) -> None:
+        self._ranking = ranking
+        self._domains = compiled_filters.domains
+        needed = set(ranking.order) | {name for name, _ in ranking.weights}
+        scored = needed & set(_SCORED_OBJECTIVES)
+        # Lo que se lleva por día solo hace falta para estos dos.
+        self._track_days = bool(needed & {"campusHours", "classesPerDay"})
+        both = {'optimizeFreeDays': True, 'optimizeGaps': True}
+        self._scorer = _schedule_scorer(problem, both) if scored else None
+        self._scored_bound = _score_upper_bound(problem, compiled_filters, both) if scored else None
+
+        # Por grupo: (día, primera entrada, última salida, clases) de cada día
+        # que usa, y sus cupos, primera entrada y última salida de la semana.
+        day_keys = problem.day_keys
+        self._group_days: List[Tuple[Tuple[int, int, int, int], ...]] = []
+        self._group_seats: List[int] = []
+        self._group_earliest: List[int] = []
+        self._group_latest: List[int] = []
+        for group in problem.groups:
+            by_day: Dict[int, List[int]] = {}
+            for d, start, end in group.blocks:
+                day = by_day.setdefault(day_keys[d], [start, end, 0])
+                day[0] = min(day[0], start)
+                day[1] = max(day[1], end)
+                day[2] += 1
+            self._group_days.append(tuple((key, *day) for key, day in by_day.items()))
+            self._group_seats.append(sum(opt.seats_available for opt in group.options))
+            self._group_earliest.append(min((d[0] for d in by_day.values()), default=_NO_CLASS_START))
+            self._group_latest.append(max((d[1] for d in by_day.values()), default=0))
+
+        n_keys = max(day_keys, default=-1) + 1
+        self._first = [0] * n_keys
+        self._last = [0] * n_keys
+        self._count = [0] * n_keys
+        self._earliest = _NO_CLASS_START
+        self._latest = 0
+        self._campus = 0
+        self._peak = 0
+        self._seats = 0
+        self._undo: List[Tuple[int, int, int, int, int, int]] = []
+        self._day_undo: List[Tuple[int, int, int, int]] = []
+
+    def push(self, group: CompiledGroup) -> None:
+        """Suma `group` a los acumuladores."""
+        i = group.id
+        self._undo.append((
+            self._earliest, self._latest, self._campus, self._peak, self._seats, len(self._day_undo)
+        ))
+        if self._track_days:
+            first, last, count, day_undo = self._first, self._last, self._count, self._day_undo
+            campus = self._campus
+            peak = self._peak
+            for key, start, end, classes in self._group_days[i]:
+                before = count[key]
+                day_first, day_last = first[key], last[key]
+                day_undo.append((key, day_first, day_last, before))
+                if before:
+                    span = day_last - day_first
+                    if span > 0:
+                        campus -= span
+                    if start < day_first:
+                        day_first = first[key] = start
+                    if end > day_last:
+                        day_last = last[key] = end
+                else:
+                    day_first, day_last = first[key], last[key] = start, end
+                if day_last > day_first:
+                    campus += day_last - day_first
+                count[key] = before + classes
+                if before + classes > peak:
+                    peak = before + classes
+            self._campus = campus
+            self._peak = peak
+        if self._group_earliest[i] < self._earliest:
+            self._earliest = self._group_earliest[i]
+        if self._group_latest[i] > self._latest:
+            self._latest = self._group_latest[i]
+        self._seats += self._group_seats[i]
+
+    def pop(self) -> None:
+        """Deshace el último `push`."""
+        (self._earliest, self._latest, self._campus, self._peak, self._seats,
+         mark) = self._undo.pop()
+        day_undo = self._day_undo
+        while len(day_undo) > mark:
+            key, self._first[key], self._last[key], self._count[key] = day_undo.pop()
+
+    def key(self, schedule: Sequence[CompiledGroup]) -> Tuple[float, ...]:
+        """Llave de orden del horario completo que está acumulado (mayor es mejor)."""
+        scored = self._scorer(schedule) if self._scorer is not None else (0.0, 0.0)
+        return self._combine(self._values(scored[0], scored[1], self._earliest, self._latest,
+                                          self._campus, self._peak, self._seats))
+
+    def score(self, schedule: Sequence[CompiledGroup]) -> Tuple[float, ...]:
+        """`key` de un horario cualquiera (acumula sus grupos y los deshace)."""
+        for group in schedule:
+            self.push(group)
+        key = self.key(schedule)
+        for _ in schedule:
+            self.pop()
+        return key
+
+    def upper_bound(
+        self,
+        assignment: List[Optional[CompiledGroup]],
+        rest: Tuple[int, ...],
+        allowed: int,
+    ) -> Tuple[float, ...]:
+        """
+        Cota superior admisible de `key` para lo acumulado (un horario
+        parcial), con la firma de la poda de `find_top_schedules`.
+
+        Primera clase, última salida, horas en el campus y día más cargado solo
+        empeoran al agregar clases; de cada materia pendiente se suma lo mejor
+        que aún puede aportar (la primera clase más tarde, la salida más
+        temprana, los cupos más altos). Días libres y huecos usan
+        `_score_upper_bound`. Con pesos >= 0 la suma ponderada de cotas también
+        es cota.
+        """
+        earliest, latest, seats = self._earliest, self._latest, self._seats
+        for j in rest:
+            ids = list(iter_bits(self._domains[j] & allowed))
+            earliest = min(earliest, max((self._group_earliest[i] for i in ids), default=_NO_CLASS_START))
+            latest = max(latest, min((self._group_latest[i] for i in ids), default=0))
+            seats += max((self._group_seats[i] for i in ids), default=0)
+        scored = (
+            self._scored_bound(assignment, rest, allowed)
+            if self._scored_bound is not None else (0.0, 0.0)
+        )
+        return self._combine(self._values(scored[0], scored[1], earliest, latest,
+                                          self._campus, self._peak, seats))
+
+    @staticmethod
+    def _values(
+        free_days: float,
+        gaps: float,
+        earliest: int,
+        latest: int,
+        campus: int,
+        peak: int,
+        seats: int,
+    ) -> Dict[str, float]:
+        return {
+            "freeDays": free_days,
+            "gaps": gaps,
+            "earliestStart": earliest / 60,
+            "latestEnd": -latest / 60,
+            "campusHours": -campus / 60,
+            "classesPerDay": -peak,
+            "seats": seats,
+        }
+
+    def _combine(self, values: Dict[str, float]) -> Tuple[float, ...]:
+        ranking = self._ranking
+        key = [values[name] for name in ranking.order]
+        if ranking.weights:
+            key.insert(0, sum(weight * values[name] for name, weight in ranking.weights))
+        return tuple(key)
+
+
+def _score_upper_bound(
+    problem: CompiledProblem,
+    compiled_filters: CompiledFilters,
+    filters: Dict[str, Any],
+) -> Callable[[List[Optional[CompiledGroup]], Tuple[int, ...], int], Tuple[float, float]]:
+    """
+    Cota superior admisible de `_calculate_schedule_score` para un horario parcial.
+
+    Recibe lo asignado (`None` en lo pendiente), las materias pendientes y los
+    grupos que aún son compatibles con todo lo asignado. Ningún horario que
+    complete el parcial puede puntuar más que la cota (en cada componente, y
+    por tanto en el orden lexicográfico):
+
+    - **Días libres:** agregar clases nunca libera un día. A los días ya usados
+      se suman los que todas las opciones de una materia pendiente usan, y
+      luego lo mínimo que la materia pendiente más exigente aún tiene que
+      agregar.
+    - **Huecos:** con máscaras por franjas (ver `_schedule_scorer`), el hueco
+      de cada día es lo que va de la primera a la última franja ocupada menos
+      lo ocupado, que no excede lo que suma `_gap_holes`. Una clase nueva lo
+      reduce a lo sumo en lo que se traslapa con él: el hueco final es al
+      menos el actual menos, por cada materia pendiente, el mayor traslape de
+      cualquiera de sus opciones con los huecos de la semana.
+
+    Se evalúa en cada nodo de la poda: nada de listas por día ni ordenamientos,
+    solo OR y conteos de bits.
+    """
+    optimize_free_days = filters.get('optimizeFreeDays', False)
+    optimize_gaps = filters.get('optimizeGaps', False)
+    domains = compiled_filters.domains
+    day_slots = problem.day_slots
+    slot_minutes = problem.slot_minutes
+    lane = (1 << day_slots) - 1
+
+    # Por grupo: días que usa (bits por día en minúscula) y su ocupación por
+    # franjas, con un carril de `day_slots` bits por día en minúscula.
+    lanes = _group_lanes(problem)
+    group_days: List[int] = [days for days, _, _ in lanes]
+    group_slots: List[int] = [slots for _, slots, _ in lanes]
+
+    def upper_bound(
+        assignment: List[Optional[CompiledGroup]],
+        rest: Tuple[int, ...],
+        allowed: int,
+    ) -> Tuple[float, float]:
+        used_days = 0
+        used_slots = 0
+        for g in assignment:
+            if g is not None:
+                used_days |= group_days[g.id]
+                used_slots |= group_slots[g.id]
+        candidates = [list(iter_bits(domains[j] & allowed)) for j in rest]
+
+        score_free_days = 0.0
+        if optimize_free_days:
+            base_days = used_days
+            for ids in candidates:
+                if ids:
+                    forced = -1
+                    for i in ids:
+                        forced &= group_days[i]
+                    base_days |= forced
+            extra = 0
+            for ids in candidates:
+                need = min(((group_days[i] & ~base_days).bit_count() for i in ids), default=0)
+                extra = max(extra, need)
+            score_free_days = 7 - base_days.bit_count() - extra
+
+        score_gaps = 0.0
+        if optimize_gaps:
+            # Hueco de cada día: de la primera a la última franja ocupada,
+            # menos lo ocupado. Nunca excede lo que suma `_gap_holes`.
+            holes = 0
+            for key in iter_bits(used_days):
+                shift = key * day_slots
+                occupied = (used_slots >> shift) & lane
+                holes |= (((1 << occupied.bit_length()) - (occupied & -occupied)) & ~occupied) << shift
+            total_gap_slots = holes.bit_count()
+            if holes:
+                # Cada materia pendiente tapa a lo sumo lo que su mejor opción
+                # se traslapa con los huecos de toda la semana.
+                for ids in candidates:
+                    total_gap_slots -= max((group_slots[i] & holes).bit_count() for i in ids) if ids else 0
+                total_gap_slots = max(total_gap_slots, 0)
+            score_gaps = 100 - total_gap_slots * slot_minutes / 60
+
+        return (score_free_days, score_gaps)
+
+    return upper_bound
+
+
+def _meets_filters(schedule: Sequence[CompiledGroup], filters: CompiledFilters) -> bool:
+    """
+    Verifica en la hoja lo único que no se pudo podar antes de buscar.
+
+    Todos los filtros se aplican como poda de dominios (`compile_filters`),
+    salvo `include_professors` de una materia que ocupa más de un nivel: ahí
+    basta con que algún nivel de esa materia tenga uno de los profesores.
+
+    Solo cuentan las materias que tienen algún nivel en `schedule`: el
+    oráculo y `pair_has_support` lo llaman con subconjuntos de materias, y
+    una materia ausente no puede incumplir su filtro.
+    """
+    for subject, included in filters.residual_include.items():
+        present = False
+        for g in schedule:
+            if g.subject == subject:
+                present = True
+                if any(p in included for p in g.professors):
+                    break
+        else:
+            if present:
+                return False # Horario inválido.
+    return True # El horario cumple todos los filtros.
@@ -0,0 +1,60 @@
+"""
+Almacén en memoria de resultados del generador, para paginar por cursor.
+
+La primera petición paginada de `/api/schedules/generate` calcula la lista
+completa una sola vez y la guarda aquí bajo un id opaco; las páginas siguientes
+se sirven desde este almacén sin volver a buscar. La lista guardada es una
+tupla inmutable, así que las páginas son estables: ningún reordenamiento ni
+recálculo puede mover un horario de una página a otra.
+
+Cada resultado vive `SCHEDULE_STORE_TTL` segundos desde que se guardó y el
+almacén conserva a lo sumo `SCHEDULE_STORE_MAX` resultados (se descarta el
+menos usado). Es por proceso: con varios workers, un cursor solo lo entiende el
+worker que lo emitió; si cae en otro, se responde como cursor vencido y el
+cliente vuelve a generar.
+"""
+import os
+import secrets
+from typing import List, Optional, Sequence, Tuple
+
+from ..models import ClassOption
+from .schedule_cache import LruTtlCache
+
+
+class ScheduleStore:
+    """Resultados ordenados del generador con TTL y tope de entradas (LRU)."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int) -> None:
+        self._results: LruTtlCache[Tuple[List[ClassOption], ...]] = LruTtlCache(
+            ttl_seconds, max_entries
+        )
+
+    def put(self, schedules: Sequence[List[ClassOption]]) -> str:
+        """Guarda una lista de horarios ya ordenada y devuelve su id."""
+        result_id = secrets.token_urlsafe(12)
+        self._results.put(result_id, tuple(schedules))
+        return result_id
+
+    def get(self, result_id: str) -> Optional[Tuple[List[ClassOption], ...]]:
+        """Los horarios guardados bajo `result_id`, o None si no existe o venció."""
+        return self._results.get(result_id)
+
+
+def encode_cursor(result_id: str, offset: int) -> str:
+    """Cursor opaco para el cliente: el resultado guardado y dónde sigue."""
+    return f"{result_id}.{offset}"
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """(id del resultado, posición) de un cursor, o None si está mal formado."""
+    result_id, _, offset = cursor.rpartition('.')
+    if not result_id or not offset.isdigit():
+        return None
+    return result_id, int(offset)
+
+
+# Instancia del proceso. Configurable por env (segundos / cantidad de resultados).
+schedule_store = ScheduleStore(
+    ttl_seconds=float(os.getenv("SCHEDULE_STORE_TTL", "600")),
+    max_entries=int(os.getenv("SCHEDULE_STORE_MAX", "256")),
+)
@@ -250,3 +250,20 @@ CREATE TABLE IF NOT EXISTS public.curso_personalizado (
 ALTER TABLE public.curso_personalizado OWNER TO pg_database_owner;
 
 CREATE INDEX IF NOT EXISTS idx_curso_pers_usuario ON public.curso_personalizado(usuario_id);
+
+--
+-- Versión de la oferta académica (fila única)
+-- El ETL la incrementa en la misma transacción en que reemplaza Curso/Clase. La
+-- API la usa en la llave de su caché de horarios: cambiar la oferta invalida
+-- todo lo cacheado, aunque el ETL corra en otro proceso.
+--
+
+CREATE TABLE IF NOT EXISTS public.oferta_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    actualizado_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE public.oferta_version OWNER TO pg_database_owner;
+
+INSERT INTO public.oferta_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
@@ -4,7 +4,7 @@ import os
 from config import get_connection, CURRENT_TERM
 from backup import limpiar_tablas
 from parser import procesar_json
-from inserter import insertar_datos
+from inserter import insertar_datos, marcar_nueva_oferta
 from rescatador import procesar_rescate
 
 def guardar_log(errores: list[str], log_path: str):
@@ -80,6 +80,8 @@ def actualizar_base():
         print("Limpiando tablas académicas (preservando datos de aplicación)...")
         limpiar_tablas(conn, auto_commit=False)
         insertar_datos(conn, datos_finales, auto_commit=False)
+        # Invalida el caché de horarios de la API (ver schedule_cache).
+        marcar_nueva_oferta(conn, auto_commit=False)
         conn.commit()
         print("Transacción confirmada: actualización aplicada correctamente.")
     except Exception as e:
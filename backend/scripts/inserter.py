@@ -52,4 +52,18 @@ def insertar_datos(conn: psycopg.Connection, datos: ProcesarJsonResponse, auto_c
     if auto_commit:
         conn.commit()
 
-    print("Datos insertados correctamente.")
\ No newline at end of file
+    print("Datos insertados correctamente.")
+
+
+def marcar_nueva_oferta(conn: psycopg.Connection, auto_commit: bool = True) -> None:
+    """Incrementa `oferta_version`: invalida el caché de horarios de la API.
+
+    Debe ir en la misma transacción que reemplaza Curso/Clase, para que la API
+    nunca vea la oferta nueva con la versión vieja (ni al revés).
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE oferta_version SET version = version + 1, actualizado_at = NOW() WHERE id = 1"
+    )
+    if auto_commit:
+        conn.commit()
@@ -139,6 +139,32 @@ def _agregar_nombre_posicion_favoritos(conn: psycopg.Connection) -> None:
         cursor.close()
 
 
+def _crear_tabla_oferta_version(conn: psycopg.Connection) -> None:
+    """Crea `oferta_version` (fila única) si no existe.
+
+    El ETL la incrementa al reemplazar la oferta y la API la usa en la llave de
+    su caché de horarios. Idempotente: la fila inicial solo se inserta si falta.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS public.oferta_version (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version BIGINT NOT NULL DEFAULT 0,
+                actualizado_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+            )
+            """
+        )
+        cursor.execute(
+            "INSERT INTO public.oferta_version (id, version) VALUES (1, 0) "
+            "ON CONFLICT (id) DO NOTHING"
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
 def aplicar_migraciones() -> None:
     """Aplica todas las migraciones pendientes. Seguro de ejecutar siempre."""
     conn = get_connection()
@@ -147,6 +173,7 @@ def aplicar_migraciones() -> None:
         _crear_tabla_curso_personalizado(conn)
         _agregar_etiqueta_curso_personalizado(conn)
         _agregar_nombre_posicion_favoritos(conn)
+        _crear_tabla_oferta_version(conn)
     finally:
         conn.close()
 
@@ -30,6 +30,19 @@ class ScheduleDiagnosis {
   /// vacío ahí significa que es la combinación de filtros, no uno puntual.
   final List<DiagnosisFilter> blockingFilters;
 
+  /// Si ningún filtro solo alcanza: el conjunto más chico de filtros que,
+  /// relajados juntos, sí desbloquea. Vacío si no aplica.
+  final List<DiagnosisFilter> relaxation;
+
+  /// Conjunto mínimo de materias que no caben juntas (solo en
+  /// `conjunto_incompatible` con [removalOptions] vacío): basta quitar una de
+  /// ellas para romper ese conflicto. Vacío si no aplica.
+  final List<String> core;
+
+  /// Si el backend cortó el diagnóstico por tiempo: lo que trae es cierto,
+  /// pero las listas pueden estar incompletas.
+  final bool partial;
+
   const ScheduleDiagnosis({
     required this.shape,
     required this.blame,
@@ -37,6 +50,9 @@ class ScheduleDiagnosis {
     this.pairs = const [],
     this.removalOptions = const [],
     this.blockingFilters = const [],
+    this.relaxation = const [],
+    this.core = const [],
+    this.partial = false,
   });
 
   factory ScheduleDiagnosis.fromJson(Map<String, dynamic> json) {
@@ -53,6 +69,12 @@ class ScheduleDiagnosis {
           .map<DiagnosisFilter>(
               (f) => DiagnosisFilter.fromJson(f as Map<String, dynamic>))
           .toList(),
+      relaxation: (json['relaxation'] as List? ?? const [])
+          .map<DiagnosisFilter>(
+              (f) => DiagnosisFilter.fromJson(f as Map<String, dynamic>))
+          .toList(),
+      core: List<String>.from(json['core'] as List? ?? const []),
+      partial: json['partial'] as bool? ?? false,
     );
   }
 
@@ -488,11 +488,13 @@ class ScheduleProvider extends ChangeNotifier {
         ? ''
         : ' Si quitas ${_joinAlternatives(d.removalOptions)}, sí hay horarios.';
 
-    // Solo con blame=filtros. Vacío ahí significa que es la combinación de
-    // filtros y no uno puntual, así que no se señala a ninguno.
-    final filtro = d.blockingFilters.isEmpty
-        ? ''
-        : ' Relajando ${_joinAlternatives(d.blockingFilters.map((f) => f.label).toList())} también se resuelve.';
+    // Solo con blame=filtros. Si ninguno solo alcanza, se nombra la
+    // combinación más chica que hay que relajar junta (si el backend la halló).
+    final filtro = d.blockingFilters.isNotEmpty
+        ? ' Relajando ${_joinAlternatives(d.blockingFilters.map((f) => f.label).toList())} también se resuelve.'
+        : d.relaxation.isNotEmpty
+            ? ' Relajando a la vez ${_joinNames(d.relaxation.map((f) => f.label).toList())} también se resuelve.'
+            : '';
 
     switch (d.shape) {
       case 'sin_oferta':
@@ -536,7 +538,11 @@ class ScheduleProvider extends ChangeNotifier {
         final base = d.blame == 'estructural'
             ? 'Estas materias no caben todas juntas (de a dos sí cabrían).'
             : 'Tus filtros dejan sin opciones a esta combinación de materias.';
-        return '$base$salida$filtro';
+        // Ninguna sola lo destraba: se nombra el grupo mínimo que no cabe.
+        final nucleo = d.removalOptions.isEmpty && d.core.isNotEmpty
+            ? ' No caben juntas ${_joinNames(d.core)}: quita al menos una.'
+            : '';
+        return '$base$salida$nucleo$filtro';
     }
   }
 
@@ -123,6 +123,8 @@ class ApiService {
       // Cursos personalizados activos: reemplazan la oferta de su materia.
       "customCourses":
           activeCustomCourses.map((c) => c.toGenerationJson()).toList(),
+      // Cada opción viaja una sola vez; los horarios llegan como índices.
+      "responseFormat": "normalized",
     };
 
     try {
@@ -135,14 +137,8 @@ class ApiService {
       if (response.statusCode == 200) {
         final decoded = json.decode(utf8.decode(response.bodyBytes))
             as Map<String, dynamic>;
-        final List<dynamic> data = decoded['schedules'] as List<dynamic>;
         final bool truncated = decoded['truncated'] as bool? ?? false;
-
-        final schedules = data.map<List<ClassOption>>((schedule) {
-          return (schedule as List).map<ClassOption>((classOption) {
-            return ClassOption.fromJson(classOption as Map<String, dynamic>);
-          }).toList();
-        }).toList();
+        final schedules = _decodeNormalizedSchedules(decoded);
 
         // Solo viene cuando no hubo horarios; explica por qué.
         final rawDiagnosis = decoded['diagnosis'];
@@ -167,6 +163,35 @@ class ApiService {
     }
   }
 
+  /// Reconstruye los horarios de una respuesta `responseFormat: normalized`.
+  ///
+  /// Cada opción de la tabla `options` se decodifica una sola vez y se comparte
+  /// entre horarios (`ClassOption` es inmutable). Cada horario queda igual que
+  /// en el formato completo: sus opciones base y luego las de los grupos
+  /// equivalentes, en el orden de `alternatives`, sin repetir NRC.
+  List<List<ClassOption>> _decodeNormalizedSchedules(
+      Map<String, dynamic> decoded) {
+    final options = (decoded['options'] as List<dynamic>)
+        .map((o) => ClassOption.fromJson(o as Map<String, dynamic>))
+        .toList();
+
+    return (decoded['schedules'] as List<dynamic>).map<List<ClassOption>>((s) {
+      final schedule = s as Map<String, dynamic>;
+      final indices = List<int>.from(schedule['options'] as List<dynamic>);
+      final seen = indices.map((i) => options[i].nrc).toSet();
+      final alternatives = schedule['alternatives'] as List<dynamic>? ?? [];
+      for (final alternative in alternatives) {
+        final groups = (alternative as Map<String, dynamic>)['groups'] as List;
+        for (final group in groups) {
+          for (final index in (group as List).cast<int>()) {
+            if (seen.add(options[index].nrc)) indices.add(index);
+          }
+        }
+      }
+      return indices.map((i) => options[i]).toList();
+    }).toList();
+  }
+
   // ============================================================
   // Favoritos (Horarios Destacados)
   // ============================================================
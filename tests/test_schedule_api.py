@@ -0,0 +1,415 @@
+"""
+Pruebas de los endpoints de generación de horarios (`backend/app/main.py`).
+
+La oferta no sale de la base: `repository` se reemplaza por una oferta fija,
+así que estas pruebas fijan el contrato HTTP (formatos, caché, paginación,
+streaming) sin PostgreSQL.
+"""
+import json
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+# `main` importa las rutas de autenticación, que leen el tenant al importarse.
+os.environ.setdefault("AZURE_TENANT_ID", "tenant-de-prueba")
+
+from backend.app import main  # noqa: E402
+from backend.app.models import (  # noqa: E402
+    ClassOption,
+    ClassOptionRecord,
+    ClassSlot,
+    GenerateScheduleResponse,
+    ScheduleDiagnosis,
+)
+from backend.app.services import schedule_diagnostics, schedule_generator  # noqa: E402
+from backend.app.services.schedule_cache import OfferVersion, generation_cache  # noqa: E402
+from backend.app.services.schedule_store import ScheduleStore  # noqa: E402
+
+
+# --- FUNCIONES DE AYUDA ---
+
+def _record(
+    code: str,
+    nrc: str,
+    blocks: List[Tuple[str, str]],
+    group_id: int = 1,
+    professor: str = "Docente",
+    credits: float = 3,
+    name: str = "",
+) -> ClassOptionRecord:
+    """Una opción de la oferta (como la hidrata el repositorio)."""
+    return ClassOptionRecord(
+        subject_name=name or f"Materia {code}",
+        subject_code=code,
+        type="Teorico-practico",
+        schedules=[ClassSlot(d, t) for d, t in blocks],
+        professor=professor,
+        nrc=nrc,
+        group_id=group_id,
+        credits=credits,
+        campus="Campus Tecnológico",
+        seats_available=10,
+        seats_maximum=30,
+    )
+
+
+def _rebuild(response: Any) -> List[List[str]]:
+    """
+    La regla del cliente (`_decodeNormalizedSchedules` en `api_service.dart`):
+    las opciones base y luego las de `alternatives` en orden, sin repetir NRC.
+    """
+    rebuilt = []
+    for schedule in response.schedules:
+        indices = list(schedule.options)
+        seen = {response.options[i].nrc for i in indices}
+        for alternative in schedule.alternatives:
+            for group in alternative.groups:
+                for i in group:
+                    if response.options[i].nrc not in seen:
+                        seen.add(response.options[i].nrc)
+                        indices.append(i)
+        rebuilt.append([response.options[i].nrc for i in indices])
+    return rebuilt
+
+
+def _full_vs_normalized(combinations: List[Any], filters: Dict[str, Any]) -> Tuple[List[List[str]], List[List[str]]]:
+    full = main._schedules_response(
+        schedule_generator.find_valid_schedules(combinations, dict(filters)), False
+    )
+    normalized = main._schedules_response(
+        schedule_generator.find_valid_schedules(combinations, dict(filters), grouped=True), True
+    )
+    return [[o.nrc for o in s] for s in full.schedules], _rebuild(normalized)
+
+
+class _Offer:
+    """Oferta fija en lugar de la base: combinaciones por código y versión."""
+
+    def __init__(self, combinations: Dict[str, List[Any]], version: int = 1) -> None:
+        self.combinations = combinations
+        self.version = version
+        self.queries = 0
+        self.version_reads = 0
+
+    def get_combinations_for_subjects(self, subjects: List[Dict[str, str]]) -> List[Any]:
+        self.queries += 1
+        return [self.combinations[s["code"]] for s in subjects if s["code"] in self.combinations]
+
+    def get_offer_version(self) -> int:
+        self.version_reads += 1
+        return self.version
+
+
+@pytest.fixture
+def client():
+    generation_cache.clear()
+    yield TestClient(main.app)
+    generation_cache.clear()
+
+
+def _serve(
+    monkeypatch: pytest.MonkeyPatch,
+    combinations: Dict[str, List[Any]],
+    version_ttl: float = 60,
+) -> _Offer:
+    offer = _Offer(combinations)
+    monkeypatch.setattr(main.repository, "get_combinations_for_subjects", offer.get_combinations_for_subjects)
+    monkeypatch.setattr(main, "_offer_version", OfferVersion(offer.get_offer_version, version_ttl))
+    return offer
+
+
+def _payload(*codes: str, **extra: Any) -> Dict[str, Any]:
+    return {
+        "subjects": [{"code": code, "name": f"Materia {code}"} for code in codes],
+        "filters": {},
+        "creditLimit": 20,
+        **extra,
+    }
+
+
+def _choque() -> Dict[str, List[Any]]:
+    """Dos materias que solo se dictan a la misma hora: ningún horario."""
+    return {
+        "A": [[_record("A", "1", [("Lunes", "07:00 - 08:50")])]],
+        "B": [[_record("B", "2", [("Lunes", "07:00 - 08:50")])]],
+    }
+
+
+def _varias() -> Dict[str, List[Any]]:
+    """Seis horarios posibles; optimizar huecos cambia su orden."""
+    return {
+        "A": [
+            [_record("A", "1", [("Lunes", "07:00 - 08:50")], group_id=1, professor="Ana María Peña")],
+            [_record("A", "2", [("Lunes", "11:00 - 12:50")], group_id=2)],
+            [_record("A", "3", [("Martes", "07:00 - 08:50")], group_id=3)],
+        ],
+        "B": [
+            [_record("B", "4", [("Lunes", "15:00 - 16:50")], group_id=1)],
+            [_record("B", "5", [("Lunes", "09:00 - 10:50")], group_id=2)],
+        ],
+    }
+
+
+def _stream(client: TestClient, payload: Dict[str, Any]) -> Tuple[List[List[str]], Dict[str, Any]]:
+    """NRCs de cada línea de horario del streaming y su línea final."""
+    response = client.post("/api/schedules/generate/stream", json=payload)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["type"] for line in lines] == ["schedule"] * (len(lines) - 1) + ["trailer"]
+    return [[o["nrc"] for o in line["schedule"]] for line in lines[:-1]], lines[-1]
+
+
+def _generate(client: TestClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+    response = client.post("/api/schedules/generate", json=payload)
+    assert response.status_code == 200
+    return response.json()
+
+
+# --- FORMATO NORMALIZADO ---
+
+def test_normalizado_reconstruye_el_formato_completo():
+    a = [
+        [_record("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_record("A", "2", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_record("A", "3", [("Martes", "07:00 - 08:50")], professor="Ana")],
+    ]
+    b = [
+        [_record("B", "4", [("Jueves", "07:00 - 08:50")])],
+        [_record("B", "5", [("Jueves", "07:00 - 08:50")])],
+    ]
+    full, rebuilt = _full_vs_normalized([a, b], {})
+    assert full == [["1", "4", "5", "2"], ["3", "4", "5"]]
+    assert rebuilt == full
+
+
+def test_normalizado_reconstruye_con_codigos_repetidos():
+    """
+    Con un código repetido no se colapsa y la fusión va por firma: el orden de
+    los NRCs alternos sale del orden de los horarios fusionados, no siempre de
+    la última materia a la primera.
+    """
+    # Los créditos impiden (a1, b2): la firma junta (a1, b1), (a2, b1) y
+    # (a2, b2), así que el NRC alterno de A llega antes que el de B.
+    a = [
+        [_record("A", "1", [("Lunes", "07:00 - 08:50")], group_id=1, credits=2)],
+        [_record("A", "2", [("Lunes", "07:00 - 08:50")], group_id=2, credits=1)],
+    ]
+    b = [
+        [_record("B", "3", [("Martes", "07:00 - 08:50")], group_id=1, credits=1)],
+        [_record("B", "4", [("Martes", "07:00 - 08:50")], group_id=2, credits=2)],
+    ]
+    # Otra materia con el mismo código que A.
+    c = [[_record("A", "5", [("Viernes", "07:00 - 08:50")], group_id=9, credits=1, name="Materia A2")]]
+    full, rebuilt = _full_vs_normalized([a, b, c], {"max_credits": 4})
+    assert full == [["1", "3", "5", "2", "4"]]
+    assert rebuilt == full
+
+
+# --- CACHÉ ---
+
+def test_acierto_del_cache_sin_ir_a_la_base(client, monkeypatch):
+    """Repetir la petición no consulta la oferta ni su versión."""
+    offer = _serve(monkeypatch, _varias(), version_ttl=0.2)
+    hits = generation_cache.hits
+    first = _generate(client, _payload("A", "B"))
+    assert _generate(client, _payload("A", "B")) == first
+    assert (offer.queries, offer.version_reads) == (1, 1)
+    assert generation_cache.hits == hits + 1
+
+    # El ETL sube la versión: vencido el plazo de la versión, ya no acierta.
+    offer.version += 1
+    time.sleep(0.3)
+    assert _generate(client, _payload("A", "B")) == first
+    assert (offer.queries, offer.version_reads) == (2, 2)
+
+def test_diagnostico_parcial_no_se_cachea(client, monkeypatch):
+    """Un diagnóstico al que se le venció el plazo no se sirve por 15 minutos."""
+    offer = _serve(monkeypatch, _choque())
+    diagnosis = {
+        "shape": "par_incompatible",
+        "blame": "estructural",
+        "subjects": ["Materia A", "Materia B"],
+        "removalOptions": [],
+        "partial": True,
+    }
+    monkeypatch.setattr(schedule_diagnostics, "diagnose", lambda *args, **kwargs: diagnosis)
+
+    for _ in range(2):
+        body = client.post("/api/schedules/generate", json=_payload("A", "B")).json()
+        assert body["diagnosis"]["partial"] is True
+    assert offer.queries == 2
+
+    # Completo sí se guarda.
+    diagnosis = {**diagnosis, "partial": False}
+    for _ in range(2):
+        client.post("/api/schedules/generate", json=_payload("A", "B"))
+    assert offer.queries == 3
+
+
+# --- STREAMING ---
+
+@pytest.mark.parametrize("filters", [{}, {"optimizeGaps": True}, {"rankBy": ["seats", "gaps"]}])
+def test_streaming_igual_a_generate(client, monkeypatch, filters):
+    """Mismos horarios y mismo orden, por el generador perezoso y por el ranking."""
+    _serve(monkeypatch, _varias())
+    payload = {**_payload("A", "B"), "filters": filters}
+    body = _generate(client, payload)
+    schedules, trailer = _stream(client, payload)
+
+    assert schedules == [[o["nrc"] for o in s] for s in body["schedules"]]
+    assert len(schedules) == 6
+    assert trailer == {"type": "trailer", "truncated": False, "total": 6, "diagnosis": None}
+
+
+def test_streaming_sin_horarios_trae_diagnostico(client, monkeypatch):
+    _serve(monkeypatch, _choque())
+    schedules, trailer = _stream(client, _payload("A", "B"))
+
+    assert schedules == []
+    assert trailer["truncated"] is False
+    assert trailer["total"] == 0
+    assert trailer["diagnosis"] == _generate(client, _payload("A", "B"))["diagnosis"]
+    assert trailer["diagnosis"]["shape"] == "par_incompatible"
+
+
+@pytest.mark.parametrize("filters", [{}, {"optimizeGaps": True}])
+def test_streaming_aplica_el_cap_movil(client, monkeypatch, filters):
+    _serve(monkeypatch, _varias())
+    monkeypatch.setattr(main, "_MAX_SCHEDULES", 4)
+    payload = {**_payload("A", "B"), "filters": filters, "isMobile": True}
+    body = _generate(client, payload)
+    schedules, trailer = _stream(client, payload)
+
+    assert schedules == [[o["nrc"] for o in s] for s in body["schedules"]]
+    assert len(schedules) == 4
+    assert trailer == {"type": "trailer", "truncated": True, "total": None, "diagnosis": None}
+
+    # Justo en el cap: no hay más, así que no se trunca.
+    monkeypatch.setattr(main, "_MAX_SCHEDULES", 6)
+    schedules, trailer = _stream(client, payload)
+    assert len(schedules) == 6
+    assert trailer["truncated"] is False and trailer["total"] == 6
+
+
+def test_streaming_usa_json_compacto(client, monkeypatch):
+    """Las líneas de horario y la final con la misma codificación (UTF-8 compacto)."""
+    _serve(monkeypatch, _choque())
+    trailer = client.post("/api/schedules/generate/stream", json=_payload("A", "B")).content.splitlines()[-1]
+    assert b", " not in trailer and b'": ' not in trailer
+    assert "Materia A".encode("utf-8") in trailer
+
+    _serve(monkeypatch, _varias())
+    first = client.post("/api/schedules/generate/stream", json=_payload("A", "B")).content.splitlines()[0]
+    assert b'"type":"schedule"' in first and "Ana María Peña".encode("utf-8") in first
+
+
+# --- SERIALIZACIÓN ---
+
+def _bytes_de_fastapi(response: Any) -> bytes:
+    """Lo que emitía FastAPI con `response_model` antes de `_json_response`."""
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def test_json_response_identico_byte_a_byte():
+    option = ClassOption(
+        subjectName="Cálculo Diferencial",
+        subjectCode="CBASM01A",
+        type="Teórico",
+        schedules=[{"day": "Miércoles", "time": "07:00 - 08:50"}],
+        professor="José Ñáñez Peña",
+        nrc="1001",
+        groupId=2,
+        credits=3.5,
+        campus="Campus Tecnológico",
+        seatsAvailable=0,
+        seatsMaximum=30,
+    )
+    # Como salen del generador: sin validar y con créditos enteros.
+    record = _record("B", "2002", [("Sábado", "10:00 - 11:50")], professor="Ana María", credits=3)
+    responses = [
+        GenerateScheduleResponse(
+            schedules=[[option, record.to_model()], [option]],
+            truncated=True,
+            total=None,
+            nextCursor="abc.2",
+        ),
+        GenerateScheduleResponse(
+            schedules=[],
+            total=0,
+            diagnosis=ScheduleDiagnosis.model_validate({
+                "shape": "par_incompatible",
+                "blame": "filtros",
+                "subjects": ["Cálculo Diferencial", "Física Mecánica"],
+                "pairs": [["Cálculo Diferencial", "Física Mecánica"]],
+                "blockingFilters": [{"type": "exclude_professors", "target": "Física Mecánica"}],
+                "partial": True,
+            }),
+        ),
+        main._schedules_response(
+            schedule_generator.find_valid_schedules([[[record]]], {}, grouped=True), True, total=1
+        ),
+    ]
+    for response in responses:
+        assert main._json_response(response).body == _bytes_de_fastapi(response)
+
+
+# --- PAGINACIÓN POR CURSOR ---
+
+def test_paginas_estables_y_sin_solapes(client, monkeypatch):
+    _serve(monkeypatch, _varias())
+    payload = {**_payload("A", "B"), "filters": {"optimizeGaps": True}}
+    everything = [[o["nrc"] for o in s] for s in _generate(client, payload)["schedules"]]
+
+    pages = []
+    body = _generate(client, {**payload, "limit": 4})
+    pages.append(body)
+    while body["nextCursor"] is not None:
+        body = _generate(client, {**payload, "cursor": body["nextCursor"], "limit": 4})
+        pages.append(body)
+
+    assert [len(page["schedules"]) for page in pages] == [4, 2]
+    assert [page["total"] for page in pages] == [6, 6]
+    assert [page["truncated"] for page in pages] == [True, False]
+    # La última página: sin cursor siguiente.
+    assert pages[-1]["nextCursor"] is None
+    served = [[o["nrc"] for o in s] for page in pages for s in page["schedules"]]
+    assert served == everything
+
+    # Volver a pedir una página con el mismo cursor da lo mismo.
+    again = _generate(client, {**payload, "cursor": pages[0]["nextCursor"], "limit": 4})
+    assert again == pages[1]
+
+
+def test_cursor_mal_formado_es_400(client, monkeypatch):
+    _serve(monkeypatch, _varias())
+    for cursor in ("sin-posicion", "abc.-1", ".3", "abc.x"):
+        response = client.post("/api/schedules/generate", json={**_payload("A", "B"), "cursor": cursor})
+        assert response.status_code == 400, cursor
+
+
+def test_cursor_desconocido_o_vencido_es_410(client, monkeypatch):
+    _serve(monkeypatch, _varias())
+    response = client.post("/api/schedules/generate", json={**_payload("A", "B"), "cursor": "desconocido.2"})
+    assert response.status_code == 410
+
+    monkeypatch.setattr(main, "schedule_store", ScheduleStore(ttl_seconds=0.05, max_entries=4))
+    cursor = _generate(client, {**_payload("A", "B"), "limit": 2})["nextCursor"]
+    time.sleep(0.1)
+    response = client.post("/api/schedules/generate", json={**_payload("A", "B"), "cursor": cursor})
+    assert response.status_code == 410
+
+
+def test_formato_normalizado_no_pagina(client, monkeypatch):
+    _serve(monkeypatch, _varias())
+    for extra in ({"limit": 2}, {"cursor": "abc.2"}):
+        response = client.post(
+            "/api/schedules/generate",
+            json={**_payload("A", "B"), "responseFormat": "normalized", **extra},
+        )
+        assert response.status_code == 400
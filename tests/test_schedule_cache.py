@@ -0,0 +1,70 @@
+"""
+Pruebas del caché de generación por petición canónica.
+
+La llave debe coincidir para peticiones que dan la misma respuesta (filtros en
+otro orden, filtros vacíos) y cambiar cuando la respuesta puede cambiar (orden
+de materias, versión de la oferta).
+"""
+import itertools
+import time
+
+from backend.app.services.schedule_cache import LruTtlCache, OfferVersion, request_key
+
+SUBJECTS = [{"code": "A", "name": "Materia A"}, {"code": "B", "name": "Materia B"}]
+
+
+def _key(subjects=SUBJECTS, filters=None, credit_limit=20, custom=None, version=1):
+    return request_key(subjects, filters or {}, credit_limit, custom or [], version)
+
+
+def test_llave_canonica_de_filtros():
+    a = {
+        "exclude_professors": {"A|Materia A": ["Ana", "Luis"]},
+        "unavailable_slots": {"Lunes": ["07:00", "08:00"]},
+    }
+    b = {
+        "unavailable_slots": {"lunes": ["08:00", "07:00"]},
+        "exclude_professors": {"A|Materia A": ["Luis", "Ana"]},
+        "optimizeGaps": False,
+        "selected_nrcs": {},
+    }
+    assert _key(filters=a) == _key(filters=b)
+    assert _key(filters=a) != _key(filters={**a, "optimizeGaps": True})
+
+
+def test_llave_respeta_orden_de_criterios():
+    """`rankBy` es una secuencia: otro orden de criterios es otro orden de horarios."""
+    a = {"rankBy": ["seats", "campusHours"], "rankWeights": {"seats": 1, "gaps": 2}}
+    b = {"rankBy": ["campusHours", "seats"], "rankWeights": {"gaps": 2, "seats": 1}}
+    assert _key(filters=a) != _key(filters=b)
+    assert _key(filters=a) == _key(filters={**b, "rankBy": ["seats", "campusHours"]})
+
+
+def test_llave_cambia_con_orden_de_materias_y_version_de_oferta():
+    """El orden de las materias define el orden de los horarios: no se ordena."""
+    assert _key() != _key(subjects=list(reversed(SUBJECTS)))
+    assert _key(version=1) != _key(version=2)
+    assert _key(credit_limit=20) == _key(credit_limit=20.0)
+    assert _key(credit_limit=20) != _key(credit_limit=19.5)
+
+
+def test_lru_cuenta_aciertos_y_fallos():
+    cache: LruTtlCache[str] = LruTtlCache(ttl_seconds=60, max_entries=2)
+    assert cache.get("x") is None
+    cache.put("x", "uno")
+    cache.put("y", "dos")
+    assert cache.get("x") == "uno"
+    cache.put("z", "tres")  # desaloja "y", el menos usado
+
+    assert cache.get("y") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+
+
+def test_version_de_oferta_se_relee_solo_al_vencer():
+    """Un acierto del caché no abre conexión: la versión se lee a lo sumo cada TTL."""
+    reads = itertools.count(1)  # cada lectura devuelve una versión nueva
+    version = OfferVersion(lambda: next(reads), ttl_seconds=0.05)
+    assert [version.get(), version.get(), version.get()] == [1, 1, 1]
+    time.sleep(0.1)
+    assert version.get() == 2
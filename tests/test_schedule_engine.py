@@ -0,0 +1,706 @@
+"""
+Pruebas del motor de búsqueda del generador sobre el modelo compilado.
+
+El generador compila cada petición a enteros (`schedule_compiler`) antes de
+buscar. Estas pruebas fijan que esa compilación no cambia la noción de validez
+ni el orden de los resultados: solapes, exención de misma materia+grupo, horas
+no disponibles y puntaje por huecos.
+"""
+import itertools
+import os
+from typing import List, Tuple
+
+import pytest
+
+from backend.app.models import ClassOption, ClassOptionRecord, ClassSlot, Schedule
+from backend.app.services import schedule_generator
+from backend.app.services.schedule_diagnostics import diagnose
+from backend.app.services.schedule_compiler import compile_problem, parse_range
+from backend.app.services.schedule_generator import (
+    FeasibilityOracle,
+    count_valid_schedules,
+    find_top_schedules,
+    find_valid_schedules,
+    has_any_schedule,
+    iter_valid_schedules,
+    pair_has_support,
+    prepare_filters,
+)
+
+
+# --- FUNCIONES DE AYUDA ---
+
+def _opt(
+    code: str,
+    nrc: str,
+    blocks: List[Tuple[str, str]],
+    group_id: int = 1,
+    professor: str = "Docente",
+    type: str = "Teorico-practico",
+    credits: float = 3,
+) -> ClassOption:
+    """Una opción de clase con los bloques (día, 'HH:MM - HH:MM') dados."""
+    return ClassOption(
+        subjectCode=code,
+        subjectName=f"Materia {code}",
+        credits=credits,
+        type=type,
+        professor=professor,
+        nrc=nrc,
+        groupId=group_id,
+        schedules=[Schedule(day=d, time=t) for d, t in blocks],
+        campus="Campus Tecnológico",
+        seatsAvailable=10,
+        seatsMaximum=30,
+    )
+
+
+def _nrcs(schedules: List[List[ClassOption]]) -> List[List[str]]:
+    return [[o.nrc for o in s] for s in schedules]
+
+
+# --- Compilación ---
+
+def test_parse_range_a_minutos():
+    assert parse_range("07:00 - 08:50") == (420, 530)
+    assert parse_range("13:30 - 14:20") == (810, 860)
+
+
+def test_compilacion_conserva_opciones_y_bloques():
+    """Cada grupo compilado conserva sus `ClassOption` y sus bloques en enteros."""
+    teorico = _opt("A", "1", [("Lunes", "07:00 - 08:50")], type="Teórico")
+    lab = _opt("A", "2", [("Martes", "10:00 - 11:50")], type="Laboratorio")
+    problem = compile_problem([[[teorico, lab]]])
+
+    group = problem.levels[0][0]
+    assert group.options == [teorico, lab]
+    assert [problem.day_names[d] for d, _, _ in group.blocks] == ["Lunes", "Martes"]
+    assert [(s, e) for _, s, e in group.blocks] == [(420, 530), (600, 710)]
+
+
+# --- Validez ---
+
+def test_solape_descarta_y_contiguo_no():
+    """Una clase que termina justo cuando empieza la otra no es un cruce."""
+    a = [[_opt("A", "1", [("Lunes", "07:00 - 08:50")])]]
+    contigua = [[_opt("B", "2", [("Lunes", "08:50 - 10:00")])]]
+    cruzada = [[_opt("C", "3", [("Lunes", "08:00 - 09:00")])]]
+
+    assert len(find_valid_schedules([a, contigua], {})) == 1
+    assert find_valid_schedules([a, cruzada], {}) == []
+    assert not has_any_schedule([a, cruzada], {})
+
+
+def test_misma_materia_y_grupo_no_choca():
+    """Teórico y laboratorio del mismo grupo pueden compartir franja."""
+    teorico = _opt("A", "1", [("Lunes", "07:00 - 08:50")], type="Teórico")
+    lab = _opt("A", "2", [("Lunes", "08:00 - 09:50")], type="Laboratorio")
+    otra = [[_opt("B", "3", [("Martes", "07:00 - 08:50")])]]
+
+    assert _nrcs(find_valid_schedules([[[teorico, lab]], otra], {})) == [["1", "2", "3"]]
+
+
+def test_hora_no_disponible_sin_distinguir_mayusculas():
+    """La hora bloqueada cae dentro de [inicio, fin) de la clase."""
+    combos = [[
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "2", [("Martes", "07:00 - 08:50")])],
+    ]]
+    result = find_valid_schedules(combos, {"unavailable_slots": {"lunes": ["08:00"]}})
+    assert _nrcs(result) == [["2"]]
+
+    # El fin es exclusivo: a las 08:50 la clase ya terminó.
+    result = find_valid_schedules(combos, {"unavailable_slots": {"LUNES": ["08:50"]}})
+    assert _nrcs(result) == [["1"], ["2"]]
+
+
+def test_optimizar_huecos_ordena_por_menos_huecos():
+    """Con `optimizeGaps` primero va el horario con menos horas muertas."""
+    a = [[_opt("A", "1", [("Lunes", "07:00 - 08:00")])]]
+    b = [
+        [_opt("B", "2", [("Lunes", "12:00 - 13:00")])],  # 4 h de hueco
+        [_opt("B", "3", [("Lunes", "09:00 - 10:00")])],  # 1 h de hueco
+    ]
+    result = find_valid_schedules([a, b], {"optimizeGaps": True})
+    assert _nrcs(result) == [["1", "3"], ["1", "2"]]
+
+
+def test_mascara_exacta_con_minutos_irregulares():
+    """La franja de la máscara es el MCD de los minutos: no hay falsos cruces."""
+    a = [[_opt("A", "1", [("Lunes", "07:03 - 08:47")])]]
+    contigua = [[_opt("B", "2", [("Lunes", "08:47 - 09:00")])]]
+    cruzada = [[_opt("C", "3", [("Lunes", "08:46 - 09:00")])]]
+
+    assert compile_problem([a, contigua]).slot_minutes == 1
+    assert len(find_valid_schedules([a, contigua], {})) == 1
+    assert find_valid_schedules([a, cruzada], {}) == []
+
+
+def test_mascaras_no_cruzan_dias():
+    """Una clase que llega a medianoche no invade el día siguiente."""
+    a = [[_opt("A", "1", [("Lunes", "22:00 - 24:00")])]]
+    b = [[_opt("B", "2", [("Martes", "00:00 - 01:00")])]]
+    assert len(find_valid_schedules([a, b], {})) == 1
+
+
+def test_matriz_de_compatibilidad():
+    """La fila de un grupo tiene los grupos de otras materias que no chocan con él."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "2", [("Martes", "07:00 - 08:50")])],
+    ]
+    b = [[_opt("B", "3", [("Lunes", "08:00 - 09:50")])]]
+    problem = compile_problem([a, b])
+    a1, a2 = problem.levels[0]
+    (b1,) = problem.levels[1]
+
+    assert problem.compat[a1.id] == 0
+    assert problem.compat[a2.id] == 1 << b1.id
+    assert problem.compat[b1.id] == 1 << a2.id
+
+
+def test_propagacion_no_cambia_resultados():
+    """Forward checking y AC-3 solo podan subárboles sin horarios válidos."""
+    # Palomar: tres materias que solo caben en dos franjas, más una libre.
+    franjas = [("Lunes", "07:00 - 08:50"), ("Martes", "07:00 - 08:50")]
+    combos = [
+        [[_opt(code, f"{code}{k}", [franja])] for k, franja in enumerate(franjas)]
+        for code in ("A", "B", "C")
+    ]
+    libre = [[_opt("D", "D0", [("Viernes", "07:00 - 08:50")])]]
+
+    assert find_valid_schedules(combos + [libre], {}) == []
+    assert not has_any_schedule([libre] + combos, {})
+
+    dos = combos[:2] + [libre]
+    assert _nrcs(find_valid_schedules(dos, {})) == _nrcs(
+        find_valid_schedules(dos, {}, propagate=False)
+    )
+    assert _nrcs(find_valid_schedules(dos, {})) == [["A0", "B1", "D0"], ["A1", "B0", "D0"]]
+
+
+def test_cota_de_creditos_anticipada():
+    """Si lo más barato de lo que falta ya no cabe, no hay horario."""
+    a = [[_opt("A", "1", [("Lunes", "07:00 - 08:50")], credits=4)]]
+    b = [[_opt("B", "2", [("Martes", "07:00 - 08:50")], credits=4)]]
+    assert not has_any_schedule([a, b], {"max_credits": 7})
+    assert has_any_schedule([a, b], {"max_credits": 8})
+
+
+def test_orden_canonico_con_mrv():
+    """
+    MRV explora primero la materia más restringida, pero la respuesta sale en
+    el orden de siempre: materia por materia, cada una en el orden de sus grupos.
+    """
+    a = [[_opt("A", f"A{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(3)]
+    # B tiene un solo grupo: MRV la elige primero.
+    b = [[_opt("B", "B0", [("Martes", "07:00 - 07:50")])]]
+    c = [[_opt("C", f"C{k}", [("Miércoles", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(2)]
+
+    result = _nrcs(find_valid_schedules([a, b, c], {}))
+    assert result == [
+        [x, "B0", z] for x in ("A0", "A1", "A2") for z in ("C0", "C1")
+    ]
+
+
+# --- Filtros como poda de dominios ---
+
+def test_filtros_podan_dominios_antes_de_buscar():
+    """NRCs, profesores y horas se aplican grupo por grupo al compilar."""
+    combos = [
+        [
+            [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+            [_opt("A", "2", [("Martes", "07:00 - 08:50")], professor="Luis")],
+            [_opt("A", "3", [("Jueves", "07:00 - 08:50")], professor="Ana")],
+        ],
+        [[_opt("B", "4", [("Viernes", "07:00 - 08:50")])]],
+    ]
+    filters = {
+        "include_professors": {"A|Materia A": ["ana"]},
+        "unavailable_slots": {"Jueves": ["07:00"]},
+    }
+    problem = compile_problem(combos)
+    compiled, _ = prepare_filters(problem, filters)
+    a1 = problem.levels[0][0]
+    (b,) = problem.levels[1]
+
+    assert compiled.domains == [1 << a1.id, 1 << b.id]
+    assert _nrcs(find_valid_schedules(combos, filters)) == [["1", "4"]]
+
+
+def test_incluir_profesor_en_materia_repetida():
+    """Si la materia ocupa dos niveles, basta con que uno tenga al profesor."""
+    teoricos = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "2", [("Martes", "07:00 - 08:50")], professor="Luis")],
+    ]
+    labs = [
+        [_opt("A", "3", [("Miércoles", "07:00 - 08:50")], group_id=2, professor="Luis")],
+    ]
+    result = find_valid_schedules([teoricos, labs], {"include_professors": {"A|Materia A": ["Ana"]}})
+    assert _nrcs(result) == [["1", "3"]]
+
+
+# --- Colapso de grupos equivalentes ---
+
+def test_secciones_paralelas_se_colapsan_antes_de_buscar():
+    """Mismo profesor y bloques: un solo nodo de búsqueda y NRCs fusionados en la salida."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "3", [("Martes", "07:00 - 08:50")], professor="Ana")],
+    ]
+    b = [
+        [_opt("B", "4", [("Jueves", "07:00 - 08:50")])],
+        [_opt("B", "5", [("Jueves", "07:00 - 08:50")])],
+    ]
+    problem = compile_problem([a, b])
+    compiled, _ = prepare_filters(problem, {})
+    a1, a2, a3 = problem.levels[0]
+    b1, b2 = problem.levels[1]
+
+    assert compiled.domains == [1 << a1.id | 1 << a3.id, 1 << b1.id]
+    assert compiled.alternatives == {a1.id: [a2], b1.id: [b2]}
+    # La última materia aporta primero sus NRCs alternos, como en la fusión por firma.
+    assert _nrcs(find_valid_schedules([a, b], {})) == [["1", "4", "5", "2"], ["3", "4", "5"]]
+
+
+def test_salida_agrupada_separa_los_grupos_equivalentes():
+    """Con `grouped` cada horario trae sus grupos base y, aparte, sus equivalentes."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "3", [("Martes", "07:00 - 08:50")], professor="Ana")],
+    ]
+    b = [
+        [_opt("B", "4", [("Jueves", "07:00 - 08:50")])],
+        [_opt("B", "5", [("Jueves", "07:00 - 08:50")])],
+    ]
+    grouped = find_valid_schedules([a, b], {}, grouped=True)
+    as_nrcs = [
+        ([[o.nrc for o in g] for g in s.base], [(p, [o.nrc for o in g]) for p, g in s.alternatives])
+        for s in grouped
+    ]
+    # Los equivalentes en el orden de la fusión: de la última materia a la primera.
+    assert as_nrcs == [
+        ([["1"], ["4"]], [(1, ["5"]), (0, ["2"])]),
+        ([["3"], ["4"]], [(1, ["5"])]),
+    ]
+    top, truncated = find_top_schedules([a, b], {}, 1, grouped=True)
+    assert top == grouped[:1] and truncated
+
+
+def test_colapso_respeta_nrcs_seleccionados():
+    """Solo se colapsa lo que quedó dentro del dominio filtrado."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")])],
+    ]
+    result = find_valid_schedules([a], {"selected_nrcs": {"A|Materia A": ["2"]}})
+    assert _nrcs(result) == [["2"]]
+
+
+# --- Top-K ---
+
+def test_top_k_coincide_con_el_orden_completo():
+    """Los K del heap son los primeros K de la lista completa, empates incluidos."""
+    a = [[_opt("A", f"A{k}", [("Lunes", f"{7 + 2 * k:02d}:00 - {8 + 2 * k:02d}:00")])] for k in range(4)]
+    b = [[_opt("B", f"B{k}", [(dia, "10:00 - 11:00")])] for k, dia in enumerate(("Lunes", "Martes", "Lunes"))]
+    c = [[_opt("C", f"C{k}", [("Martes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(3)]
+    combos = [a, b, c]
+
+    for filters in ({}, {"optimizeGaps": True}, {"optimizeFreeDays": True, "optimizeGaps": True}):
+        full = find_valid_schedules(combos, filters)
+        for k in (1, 5, len(full), len(full) + 3):
+            top, truncated = find_top_schedules(combos, filters, k)
+            assert _nrcs(top) == _nrcs(full[:k])
+            assert truncated == (len(full) > k)
+
+
+def test_puntaje_en_bloque_igual_al_calculo_por_horario():
+    """El puntaje por máscaras da lo mismo, también con traslapes, bloques vacíos y días en minúscula."""
+    a = [
+        [_opt("A", "A1", [("Lunes", "07:00 - 08:50"), ("Martes", "07:00 - 08:00")])],
+        [_opt("A", "A2", [("lunes", "10:00 - 11:30"), ("Jueves", "09:00 - 09:00")])],
+    ]
+    # Teoría y laboratorio del mismo grupo que se traslapan (misma llave).
+    b = [
+        [_opt("B", "B1", [("Lunes", "13:00 - 14:50")]), _opt("B", "B2", [("Lunes", "14:00 - 15:00")])],
+        [_opt("B", "B3", [("Martes", "11:10 - 12:00")])],
+    ]
+    c = [[_opt("C", f"C{k}", [("Lunes", f"{16 + k:02d}:00 - {16 + k:02d}:50")])] for k in range(3)]
+    combos = [a, b, c]
+
+    for filters in ({"optimizeGaps": True}, {"optimizeFreeDays": True},
+                    {"optimizeFreeDays": True, "optimizeGaps": True}):
+        problem, compiled, filters = schedule_generator._prepare(combos, filters)
+        score = schedule_generator._schedule_scorer(problem, filters)
+        schedules = [list(s) for s in itertools.product(*problem.levels)]
+        for schedule in schedules:
+            assert score(schedule) == schedule_generator._calculate_schedule_score(
+                schedule, problem, filters
+            )
+        esperado = sorted(
+            range(len(schedules)),
+            key=lambda i: schedule_generator._calculate_schedule_score(schedules[i], problem, filters),
+            reverse=True,
+        )
+        assert schedule_generator._score_order(schedules, problem, filters) == esperado
+
+
+def test_criterios_con_nombre_lexicograficos_y_ponderados():
+    """`rankBy` ordena por criterios en secuencia y `rankWeights` por suma ponderada."""
+    a = [
+        [_opt("A", "A1", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "A2", [("Lunes", "10:00 - 11:50")]).model_copy(update={"seats_available": 3})],
+    ]
+    b = [
+        [_opt("B", "B1", [("Lunes", "12:00 - 13:50")])],
+        [_opt("B", "B2", [("Martes", "14:00 - 15:50")])],
+    ]
+    combos = [a, b]
+    casos = [
+        ({"rankBy": ["earliestStart"]}, [["A2", "B1"], ["A2", "B2"], ["A1", "B1"], ["A1", "B2"]]),
+        ({"rankBy": ["campusHours"]}, [["A1", "B2"], ["A2", "B2"], ["A2", "B1"], ["A1", "B1"]]),
+        ({"rankBy": ["classesPerDay", "earliestStart"]},
+         [["A2", "B2"], ["A1", "B2"], ["A2", "B1"], ["A1", "B1"]]),
+        ({"rankWeights": {"seats": 1}}, [["A1", "B1"], ["A1", "B2"], ["A2", "B1"], ["A2", "B2"]]),
+        ({"rankWeights": {"earliestStart": 1, "latestEnd": 1}, "rankBy": ["seats"]},
+         [["A2", "B1"], ["A2", "B2"], ["A1", "B1"], ["A1", "B2"]]),
+    ]
+    for filters, esperado in casos:
+        assert _nrcs(find_valid_schedules(combos, filters)) == esperado
+        for k in (1, 2, 3):
+            top, truncated = find_top_schedules(combos, filters, k)
+            assert _nrcs(top) == esperado[:k] and truncated
+
+    for invalido in ({"rankBy": ["comodidad"]}, {"rankWeights": {"seats": -1}}, {"rankBy": "seats"}):
+        with pytest.raises(ValueError):
+            schedule_generator.parse_ranking(invalido)
+
+
+def test_branch_and_bound_no_pierde_horarios():
+    """La poda por cota de puntaje deja exactamente los mismos K que el orden completo."""
+    dias = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes")
+    combos = [
+        [
+            [_opt(code, f"{code}{k}", [
+                (dias[(s + k) % 5], f"{7 + (s * 3 + k) % 9:02d}:00 - {8 + (s * 3 + k) % 9:02d}:00"),
+                (dias[(s * 2 + k) % 5], f"{13 + k % 4:02d}:00 - {14 + k % 4:02d}:30"),
+            ])]
+            for k in range(5)
+        ]
+        for s, code in enumerate("ABCD")
+    ]
+
+    for filters in ({"optimizeGaps": True}, {"optimizeFreeDays": True},
+                    {"optimizeFreeDays": True, "optimizeGaps": True}):
+        full = find_valid_schedules(combos, filters)
+        assert len(full) > 10
+        for k in (1, 3, 10):
+            top, truncated = find_top_schedules(combos, filters, k)
+            assert _nrcs(top) == _nrcs(full[:k])
+            assert truncated
+
+
+# --- Enumeración perezosa ---
+
+def test_iter_valid_schedules_es_perezoso_y_canonico():
+    """El generador produce en el orden de `find_valid_schedules` y se puede cortar."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")])],
+        [_opt("A", "3", [("Martes", "07:00 - 08:50")])],
+    ]
+    b = [[_opt("B", f"B{k}", [("Jueves", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(3)]
+    combos = [a, b]
+
+    full = find_valid_schedules(combos, {})
+    assert _nrcs(list(iter_valid_schedules(combos, {}))) == _nrcs(full)
+    assert _nrcs(list(itertools.islice(iter_valid_schedules(combos, {}), 2))) == _nrcs(full[:2])
+
+    # Sin fusión sale cada combinación: los equivalentes A1/A2 por separado.
+    sueltos = _nrcs(list(iter_valid_schedules(combos, {}, merge=False)))
+    assert len(sueltos) == 9
+    assert sueltos[:2] == [["1", "B0"], ["2", "B0"]]
+
+
+# --- Oráculo con nogoods ---
+
+def test_oraculo_coincide_con_has_any_schedule_en_subconjuntos():
+    """Las consultas por subconjunto responden lo mismo que compilar cada una aparte."""
+    # Palomar: tres materias para dos franjas, más una que no choca con nadie.
+    a, b, c = (
+        [[_opt(code, f"{code}{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(2)]
+        for code in "ABC"
+    )
+    d = [[_opt("D", "D0", [("Viernes", "07:00 - 07:50")])]]
+    combos = [a, b, c, d]
+    oracle = FeasibilityOracle(combos)
+
+    for filters in ({}, {"max_credits": 6}, {"exclude_professors": {"D|Materia D": ["docente"]}}):
+        for size in range(1, 5):
+            for subset in itertools.combinations(range(4), size):
+                esperado = has_any_schedule([combos[i] for i in subset], filters)
+                assert oracle.has_any(subset, filters) == esperado, (subset, filters)
+
+
+def test_oraculo_aprende_conjuntos_imposibles():
+    """Un conjunto demostrado imposible queda aprendido sin la materia que no influyó."""
+    a, b, c = (
+        [[_opt(code, f"{code}{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(2)]
+        for code in "ABC"
+    )
+    d = [[_opt("D", f"D{k}", [("Viernes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(3)]
+    oracle = FeasibilityOracle([d, a, b, c])
+
+    assert not oracle.has_any(range(4), {})
+    tabla = next(iter(oracle._tables.values()))
+    aprendidos = [{level for level, _ in n.proof} for n in tabla.unconditional]
+    assert {1, 2, 3} in aprendidos
+    assert not oracle.has_any([1, 2, 3], {})
+
+
+def test_oraculo_reusa_respuestas_por_monotonia():
+    """Subconjunto de uno con horario, o superconjunto de uno sin horario: no se busca."""
+    a, b, c = (
+        [[_opt(code, f"{code}{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(2)]
+        for code in "ABC"
+    )
+    d = [[_opt("D", "D0", [("Viernes", "07:00 - 07:50")])]]
+    oracle = FeasibilityOracle([d, a, b, c])
+
+    assert oracle.has_any([0, 1, 2], {})
+    assert not oracle.has_any([1, 2, 3], {})
+    assert oracle.hits == 0
+    assert oracle.has_any([0, 2], {})
+    assert not oracle.has_any([0, 1, 2, 3], {})
+    assert oracle.has_any_many([([1], {}), ([0, 1, 2, 3], {})], workers=2) == [True, False]
+    assert oracle.hits == 4
+    # Otros filtros, otra memoria.
+    assert oracle.has_any([0, 2], {"exclude_professors": {"D|Materia D": ["docente"]}}) is False
+    assert oracle.hits == 4
+
+
+def test_diagnostico_reporta_nucleo_minimo():
+    """Si ninguna materia sola destraba, se nombra el grupo mínimo que no cabe."""
+    def palomar(prefijo, dias):
+        # Tres materias para dos franjas: cualquier par cabe, las tres no.
+        return [
+            [[_opt(f"{prefijo}{s}", f"{prefijo}{s}{k}", [(dia, "07:00 - 08:50")])] for k, dia in enumerate(dias)]
+            for s in range(3)
+        ]
+
+    combos = palomar("A", ["Lunes", "Martes"]) + palomar("B", ["Jueves", "Viernes"])
+    diagnostico = diagnose(combos, {"max_credits": 30})
+
+    assert diagnostico["shape"] == "conjunto_incompatible"
+    assert diagnostico["removalOptions"] == []
+    # Cualquiera de los dos palomares es un núcleo mínimo.
+    assert diagnostico["core"] in (
+        ["Materia A0", "Materia A1", "Materia A2"],
+        ["Materia B0", "Materia B1", "Materia B2"],
+    )
+
+
+def _materia_repetida_con_profesor():
+    """A choca con el teórico de B; B (teórico + lab, dos niveles) exige a Ana; C es libre."""
+    a = [[_opt("A", "A1", [("Lunes", "07:00 - 08:50")])]]
+    teorico = [[_opt("B", "B1", [("Lunes", "07:00 - 08:50")], professor="Ana", type="Teórico")]]
+    lab = [[_opt("B", "B2", [("Martes", "07:00 - 08:50")], professor="Ana", type="Laboratorio")]]
+    c = [[_opt("C", "C1", [("Jueves", "07:00 - 08:50")])]]
+    return [a, teorico, lab, c], {"include_professors": {"B|Materia B": ["ana"]}}
+
+
+def test_diagnostico_filtro_residual_solo_en_materias_presentes():
+    """El filtro de una materia repetida no hace fallar consultas donde esa materia no está."""
+    combos, filters = _materia_repetida_con_profesor()
+    diagnostico = diagnose(combos, filters)
+
+    assert diagnostico["shape"] == "par_incompatible"
+    assert diagnostico["pairs"] == [["Materia A", "Materia B"]]
+    assert diagnostico["removalOptions"] == ["Materia A", "Materia B"]
+
+
+def test_pares_incompatibles_con_filtro_residual():
+    """Un par sin niveles de la materia repetida no se marca incompatible por su filtro."""
+    combos, filters = _materia_repetida_con_profesor()
+    problem = compile_problem(combos)
+    compiled, _ = prepare_filters(problem, filters)
+    sin_soporte = [
+        (i, j)
+        for i, j in itertools.combinations(range(len(combos)), 2)
+        if not pair_has_support(problem, compiled, i, j)
+    ]
+    assert sin_soporte == [(0, 1)]
+
+
+def test_diagnostico_parcial_si_vence_el_plazo():
+    """Sin tiempo, el diagnóstico no inventa: marca `partial` y solo da lo demostrado."""
+    combos = [
+        [[_opt(code, f"{code}{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(2)]
+        for code in "ABC"
+    ]
+    completo = diagnose(combos, {"max_credits": 30})
+    assert not completo["partial"]
+    assert completo["shape"] == "conjunto_incompatible"
+
+    parcial = diagnose(combos, {"max_credits": 30}, time_budget=0)
+    assert parcial["partial"]
+    assert parcial["shape"] == "conjunto_incompatible"
+    assert parcial["removalOptions"] == []
+    assert parcial["core"] == []
+
+
+def test_diagnostico_en_paralelo_igual_a_secuencial():
+    """Repartir las consultas entre procesos no cambia el diagnóstico."""
+    combos = [
+        [[_opt(code, f"{code}{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")], professor=f"P{k}")]
+         for k in range(3)]
+        for code in "ABC"
+    ]
+    # A y B quedan solo con las 7:00: chocan por los filtros.
+    filters = {"max_credits": 30, "exclude_professors": {"A|Materia A": ["p1", "p2"], "B|Materia B": ["p1", "p2"]}}
+    secuencial = diagnose(combos, filters, workers=1)
+    assert diagnose(combos, filters, workers=2) == secuencial
+    assert secuencial["blame"] == "filtros"
+    assert secuencial["blockingFilters"]
+
+
+def test_diagnostico_relajacion_minima_de_filtros():
+    """Si ningún filtro solo destraba, se nombra el par de filtros más chico que sí."""
+    a = [
+        [_opt("A", "A0", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "A1", [("Martes", "07:00 - 08:50")], professor="Beto")],
+    ]
+    b = [[_opt("B", "B0", [("Jueves", "07:00 - 08:50")])]]
+    filters = {
+        "max_credits": 30,
+        "exclude_professors": {"A|Materia A": ["ana", "beto"]},
+        "unavailable_slots": {"Lunes": ["07:00"], "Martes": ["07:00"]},
+    }
+    diagnostico = diagnose([a, b], filters)
+
+    assert diagnostico["shape"] == "materia_sin_opciones"
+    assert diagnostico["blockingFilters"] == []
+    assert diagnostico["relaxation"] == [
+        {"type": "exclude_professors", "target": "Materia A"},
+        {"type": "unavailable_slots", "target": "Lunes"},
+    ]
+    assert not diagnostico["partial"]
+
+# --- Conteo ---
+
+def test_count_valid_schedules_igual_al_largo_de_la_lista():
+    """El conteo da lo mismo que generar y contar, por cualquiera de sus caminos."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "3", [("Martes", "07:00 - 08:50")], professor="Beto")],
+    ]
+    b = [[_opt("B", f"B{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(4)]
+    c = [[_opt("C", f"C{k}", [("Martes", f"{8 + k:02d}:00 - {8 + k:02d}:50")], credits=k + 1)] for k in range(3)]
+    a_repetida = [[_opt("A", "9", [("Jueves", "07:00 - 08:50")], professor="Caro")]]
+
+    casos = [
+        ([a, b, c], {}),
+        ([a, b, c], {"max_credits": 8}),
+        ([a, b, c], {"exclude_professors": {"A|Materia A": ["BETO"]}}),
+        # Materia repetida en dos niveles: filtro residual y fusión por firma.
+        ([a, b, a_repetida], {"include_professors": {"A|Materia A": ["Caro"]}}),
+        ([a, b, a_repetida], {}),
+        ([a, [[_opt("B", "X", [("Lunes", "07:00 - 08:50")])]]], {"selected_nrcs": {"A|Materia A": ["1"]}}),
+    ]
+    for combos, filters in casos:
+        assert count_valid_schedules(combos, filters) == len(find_valid_schedules(combos, filters))
+    assert count_valid_schedules([], {}) == 0
+
+
+# --- Búsqueda en paralelo ---
+
+def _combos_en_paralelo() -> List[List[List[ClassOption]]]:
+    """Cuatro materias de cuatro grupos, en días y horas repartidos."""
+    dias = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes")
+    return [
+        [
+            [_opt(code, f"{code}{k}", [
+                (dias[(s + k) % 5], f"{7 + (s * 3 + k) % 9:02d}:00 - {8 + (s * 3 + k) % 9:02d}:00"),
+            ], professor=f"P{k % 2}")]
+            for k in range(4)
+        ]
+        for s, code in enumerate("ABCD")
+    ]
+
+
+def _romper_pool(workers: int) -> None:
+    """Mata un proceso del pool, como un OOM kill: el pool queda roto."""
+    pool = schedule_generator._get_pool(workers)
+    assert pool.submit(os._exit, 1).exception() is not None
+
+
+def test_busqueda_en_paralelo_igual_a_secuencial(monkeypatch):
+    """Repartir el árbol entre procesos no cambia ni los horarios ni su orden."""
+    monkeypatch.setattr(schedule_generator, "PARALLEL_MIN_SPACE", 0)
+    combos = _combos_en_paralelo()
+
+    for filters in ({}, {"optimizeGaps": True}, {"exclude_professors": {"B|Materia B": ["P1"]}}):
+        secuencial = find_valid_schedules(combos, filters)
+        assert secuencial
+        assert _nrcs(find_valid_schedules(combos, filters, workers=2)) == _nrcs(secuencial)
+
+
+def test_pool_roto_no_tumba_las_peticiones_siguientes(monkeypatch):
+    """Si muere un proceso, la búsqueda y el diagnóstico siguen respondiendo."""
+    monkeypatch.setattr(schedule_generator, "PARALLEL_MIN_SPACE", 0)
+    combos = _combos_en_paralelo()
+    secuencial = _nrcs(find_valid_schedules(combos, {}))
+
+    _romper_pool(2)
+    assert _nrcs(find_valid_schedules(combos, {}, workers=2)) == secuencial
+    # El pool roto se soltó: la siguiente petición vuelve a repartir.
+    assert _nrcs(find_valid_schedules(combos, {}, workers=2)) == secuencial
+    assert schedule_generator._pool is not None
+
+    _romper_pool(2)
+    oracle = FeasibilityOracle(combos)
+    assert oracle.has_any_many([([0, 1], {}), ([0, 1, 2, 3], {})], workers=2) == [True, True]
+
+
+# --- Opciones livianas ---
+
+def _record(option: ClassOption) -> ClassOptionRecord:
+    """La misma opción como la hidrata el repositorio."""
+    return ClassOptionRecord(
+        subject_name=option.subject_name,
+        subject_code=option.subject_code,
+        type=option.type,
+        schedules=[ClassSlot(s.day, s.time) for s in option.schedules],
+        professor=option.professor,
+        nrc=option.nrc,
+        group_id=option.group_id,
+        credits=option.credits,
+        campus=option.campus,
+        seats_available=option.seats_available,
+        seats_maximum=option.seats_maximum,
+    )
+
+
+def test_registros_livianos_dan_los_mismos_horarios():
+    """Con `ClassOptionRecord` el generador da lo mismo, y `to_model` da el mismo JSON."""
+    a = [
+        [_opt("A", "1", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "2", [("Lunes", "07:00 - 08:50")], professor="Ana")],
+        [_opt("A", "3", [("Martes", "07:00 - 08:50")], professor="Beto")],
+    ]
+    b = [[_opt("B", f"B{k}", [("Lunes", f"{7 + k:02d}:00 - {7 + k:02d}:50")])] for k in range(4)]
+    combos = [a, b]
+    registros = [[[_record(o) for o in group] for group in subject] for subject in combos]
+
+    for filters in ({}, {"optimizeGaps": True}, {"exclude_professors": {"A|Materia A": ["beto"]}}):
+        esperado = find_valid_schedules(combos, filters)
+        obtenido = find_valid_schedules(registros, filters)
+        assert [[o.to_model() for o in s] for s in obtenido] == esperado
+
+    registro = registros[0][0][0]
+    assert registro.to_model() is registro.to_model()
+    assert registro.to_model().model_dump(by_alias=True) == a[0][0].model_dump(by_alias=True)
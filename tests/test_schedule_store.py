@@ -0,0 +1,47 @@
+"""
+Pruebas del almacén de resultados para la paginación por cursor.
+
+Las páginas siguientes de `/api/schedules/generate` se sirven de
+`schedule_store` sin volver a buscar: estas pruebas fijan que el resultado
+guardado no cambia, que vence a su TTL y que el almacén no crece sin tope.
+"""
+import time
+
+from backend.app.services.schedule_store import ScheduleStore, decode_cursor, encode_cursor
+
+
+def test_guarda_y_devuelve_el_mismo_orden():
+    store = ScheduleStore(ttl_seconds=60, max_entries=4)
+    schedules = [["a"], ["b"], ["c"]]
+    result_id = store.put(schedules)  # type: ignore[arg-type]
+
+    # Mutar la lista original no mueve las páginas ya guardadas.
+    schedules.reverse()
+    assert store.get(result_id) == (["a"], ["b"], ["c"])
+    assert store.get("no-existe") is None
+
+
+def test_vence_por_ttl():
+    store = ScheduleStore(ttl_seconds=0.01, max_entries=4)
+    result_id = store.put([["a"]])  # type: ignore[list-item]
+    time.sleep(0.02)
+    assert store.get(result_id) is None
+
+
+def test_descarta_el_menos_usado_al_llenarse():
+    store = ScheduleStore(ttl_seconds=60, max_entries=2)
+    first = store.put([["a"]])  # type: ignore[list-item]
+    second = store.put([["b"]])  # type: ignore[list-item]
+    store.get(first)  # `first` pasa a ser el más reciente.
+    third = store.put([["c"]])  # type: ignore[list-item]
+
+    assert store.get(second) is None
+    assert store.get(first) is not None
+    assert store.get(third) is not None
+
+
+def test_cursor_opaco_ida_y_vuelta():
+    result_id = ScheduleStore(ttl_seconds=60, max_entries=1).put([])
+    assert decode_cursor(encode_cursor(result_id, 50)) == (result_id, 50)
+    assert decode_cursor("sin-posicion") is None
+    assert decode_cursor("id.-3") is None